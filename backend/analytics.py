@@ -0,0 +1,311 @@
+"""
+Incremental rollups of the Event log and the endpoints that serve them.
+
+Every ``ANALYTICS_INTERVAL`` seconds ``rollup`` folds events newer than its
+watermark into three summary tables: event counts per hour and type,
+``generate`` latency histograms per hour and mode set, and fetch counts per
+run and asset type. Latencies are kept as fixed-bucket histograms so
+percentiles over any time range are merged from the summaries, never read
+from the raw events. Rolled-up events older than ``EVENT_RETENTION_DAYS``
+are appended to monthly gzip JSONL files under ``EVENT_ARCHIVE_DIR`` and
+deleted, so the hot table stays small.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import gzip
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from sqlalchemy import Column, JSON, delete, update
+from sqlmodel import Field, Session, SQLModel, select
+from starlette.concurrency import run_in_threadpool
+
+from config import (
+    ANALYTICS_INTERVAL,
+    EVENT_ARCHIVE_DIR,
+    EVENT_FLUSH_INTERVAL,
+    EVENT_RETENTION_DAYS,
+)
+from dev_tools import API_KEY
+from log_db import Event, engine
+
+router = APIRouter(tags=["analytics"])
+
+# Upper bounds (seconds) of the generate latency histogram; the last bucket is open
+LATENCY_BUCKETS = [0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600]
+BATCH = 5000
+# Events this recent may still be in the write-behind queue of another process
+SETTLE = timedelta(seconds=max(5.0, 5 * EVENT_FLUSH_INTERVAL))
+
+
+class EventCount(SQLModel, table=True):
+    hour: datetime = Field(primary_key=True)
+    type: str = Field(primary_key=True)
+    count: int = 0
+
+
+class GenerateLatency(SQLModel, table=True):
+    hour: datetime = Field(primary_key=True)
+    modes: str = Field(primary_key=True)
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    buckets: list = Field(default_factory=list, sa_column=Column(JSON))
+
+
+class RunFetchCount(SQLModel, table=True):
+    folder: str = Field(primary_key=True)
+    asset_type: str = Field(primary_key=True)
+    count: int = 0
+    last_at: Optional[datetime] = None
+
+
+class RollupState(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    last_event_id: int = 0
+    updated_at: Optional[datetime] = None
+
+
+def _hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _modes(payload: dict) -> str:
+    return ",".join(sorted(m.strip() for m in str(payload.get("modes", "")).split(",") if m.strip()))
+
+
+def _fold(db: Session, events: list[Event]) -> None:
+    rows: dict[tuple, SQLModel] = {}
+
+    def row(model, **key):
+        """The summary row for ``key``, loaded or created once per batch."""
+        k = (model, *key.values())
+        if k not in rows:
+            rows[k] = db.get(model, tuple(key.values())) or model(**key)
+            db.add(rows[k])
+        return rows[k]
+
+    for ev in events:
+        hour = _hour(ev.ts)
+        row(EventCount, hour=hour, type=ev.type).count += 1
+        payload = ev.payload or {}
+
+        if ev.type == "generate" and isinstance(payload.get("latency"), (int, float)):
+            lat = float(payload["latency"])
+            r = row(GenerateLatency, hour=hour, modes=_modes(payload))
+            buckets = list(r.buckets or [0] * (len(LATENCY_BUCKETS) + 1))
+            buckets[bisect.bisect_left(LATENCY_BUCKETS, lat)] += 1
+            r.buckets = buckets  # reassign so the JSON column is marked dirty
+            r.count += 1
+            r.total += lat
+            r.max = max(r.max, lat)
+
+        elif ev.type == "fetch_output" and payload.get("path"):
+            folder = str(payload["path"]).split("/", 1)[0]
+            r = row(RunFetchCount, folder=folder, asset_type=payload.get("asset_type", "other"))
+            r.count += 1
+            r.last_at = max(r.last_at or ev.ts, ev.ts)
+
+
+def rollup(name: str = "events") -> int:
+    """
+    Fold the events past the watermark into the summary tables, in id order
+    up to the first one that has not settled, and return how many were
+    folded. The watermark is an id, so a batch never skips an unsettled event
+    to fold later ones: it would be behind the watermark for good. Each batch
+    first advances the watermark with
+    a conditional update, which also serializes concurrent rollups (other
+    server processes): the loser matches no row and stops.
+    """
+    folded = 0
+    while True:
+        with Session(engine) as db:
+            state = db.get(RollupState, name)
+            if state is None:
+                db.add(RollupState(name=name))
+                db.commit()
+                continue
+            start = state.last_event_id
+            events = db.exec(
+                select(Event).where(Event.id > start).order_by(Event.id).limit(BATCH)
+            ).all()
+            cutoff = datetime.utcnow() - SETTLE
+            settled = next((i for i, ev in enumerate(events) if ev.ts >= cutoff), len(events))
+            events = events[:settled]
+            if not events:
+                return folded
+            claimed = db.execute(
+                update(RollupState)
+                .where(RollupState.name == name, RollupState.last_event_id == start)
+                .values(last_event_id=events[-1].id, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed != 1:
+                db.rollback()
+                return folded
+            _fold(db, events)
+            db.commit()
+            folded += len(events)
+
+
+def archive_events(days: float = EVENT_RETENTION_DAYS, name: str = "events") -> int:
+    """Move rolled-up events older than ``days`` to gzip JSONL files; return the count moved."""
+    if days <= 0:
+        return 0
+    archive_dir = Path(EVENT_ARCHIVE_DIR)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    moved = 0
+    while True:
+        with Session(engine) as db:
+            state = db.get(RollupState, name)
+            if state is None:
+                return moved
+            events = db.exec(
+                select(Event)
+                .where(Event.ts < cutoff, Event.id <= state.last_event_id)
+                .order_by(Event.id)
+                .limit(BATCH)
+            ).all()
+            if not events:
+                return moved
+            by_month: dict[str, list[str]] = {}
+            for ev in events:
+                by_month.setdefault(ev.ts.strftime("%Y-%m"), []).append(json.dumps({
+                    "id": ev.id, "session_id": ev.session_id, "ts": ev.ts.isoformat(),
+                    "type": ev.type, "payload": ev.payload,
+                }, ensure_ascii=False))
+            # Delete first: if another process archived these rows already, nothing is written twice
+            deleted = db.execute(delete(Event).where(Event.id.in_([ev.id for ev in events]))).rowcount
+            if deleted != len(events):
+                db.rollback()
+                return moved
+            # Appending writes another gzip member; readers see one continuous stream
+            for month, lines in by_month.items():
+                with gzip.open(archive_dir / f"events-{month}.jsonl.gz", "at", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            db.commit()
+            moved += len(events)
+
+
+async def rollup_loop() -> None:
+    """Background task of the server: roll up, then archive, every ``ANALYTICS_INTERVAL`` seconds."""
+    while True:
+        try:
+            folded = await run_in_threadpool(rollup)
+            archived = await run_in_threadpool(archive_events)
+            if folded or archived:
+                print(f"📊 rolled up {folded} events, archived {archived}")
+        except Exception as e:
+            print(f"Analytics rollup failed: {e}")
+        await asyncio.sleep(ANALYTICS_INTERVAL)
+
+
+def _check_key(key: str) -> None:
+    if key != API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid key")
+
+
+def _since(hours: float) -> datetime:
+    return _hour(datetime.utcnow() - timedelta(hours=hours))
+
+
+def _percentile(buckets: list[int], count: int, top: float, q: float) -> float | None:
+    """q-th quantile, interpolated linearly inside its histogram bucket and capped at the max seen."""
+    if not count:
+        return None
+    rank, seen = q * count, 0
+    for i, n in enumerate(buckets):
+        if n and seen + n >= rank:
+            lo = LATENCY_BUCKETS[i - 1] if i else 0.0
+            hi = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else top
+            return min(top, lo + (hi - lo) * (rank - seen) / n)
+        seen += n
+    return top
+
+
+@router.get("/analytics/events", include_in_schema=False)
+def event_counts(key: str = Query(...), hours: float = 24, type: str | None = None):
+    """Event counts per hour and type over the last ``hours``."""
+    _check_key(key)
+    with Session(engine) as db:
+        stmt = select(EventCount).where(EventCount.hour >= _since(hours))
+        if type:
+            stmt = stmt.where(EventCount.type == type)
+        rows = db.exec(stmt.order_by(EventCount.hour, EventCount.type)).all()
+    totals: dict[str, int] = {}
+    for r in rows:
+        totals[r.type] = totals.get(r.type, 0) + r.count
+    return {
+        "totals": totals,
+        "hourly": [{"hour": r.hour.isoformat(), "type": r.type, "count": r.count} for r in rows],
+    }
+
+
+@router.get("/analytics/latency", include_in_schema=False)
+def generate_latency(key: str = Query(...), hours: float = 24, modes: str | None = None):
+    """``generate`` latency percentiles per mode set over the last ``hours``."""
+    _check_key(key)
+    with Session(engine) as db:
+        stmt = select(GenerateLatency).where(GenerateLatency.hour >= _since(hours))
+        if modes:
+            stmt = stmt.where(GenerateLatency.modes == _modes({"modes": modes}))
+        rows = db.exec(stmt).all()
+
+    merged: dict[str, dict] = {}
+    for r in rows:
+        m = merged.setdefault(r.modes, {"count": 0, "total": 0.0, "max": 0.0,
+                                        "buckets": [0] * (len(LATENCY_BUCKETS) + 1)})
+        m["count"] += r.count
+        m["total"] += r.total
+        m["max"] = max(m["max"], r.max)
+        m["buckets"] = [a + b for a, b in zip(m["buckets"], r.buckets or [])]
+    return {
+        mode: {
+            "count": m["count"],
+            "mean": m["total"] / m["count"] if m["count"] else None,
+            "p50": _percentile(m["buckets"], m["count"], m["max"], 0.5),
+            "p90": _percentile(m["buckets"], m["count"], m["max"], 0.9),
+            "p99": _percentile(m["buckets"], m["count"], m["max"], 0.99),
+            "max": m["max"],
+            "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["inf"], m["buckets"])),
+        }
+        for mode, m in merged.items()
+    }
+
+
+@router.get("/analytics/fetches", include_in_schema=False)
+def run_fetches(key: str = Query(...), folder: str | None = None, limit: int = Query(100, le=1000)):
+    """Asset fetch counts per run (most recently fetched runs first)."""
+    _check_key(key)
+    with Session(engine) as db:
+        stmt = select(RunFetchCount)
+        if folder:
+            stmt = stmt.where(RunFetchCount.folder == folder)
+        rows = db.exec(stmt.order_by(RunFetchCount.last_at.desc()).limit(limit)).all()
+    runs: dict[str, dict] = {}
+    for r in rows:
+        run = runs.setdefault(r.folder, {"total": 0, "last_at": None, "assets": {}})
+        run["assets"][r.asset_type] = r.count
+        run["total"] += r.count
+        last = r.last_at.isoformat() if r.last_at else None
+        run["last_at"] = max(filter(None, [run["last_at"], last]), default=None)
+    return runs
+
+
+@router.get("/analytics/status", include_in_schema=False)
+def rollup_status(key: str = Query(...)):
+    _check_key(key)
+    with Session(engine) as db:
+        state = db.get(RollupState, "events")
+    return {
+        "last_event_id": state.last_event_id if state else 0,
+        "updated_at": state.updated_at.isoformat() if state and state.updated_at else None,
+        "archive_dir": str(EVENT_ARCHIVE_DIR),
+        "retention_days": EVENT_RETENTION_DAYS,
+    }
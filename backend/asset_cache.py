@@ -0,0 +1,129 @@
+"""
+HTTP caching for files served from ``/output``.
+
+Strong ETags are content hashes, memoized per (inode, size, mtime) so each
+file is hashed once. A matching ``If-None-Match`` gets a 304, and each asset
+kind gets its own Cache-Control. Small text assets are written together with
+gzip (and, when the optional ``brotli`` package is installed, brotli) copies
+by ``write_text_asset`` and served to clients that accept them. Range
+requests and ``If-Range`` are handled by Starlette's ``FileResponse``.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEXT_ASSETS = {"tags.json", "prompt.txt", "lyrics.lrc"}
+# Rewritten in place by /regenerate (or still growing); clients must revalidate.
+MUTABLE_PREFIXES = ("audio.", "prompt.txt", "lyrics.lrc", "events.jsonl", "trace.")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_etags: OrderedDict[tuple, str] = OrderedDict()
+_etags_lock = threading.Lock()
+_ETAG_MEMO = 4096
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_text_asset(path: Path, text: str) -> list[Path]:
+    """
+    Write a text asset, then its compressed copies (newer than the source, so
+    fresh); return the paths written.
+    """
+    data = text.encode("utf-8")
+    written = [path, path.with_name(path.name + ".gz")]
+    _atomic_write(path, data)
+    _atomic_write(written[1], gzip.compress(data, 9, mtime=0))
+    if brotli is not None:
+        written.append(path.with_name(path.name + ".br"))
+        _atomic_write(written[2], brotli.compress(data, quality=11))
+    return written
+
+
+def etag_for(path: Path) -> str:
+    st = path.stat()
+    key = (str(path), st.st_ino, st.st_size, st.st_mtime_ns)
+    with _etags_lock:
+        if key in _etags:
+            _etags.move_to_end(key)
+            return _etags[key]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    etag = f'"{h.hexdigest()[:32]}"'
+
+    with _etags_lock:
+        _etags[key] = etag
+        while len(_etags) > _ETAG_MEMO:
+            _etags.popitem(last=False)
+    return etag
+
+
+def not_modified(if_none_match: str | None, etag: str) -> bool:
+    """Weak comparison, as RFC 9110 prescribes for If-None-Match."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+def cache_control(subpath: str) -> str:
+    name = subpath.rsplit("/", 1)[-1].lower()
+    if "/" not in subpath and name.startswith(MUTABLE_PREFIXES):
+        return REVALIDATE
+    return IMMUTABLE
+
+
+def pick_encoding(path: Path, accept_encoding: str, exists=None) -> tuple[Path, str | None]:
+    """
+    Precompressed copy of a text asset the client accepts, if it is up to
+    date. ``exists`` checks a copy somewhere else than on local disk (a
+    remote store, where copies are replaced together with the source).
+    """
+    if path.name not in TEXT_ASSETS:
+        return path, None
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, *params = [p.strip() for p in item.split(";")]
+        if not any(p.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for p in params):
+            accepted.add(coding.lower())
+    for encoding, suffix in ENCODINGS:
+        if encoding not in accepted:
+            continue
+        cp = path.with_name(path.name + suffix)
+        if exists is not None:
+            if exists(cp):
+                return cp, encoding
+            continue
+        try:
+            if cp.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+                return cp, encoding
+        except FileNotFoundError:
+            continue
+    return path, None
@@ -0,0 +1,137 @@
+"""
+Compressed delivery copies of generated songs.
+
+``audio.wav`` is transcoded with ffmpeg into every format in
+``AUDIO_FORMATS`` (Opus, AAC, MP3), written next to it in the run folder,
+and ``fetch`` picks one per request (``negotiate``). Encodes are
+content-addressed under ``uploads/derived``, so a repeated WAV such as the
+mock song is only encoded once. Each encode is its own ffmpeg process, so
+they run in parallel and never hold the GIL or the event loop. Without
+ffmpeg on PATH only the WAV is served, as before.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from uuid import uuid4
+
+from blob_store import digest_of, link_into
+from config import AUDIO_FORMATS, FFMPEG_BIN
+from derivatives import DERIVED_DIR
+
+# name -> (file extension, media type, ffmpeg muxer, encoder args)
+FORMATS = {
+    "opus": ("opus", "audio/ogg", "ogg", ["-c:a", "libopus", "-b:a", "96k"]),
+    "aac": ("m4a", "audio/mp4", "mp4", ["-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart"]),
+    "mp3": ("mp3", "audio/mpeg", "mp3", ["-c:a", "libmp3lame", "-b:a", "128k"]),
+}
+ENABLED = [f for f in (s.strip() for s in AUDIO_FORMATS.split(",")) if f in FORMATS]
+FFMPEG = shutil.which(FFMPEG_BIN)
+
+
+def delivery_path(wav: Path, fmt: str) -> Path:
+    return wav.with_suffix(f".{FORMATS[fmt][0]}")
+
+
+def _store(digest: str, fmt: str) -> Path:
+    return DERIVED_DIR / f"{digest}-{fmt}.{FORMATS[fmt][0]}"
+
+
+def _cmd(src: Path, dest: Path, fmt: str) -> list[str]:
+    _, _, muxer, args = FORMATS[fmt]
+    return [FFMPEG, "-nostdin", "-loglevel", "error", "-y", "-i", str(src), "-vn", *args, "-f", muxer, str(dest)]
+
+
+def _pending(wav: Path) -> tuple[str, list[str]]:
+    """Content digest of ``wav`` and the enabled formats not yet encoded for it."""
+    digest = digest_of(wav)
+    return digest, [f for f in ENABLED if not _store(digest, f).exists()]
+
+
+def _publish(wav: Path, digest: str, encoded: dict[str, Path]) -> list[str]:
+    """Move finished encodes into the store and link every available one next to ``wav``."""
+    for fmt, tmp in encoded.items():
+        os.replace(tmp, _store(digest, fmt))
+    ready = []
+    for fmt in ENABLED:
+        store = _store(digest, fmt)
+        if store.exists():
+            link_into(store, wav.parent, delivery_path(wav, fmt).name)
+            ready.append(fmt)
+    return ready
+
+
+def _tmp(digest: str, fmt: str) -> Path:
+    return DERIVED_DIR / f".{digest}-{fmt}.{uuid4().hex[:8]}.part"
+
+
+def transcode(wav: str | Path) -> list[str]:
+    """Encode ``wav`` into every enabled format (in parallel); return the formats now available."""
+    wav = Path(wav)
+    if FFMPEG is None or not ENABLED:
+        return []
+    digest, todo = _pending(wav)
+    DERIVED_DIR.mkdir(parents=True, exist_ok=True)
+    tmps = {f: _tmp(digest, f) for f in todo}
+    procs = {f: subprocess.Popen(_cmd(wav, tmps[f], f)) for f in todo}
+    encoded = {}
+    for fmt, proc in procs.items():
+        if proc.wait() == 0:
+            encoded[fmt] = tmps[fmt]
+        else:
+            print(f"Transcoding {wav} to {fmt} failed (ffmpeg exit {proc.returncode})")
+            tmps[fmt].unlink(missing_ok=True)
+    return _publish(wav, digest, encoded)
+
+
+async def atranscode(wav: str | Path) -> list[str]:
+    """Async ``transcode``: waits on the ffmpeg processes without blocking the loop."""
+    wav = Path(wav)
+    if FFMPEG is None or not ENABLED:
+        return []
+    digest, todo = await asyncio.to_thread(_pending, wav)
+    DERIVED_DIR.mkdir(parents=True, exist_ok=True)
+    tmps = {f: _tmp(digest, f) for f in todo}
+    procs = {f: await asyncio.create_subprocess_exec(*_cmd(wav, tmps[f], f)) for f in todo}
+    encoded = {}
+    for fmt, proc in procs.items():
+        if await proc.wait() == 0:
+            encoded[fmt] = tmps[fmt]
+        else:
+            print(f"Transcoding {wav} to {fmt} failed (ffmpeg exit {proc.returncode})")
+            tmps[fmt].unlink(missing_ok=True)
+    return await asyncio.to_thread(_publish, wav, digest, encoded)
+
+
+def _accepted(accept: str) -> list[str]:
+    """Formats named explicitly (not via wildcards) in an Accept header, by q-value."""
+    ranked = []
+    for i, part in enumerate(accept.split(",")):
+        mime, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        for fmt, (_, media_type, _, _) in FORMATS.items():
+            if mime.lower() == media_type and q > 0:
+                ranked.append((-q, i, fmt))
+    return [fmt for _, _, fmt in sorted(ranked)]
+
+
+def negotiate(wav: Path, fmt: str | None, accept: str = "", exists=Path.exists) -> tuple[Path, str]:
+    """
+    Pick the file to serve for a request of ``wav``: the explicit ``fmt``
+    query parameter first, then audio types listed in Accept, else the WAV.
+    """
+    wanted = [fmt] if fmt in FORMATS else _accepted(accept)
+    for f in wanted:
+        p = delivery_path(wav, f)
+        if exists(p):
+            return p, FORMATS[f][1]
+    return wav, "audio/wav"
@@ -0,0 +1,106 @@
+"""
+Content-addressed store for uploaded files.
+
+Uploads are streamed into ``uploads/blobs/<aa>/<sha256><ext>`` while being
+hashed, so identical uploads share one file and concurrent uploads with the
+same filename never clobber each other. Run folders hardlink the blob and
+record it in ``source.json`` instead of copying it.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+UPLOAD_DIR = Path(__file__).parent / "uploads"
+BLOB_DIR = UPLOAD_DIR / "blobs"
+MANIFEST = "source.json"
+CHUNK_SIZE = 1 << 20
+
+_HEX64 = re.compile(r"^[0-9a-f]{64}$")
+
+
+def blob_path(digest: str, suffix: str = "") -> Path:
+    return BLOB_DIR / digest[:2] / f"{digest}{suffix.lower()}"
+
+
+def save_stream(fileobj: BinaryIO, filename: str = "") -> Path:
+    """Copy ``fileobj`` into the store, hashing as it goes; return the blob path."""
+    BLOB_DIR.mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=BLOB_DIR, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := fileobj.read(CHUNK_SIZE):
+                h.update(chunk)
+                out.write(chunk)
+        dest = blob_path(h.hexdigest(), Path(filename).suffix)
+        if dest.exists():
+            os.unlink(tmp)
+            os.utime(dest)  # keep recently re-uploaded blobs warm
+        else:
+            dest.parent.mkdir(exist_ok=True)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return dest
+
+
+def digest_of(path: str | Path) -> str:
+    """SHA-256 of a file; free for blobs, whose name already is the digest."""
+    p = Path(path)
+    stem = p.name.split(".", 1)[0]
+    if _HEX64.match(stem):
+        return stem
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def link_into(src: str | Path, out_dir: Path, name: str | None = None) -> Path:
+    """Hardlink ``src`` into ``out_dir`` (copying across devices); idempotent."""
+    src = Path(src)
+    dest = out_dir / (name or src.name)
+    if dest.exists():
+        return dest
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        pass
+    except OSError:
+        # A private temp name: concurrent copies of the same file never share one
+        fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=f".{dest.name}.")
+        os.close(fd)
+        try:
+            shutil.copy2(src, tmp)
+            os.replace(tmp, dest)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    return dest
+
+
+def write_manifest(out_dir: Path, **sources: tuple[Path, str] | None) -> None:
+    """Record which blobs a run was built from, e.g. ``image=(blob, filename)``."""
+    manifest = {}
+    for role, entry in sources.items():
+        if entry is None:
+            continue
+        blob, filename = entry
+        manifest[role] = {
+            "sha256": digest_of(blob),
+            "blob": str(Path(blob).relative_to(UPLOAD_DIR)),
+            "filename": filename,
+        }
+    with open(out_dir / MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,256 @@
+"""
+Small persistent key/value caches.
+
+``SQLiteCache`` keeps text values in a SQLite file with per-entry TTL and
+evicts least-recently-used entries once the stored values exceed
+``max_bytes``. ``NullCache`` has the same interface and never stores
+anything, for when caching is switched off. ``FileCache`` keeps binary
+payloads as content-addressed files under a directory, indexed by key in
+SQLite, so callers can hardlink hits instead of copying them.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+class NullCache:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> str | None:
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"enabled": False, "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteCache(NullCache):
+    def __init__(self, path: str | Path, max_bytes: int, ttl: float):
+        super().__init__()
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self) -> sqlite3.Connection:
+        # Opened lazily so the cache can be created before worker processes fork.
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    db.commit()
+                self.misses += 1
+                return None
+            db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + (ttl or self.ttl), now),
+            )
+            self._evict(db, now)
+            db.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        db.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims = []
+        for key, size in db.execute("SELECT key, size FROM cache ORDER BY accessed_at"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        db.executemany("DELETE FROM cache WHERE key = ?", victims)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._db().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache"
+            ).fetchone()
+        return {
+            "enabled": True,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class FileCache:
+    """
+    Content-addressed file cache: ``put(key, data, suffix)`` stores the bytes
+    as ``<root>/<sha[:2]>/<sha><suffix>`` and ``get(key)`` returns that path.
+    Several keys may share one file. Least-recently-used keys are dropped once
+    the files exceed ``max_bytes``; files are unlinked when no key refers to
+    them, which leaves hardlinked copies elsewhere intact.
+    """
+
+    def __init__(self, root: str | Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.root / "index.db", timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " key TEXT PRIMARY KEY, name TEXT NOT NULL, size INTEGER NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS files_name ON files (name)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _path(self, name: str) -> Path:
+        return self.root / name[:2] / name
+
+    def get(self, key: str) -> Path | None:
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT name FROM files WHERE key = ?", (key,)).fetchone()
+            path = self._path(row[0]) if row else None
+            if path is None or not path.exists():
+                if row is not None:
+                    db.execute("DELETE FROM files WHERE key = ?", (key,))
+                    db.commit()
+                self.misses += 1
+                return None
+            db.execute("UPDATE files SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+            self.hits += 1
+            return path
+
+    def put(self, key: str, data: bytes, suffix: str = "") -> Path:
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".put-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return self.put_file(key, tmp, suffix)
+
+    def put_file(self, key: str, src: str | Path, suffix: str = "") -> Path:
+        """Move ``src`` (on the same filesystem as ``root``) into the cache."""
+        h = hashlib.sha256()
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        name = h.hexdigest() + suffix
+        path = self._path(name)
+        size = os.path.getsize(src)
+        if path.exists():
+            os.unlink(src)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(src, 0o644)
+            os.replace(src, path)
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO files (key, name, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, name, size, time.time()),
+            )
+            self._evict(db, keep=name)
+            db.commit()
+        return path
+
+    def _evict(self, db: sqlite3.Connection, keep: str) -> None:
+        # Size is counted per distinct file, not per key.
+        total = db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT name, size FROM files)"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, name, size in db.execute(
+            "SELECT key, name, size FROM files WHERE name != ? ORDER BY accessed_at", (keep,)
+        ).fetchall():
+            db.execute("DELETE FROM files WHERE key = ?", (key,))
+            if db.execute("SELECT 1 FROM files WHERE name = ?", (name,)).fetchone() is None:
+                self._path(name).unlink(missing_ok=True)
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, files, total = self._db().execute(
+                "SELECT COUNT(*), COUNT(DISTINCT name),"
+                " (SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT name, size FROM files))"
+                " FROM files"
+            ).fetchone()
+        return {
+            "enabled": True,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "files": files,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
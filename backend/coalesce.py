@@ -0,0 +1,116 @@
+"""
+Single-flight for identical concurrent generations.
+
+``/generate`` requests with the same key (image and audio content hashes,
+language, modes, ``fresh``) that arrive while one is in flight in this
+process attach to it instead of repeating its LLM and SerpAPI calls. Every
+request still gets its own run folder: the leader's tags and images are
+hardlinked into the followers' folders (``mirror_assets``).
+
+Music is shared through the job queue, across processes: a music job
+enqueued while an identical one is in flight follows it, and the finished
+prompt, lyrics and audio are linked into every follower's folder
+(``mirror_music``). Compressed copies of the song, encoded after the job
+finished, are linked in when they are ready (``jobs.mirror_encodes``).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import metrics
+import storage
+from blob_store import digest_of, link_into
+from run_events import emit
+
+TAGS_ASSETS = ("tags.json*",)
+IMAGE_ASSETS = ("images/**/*",)
+MUSIC_ASSETS = ("chords.json", "prompt.txt*", "lyrics.lrc*", "audio.*")
+
+
+def flight_key(
+    image_path: str | Path,
+    audio_path: str | Path | None,
+    language: str,
+    fresh: bool,
+    modes: set[str] | tuple[str, ...],
+) -> str:
+    parts = [
+        digest_of(image_path),
+        digest_of(audio_path) if audio_path else "",
+        language,
+        ",".join(sorted(modes)),
+        "fresh" if fresh else "",
+    ]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:32]
+
+
+class SingleFlight:
+    """Computations in flight by key; the first caller leads, later ones share its result."""
+
+    def __init__(self):
+        self.flights: dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """
+        ``(result, led)``: the result of the identical call already in flight,
+        or of ``fn()`` if there is none (or it failed).
+        """
+        fut = self.flights.get(key)
+        if fut is not None:
+            try:
+                result = await asyncio.shield(fut)
+                metrics.inc("coalesced_total", stage="generate")
+                return result, False
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise  # this request was cancelled, not the leader
+            except Exception:
+                pass  # the leader failed; try on our own
+            return await fn(), True
+
+        fut = asyncio.get_running_loop().create_future()
+        self.flights[key] = fut
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # followers handle it; never "exception was never retrieved"
+            raise
+        else:
+            fut.set_result(result)
+            return result, True
+        finally:
+            del self.flights[key]
+
+
+def mirror_assets(src: Path, dest: Path, patterns: tuple[str, ...]) -> list[Path]:
+    """Hardlink the files of ``src`` matching ``patterns`` into ``dest`` and publish them."""
+    linked = []
+    for pattern in patterns:
+        for fp in src.glob(pattern):
+            if not fp.is_file() or fp.name.startswith("."):
+                continue
+            target = dest / fp.relative_to(src)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            linked.append(link_into(fp, target.parent, target.name))
+    storage.publish(*linked)
+    return linked
+
+
+def mirror_music(src: Path, dest: Path, job_id: str, done: bool, error: str | None = None) -> None:
+    """Give a follower's run the outcome of the music job it followed, with the usual events."""
+    if not done:
+        emit(dest, "audio", "failed", job_id=job_id, error=error)
+        emit(dest, "run", "failed", job_id=job_id, error=error)
+        return
+    names = {p.name for p in mirror_assets(src, dest, MUSIC_ASSETS)}
+    for asset, name in (("chords", "chords.json"), ("prompt", "prompt.txt"), ("lyrics", "lyrics.lrc"), ("audio", "audio.wav")):
+        if name in names:
+            emit(dest, asset, "ready")
+    emit(dest, "run", "done", job_id=job_id)
@@ -11,4 +11,116 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")        # GPT-4.1-mini
 PIAPI_KEY = os.getenv("PIAPI_KEY", "")                  # Udio cloud inference
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY", "")      # SerpAPI for image search
 MUSIC_AI_API_KEY = os.getenv("MUSIC_AI_API_KEY", "")    # Music AI chord transcription
-MUSICAI_CHORD_WORKFLOW = os.getenv("MUSICAI_CHORD_WORKFLOW", "untitled-workflow-1fe2713")
\ No newline at end of file
+MUSICAI_CHORD_WORKFLOW = os.getenv("MUSICAI_CHORD_WORKFLOW", "untitled-workflow-1fe2713")
+
+# Background job queue (music generation runs in worker processes, not the web process)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))                    # 0 = run `python worker.py` separately
+# One pool (workers, Udio poller, retention sweeper) per host: the first server
+# process to start (e.g. of `uvicorn --workers N`) holds this lock and hosts it
+JOB_POOL_LOCK = os.getenv("JOB_POOL_LOCK", os.path.join(os.path.dirname(__file__), "cache", "job_pool.lock"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))    # seconds between empty-queue polls
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))          # claims before a job is marked failed
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))      # running jobs older than this are requeued
+
+# Longest a /runs/{folder}/events stream stays open (seconds)
+EVENTS_STREAM_TIMEOUT = float(os.getenv("EVENTS_STREAM_TIMEOUT", "900"))
+
+# Cache of LLM processor outputs (keyed by image hash, language, prompt and sampling params)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), "cache", "llm_cache.db"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "64"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+
+# Images are downscaled and re-encoded once before being sent to the vision model
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1024"))            # longest side in pixels
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "jpeg").lower()  # jpeg | webp
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
+
+# Shared outbound HTTP client (see http_client.py)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))                  # default read/write timeout (s)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))                      # extra attempts for retryable failures
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))     # pooled connections across all hosts
+HTTP_HOST_CONCURRENCY = int(os.getenv("HTTP_HOST_CONCURRENCY", "16"))   # in-flight requests per host
+HTTP_HOST_LIMITS = os.getenv("HTTP_HOST_LIMITS", "")                    # per-host overrides, e.g. "serpapi.com=4"
+
+# Per-entity image search/download for the images mode
+IMAGE_FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "12"))  # in-flight SerpAPI/image requests, all runs
+IMAGE_STAGE_DEADLINE = float(os.getenv("IMAGE_STAGE_DEADLINE", "15"))      # seconds; images stage returns what it has
+IMAGE_EXTRA_CANDIDATES = int(os.getenv("IMAGE_EXTRA_CANDIDATES", "2"))     # spare candidates downloaded per entity
+
+# Cache of SerpAPI results (keyed by query, engine and page) and of the images they point at
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "True").lower() == "true"
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", os.path.join(os.path.dirname(__file__), "cache", "search_cache.db"))
+SEARCH_CACHE_MAX_MB = float(os.getenv("SEARCH_CACHE_MAX_MB", "32"))
+SEARCH_CACHE_TTL_HOURS = float(os.getenv("SEARCH_CACHE_TTL_HOURS", "72"))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "cache", "images"))
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "512"))  # LRU by last use; run folders hardlink hits
+IMAGE_MAX_BYTES = int(float(os.getenv("IMAGE_MAX_MB", "8")) * 1024 * 1024)  # downloads above this are aborted
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "40000000"))          # width * height read from the header
+
+# WebP derivatives of run images, served via /output/...?variant=<name>
+IMAGE_VARIANTS = os.getenv("IMAGE_VARIANTS", "thumb:320,medium:768")  # name:longest side in pixels
+VARIANT_QUALITY = int(os.getenv("VARIANT_QUALITY", "80"))
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))          # processes rendering derivatives
+
+# Udio (PiAPI) task polling; one shared poller process checks every pending task
+UDIO_EXPECTED_SECONDS = float(os.getenv("UDIO_EXPECTED_SECONDS", "90"))  # initial guess, refined from completed tasks
+UDIO_POLL_MIN = float(os.getenv("UDIO_POLL_MIN", "3"))                   # interval around the expected finish (s)
+UDIO_POLL_MAX = float(os.getenv("UDIO_POLL_MAX", "20"))                  # longest gap between checks (s)
+UDIO_TASK_TIMEOUT = float(os.getenv("UDIO_TASK_TIMEOUT", "375"))         # give up on a task after this long (s)
+UDIO_POLL_BATCH = int(os.getenv("UDIO_POLL_BATCH", "32"))                # most status checks in flight per tick
+
+# Compressed copies of generated songs (needs ffmpeg); fetch negotiates which one to serve
+AUDIO_FORMATS = os.getenv("AUDIO_FORMATS", "opus,aac,mp3")  # any of opus, aac, mp3; empty = WAV only
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+
+# Log/job database (DATABASE_URL). SQLite runs in WAL mode; other URLs get a pooled engine
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "15"))  # seconds to wait for the write lock
+SQLITE_CACHE_MB = float(os.getenv("SQLITE_CACHE_MB", "32"))          # page cache per connection
+SQLITE_MMAP_MB = float(os.getenv("SQLITE_MMAP_MB", "256"))           # memory-mapped I/O; 0 disables
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))                  # persistent connections per process
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))            # extra connections under bursts
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))          # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))          # reconnect after this many seconds
+
+# Write-behind event log: requests enqueue events, a background thread bulk-inserts them
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "200"))          # flush once this many are queued
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0"))  # ...or this many seconds after the first
+EVENT_QUEUE_MAX = int(os.getenv("EVENT_QUEUE_MAX", "10000"))            # events beyond this are dropped
+
+# Known session IDs are cached in memory instead of looked up on every request
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))        # session IDs remembered in memory
+SESSION_TOUCH_INTERVAL = float(os.getenv("SESSION_TOUCH_INTERVAL", "60"))  # seconds between last-seen updates
+
+# Analytics rollups of the event log (see analytics.py)
+ANALYTICS_INTERVAL = float(os.getenv("ANALYTICS_INTERVAL", "300"))    # seconds between rollups
+EVENT_RETENTION_DAYS = float(os.getenv("EVENT_RETENTION_DAYS", "30"))  # older rolled-up events are archived; 0 keeps all
+EVENT_ARCHIVE_DIR = os.getenv("EVENT_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archive"))
+
+# Prometheus metrics at /metrics; each process snapshots its own into METRICS_DIR
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(os.path.dirname(__file__), "cache", "metrics"))
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "5"))  # seconds between snapshots
+
+# Retention of run folders and uploads (a background sweeper process; 0 disables a limit)
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "True").lower() == "true"
+RUN_MAX_AGE_DAYS = float(os.getenv("RUN_MAX_AGE_DAYS", "30"))          # since last fetch (or last write)
+OUTPUT_MAX_GB = float(os.getenv("OUTPUT_MAX_GB", "10"))                # least recently used runs go first
+UPLOAD_MAX_AGE_DAYS = float(os.getenv("UPLOAD_MAX_AGE_DAYS", "30"))    # uploads no run links to any more
+UPLOAD_MAX_GB = float(os.getenv("UPLOAD_MAX_GB", "5"))
+RETENTION_MIN_AGE = float(os.getenv("RETENTION_MIN_AGE", "3600"))      # seconds; newer files are never deleted
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "200"))             # entries examined (or deleted) per step
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "30"))      # seconds between idle steps
+
+# Run asset storage: "local" (the OUTPUT_DIR working folder) or "s3" (AWS S3, MinIO, ...)
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "output"))
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+S3_BUCKET = os.getenv("S3_BUCKET", "omniwizz-output")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None              # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_PREFIX = os.getenv("S3_PREFIX", "")                               # key prefix inside the bucket
+STORAGE_REDIRECT = os.getenv("STORAGE_REDIRECT", "True").lower() == "true"  # /output redirects to presigned URLs
+PRESIGN_TTL = float(os.getenv("PRESIGN_TTL", "3600"))               # seconds a presigned URL stays valid
+
+# Identical concurrent /generate requests share one computation (and one music job)
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "True").lower() == "true"
@@ -0,0 +1,110 @@
+"""
+Size-bounded WebP variants of run images.
+
+Each configured variant (``IMAGE_VARIANTS``, e.g. ``thumb:320``) is rendered
+once per source content into ``uploads/derived/<sha256>-<side>-<q>.webp`` and
+hardlinked into the run as ``<dir>/_<variant>/<stem>.webp``, next to the
+original. Rendering is CPU-bound, so the server hands it to a process pool
+(``arun``); job workers and scripts call the functions directly.
+"""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing as mp
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from blob_store import UPLOAD_DIR, digest_of, link_into
+from config import IMAGE_VARIANTS, VARIANT_QUALITY, DERIVATIVE_WORKERS
+
+DERIVED_DIR = UPLOAD_DIR / "derived"
+SOURCE_EXTS = {"jpg", "jpeg", "png", "gif", "webp"}
+
+
+def _parse_variants(spec: str) -> dict[str, int]:
+    variants = {}
+    for item in spec.split(","):
+        name, _, side = item.partition(":")
+        if name.strip() and side.strip().isdigit():
+            variants[name.strip()] = int(side)
+    return variants
+
+
+VARIANTS = _parse_variants(IMAGE_VARIANTS)
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def variant_path(src: Path, variant: str) -> Path:
+    return src.parent / f"_{variant}" / f"{src.stem}.webp"
+
+
+def _render(src: Path, dest: Path, side: int) -> None:
+    with Image.open(src) as im:
+        # JPEGs decode straight at a reduced scale; a no-op for other formats
+        im.draft("RGB", (side, side))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((side, side), Image.LANCZOS)
+        if im.mode in ("P", "LA"):
+            im = im.convert("RGBA")
+        elif im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGB")
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=".derive-")
+        os.close(fd)
+        try:
+            im.save(tmp, "WEBP", quality=VARIANT_QUALITY, method=4)
+            os.replace(tmp, dest)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def make_variant(src: str | Path, variant: str) -> str:
+    """Render (or reuse) one variant of ``src`` and link it into place; return its path."""
+    src = Path(src)
+    side = VARIANTS[variant]
+    store = DERIVED_DIR / f"{digest_of(src)}-{side}-{VARIANT_QUALITY}.webp"
+    if not store.exists():
+        DERIVED_DIR.mkdir(parents=True, exist_ok=True)
+        _render(src, store, side)
+    dest = variant_path(src, variant)
+    dest.parent.mkdir(exist_ok=True)
+    return str(link_into(store, dest.parent, dest.name))
+
+
+def make_variants(paths: list[str]) -> int:
+    """Every variant of every path; failures are logged and skipped. Returns the count made."""
+    made = 0
+    for p in paths:
+        for variant in VARIANTS:
+            try:
+                make_variant(p, variant)
+                made += 1
+            except Exception as e:
+                print(f"Derivative {variant} failed for {p}: {e}")
+    return made
+
+
+def pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=DERIVATIVE_WORKERS, mp_context=mp.get_context("spawn")
+        )
+    return _pool
+
+
+async def arun(fn, *args):
+    """Run ``fn(*args)`` on the derivative process pool."""
+    return await asyncio.get_running_loop().run_in_executor(pool(), fn, *args)
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -2,6 +2,10 @@ from pathlib import Path
 import os
 from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import FileResponse
+from llm_processors import LLM_CACHE
+from serpapi_module import IMAGE_CACHE, SEARCH_CACHE
+import http_client
+from log_db import db_settings, engine
 
 router = APIRouter(tags=["dev"])
 
@@ -14,8 +18,48 @@ def download_logs(key: str = Query(..., description="API key set in LOG_DOWNLOAD
         raise HTTPException(status_code=403, detail="Invalid key")
     if not DB_PATH.exists():
         raise HTTPException(status_code=404, detail="Log DB not found")
+    if engine.dialect.name == "sqlite":
+        # WAL mode: fold the write-ahead log into the main file first
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
     return FileResponse(
         DB_PATH,
         filename="omni_logs.db",
         media_type="application/x-sqlite3",
-    )
\ No newline at end of file
+    )
+
+
+@router.get("/dev/cache-stats", include_in_schema=False)
+def cache_stats(key: str = Query(..., description="API key set in LOG_DOWNLOAD_KEY")):
+    if key != API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid key")
+    return {
+        "llm": LLM_CACHE.stats(),
+        "search": SEARCH_CACHE.stats(),
+        "images": IMAGE_CACHE.stats() if IMAGE_CACHE is not None else {"enabled": False},
+    }
+
+
+@router.get("/dev/http-stats", include_in_schema=False)
+def http_stats(key: str = Query(..., description="API key set in LOG_DOWNLOAD_KEY")):
+    if key != API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid key")
+    return {"http2": http_client.HTTP2, "hosts": http_client.host_stats()}
+
+
+@router.get("/dev/db-settings", include_in_schema=False)
+def db_settings_report(key: str = Query(..., description="API key set in LOG_DOWNLOAD_KEY")):
+    if key != API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid key")
+    return db_settings()
+
+
+@router.post("/dev/runs/{folder}/pin", include_in_schema=False)
+def pin_run(folder: str, key: str = Query(..., description="API key set in LOG_DOWNLOAD_KEY"), pinned: bool = True):
+    """Protect a run from retention (``pinned=false`` releases it)."""
+    if key != API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid key")
+    from retention import pin  # retention -> analytics imports this module
+
+    pin(folder, pinned)
+    return {"folder": folder, "pinned": pinned}
@@ -0,0 +1,376 @@
+"""
+Shared HTTP client for OpenAI, PiAPI, SerpAPI and Music.AI.
+
+All outbound calls go through one pooled ``httpx.Client`` (keep-alive
+connections per host, HTTP/2 when the optional ``h2`` package is installed)
+with uniform timeouts, jittered retries and a per-host concurrency cap.
+The ``a*`` functions are the same policy on an ``httpx.AsyncClient`` bound
+to the running event loop. Latency and error counts are kept per host; see
+``host_stats()``.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
+
+import httpx
+
+import metrics
+import tracing
+
+from config import (
+    HTTP_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_RETRIES,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_HOST_CONCURRENCY,
+    HTTP_HOST_LIMITS,
+)
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+IDEMPOTENT = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Failures where the request never reached the server; safe to retry any method.
+NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class _HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=512)
+
+    def snapshot(self) -> dict:
+        recent = sorted(self.recent)
+
+        def pct(q):
+            return round(recent[min(len(recent) - 1, int(q * len(recent)))] * 1000, 1) if recent else None
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_ms": round(self.total / self.requests * 1000, 1) if self.requests else None,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+
+_stats: dict[str, _HostStats] = {}
+_stats_lock = threading.Lock()
+_slots: dict[str, threading.BoundedSemaphore] = {}
+_client: httpx.Client | None = None
+_client_pid = None
+_client_lock = threading.Lock()
+# AsyncClients and their semaphores are tied to the loop that created them.
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _host_limits() -> dict[str, int]:
+    limits = {}
+    for item in HTTP_HOST_LIMITS.split(","):
+        host, _, n = item.partition("=")
+        if host.strip() and n.strip().isdigit():
+            limits[host.strip()] = int(n)
+    return limits
+
+
+_LIMITS = _host_limits()
+
+
+def client() -> httpx.Client:
+    global _client, _client_pid
+    with _client_lock:
+        # Connections must not be shared across a fork.
+        if _client is None or _client_pid != os.getpid():
+            _client = httpx.Client(
+                http2=HTTP2,
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=60,
+                ),
+                follow_redirects=True,
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        ac = httpx.AsyncClient(
+            http2=HTTP2,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=60,
+            ),
+            follow_redirects=True,
+        )
+        entry = _async_clients[loop] = (ac, {})
+    return entry[0]
+
+
+def _aslot(host: str) -> asyncio.Semaphore:
+    async_client()
+    slots = _async_clients[asyncio.get_running_loop()][1]
+    if host not in slots:
+        slots[host] = asyncio.Semaphore(_LIMITS.get(host, HTTP_HOST_CONCURRENCY))
+    return slots[host]
+
+
+async def aclose() -> None:
+    """Close the AsyncClient of the running loop (call on app shutdown)."""
+    entry = _async_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[0].aclose()
+
+
+def _slot(host: str) -> threading.BoundedSemaphore:
+    with _stats_lock:
+        if host not in _slots:
+            _slots[host] = threading.BoundedSemaphore(_LIMITS.get(host, HTTP_HOST_CONCURRENCY))
+        return _slots[host]
+
+
+def _record(host: str, elapsed: float, error: bool = False, retry: bool = False) -> None:
+    metrics.observe("http_request_seconds", elapsed, host=host)
+    metrics.inc("http_requests_total", host=host, outcome="error" if error else "ok")
+    tracing.count("http_attempts")
+    if error:
+        tracing.count("http_errors")
+    if retry:
+        metrics.inc("http_retries_total", host=host)
+        tracing.count("http_retries")
+    with _stats_lock:
+        st = _stats.setdefault(host, _HostStats())
+        st.requests += 1
+        st.errors += int(error)
+        st.retries += int(retry)
+        st.total += elapsed
+        st.max = max(st.max, elapsed)
+        st.recent.append(elapsed)
+
+
+def _backoff(attempt: int, res: httpx.Response | None = None) -> float:
+    if res is not None:
+        after = res.headers.get("retry-after", "")
+        if after.isdigit():
+            return min(float(after), BACKOFF_CAP)
+    # full jitter
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _timeout(timeout) -> httpx.Timeout | None:
+    if timeout is None or isinstance(timeout, httpx.Timeout):
+        return timeout
+    return httpx.Timeout(timeout, connect=min(timeout, HTTP_CONNECT_TIMEOUT))
+
+
+def host_stats() -> dict:
+    with _stats_lock:
+        return {host: st.snapshot() for host, st in sorted(_stats.items())}
+
+
+def request(
+    method: str, url: str, *, retries: int | None = None, timeout=None, **kwargs
+) -> httpx.Response:
+    """
+    Send a request through the shared client. Idempotent methods are retried
+    on transport errors and 429/5xx; other methods only when the connection
+    could not be made at all.
+    """
+    method = method.upper()
+    host = httpx.URL(url).host
+    idempotent = method in IDEMPOTENT
+    if retries is None:
+        retries = HTTP_RETRIES
+    kwargs["timeout"] = _timeout(timeout) or client().timeout
+
+    attempt = 0
+    while True:
+        t0 = time.monotonic()
+        res = None
+        try:
+            with _slot(host):
+                res = client().request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            _record(host, time.monotonic() - t0, error=True, retry=attempt > 0)
+            if attempt >= retries or not (idempotent or isinstance(e, NOT_SENT)):
+                raise
+        else:
+            failed = res.status_code in RETRY_STATUS
+            _record(host, time.monotonic() - t0, error=res.status_code >= 500, retry=attempt > 0)
+            if not failed or not idempotent or attempt >= retries:
+                return res
+            res.close()
+        attempt += 1
+        time.sleep(_backoff(attempt, res))
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> httpx.Response:
+    return request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> httpx.Response:
+    return request("PUT", url, **kwargs)
+
+
+@contextmanager
+def stream(
+    method: str, url: str, *, retries: int | None = None, timeout=None, **kwargs
+) -> Iterator[httpx.Response]:
+    """
+    Like ``request`` but yields a response whose body has not been read yet.
+    Retries only happen before the response is handed to the caller.
+    """
+    method = method.upper()
+    host = httpx.URL(url).host
+    idempotent = method in IDEMPOTENT
+    if retries is None:
+        retries = HTTP_RETRIES
+    kwargs["timeout"] = _timeout(timeout) or client().timeout
+
+    attempt = 0
+    while True:
+        t0 = time.monotonic()
+        res = None
+        yielded = False
+        try:
+            with _slot(host), client().stream(method, url, **kwargs) as res:
+                failed = res.status_code in RETRY_STATUS
+                if not failed or not idempotent or attempt >= retries:
+                    yielded = True
+                    try:
+                        yield res
+                    finally:
+                        _record(
+                            host,
+                            time.monotonic() - t0,
+                            error=res.status_code >= 500,
+                            retry=attempt > 0,
+                        )
+                    return
+                _record(host, time.monotonic() - t0, error=True, retry=attempt > 0)
+        except httpx.TransportError as e:
+            if yielded:
+                raise
+            _record(host, time.monotonic() - t0, error=True, retry=attempt > 0)
+            if attempt >= retries or not (idempotent or isinstance(e, NOT_SENT)):
+                raise
+        attempt += 1
+        time.sleep(_backoff(attempt, res))
+
+
+async def arequest(
+    method: str, url: str, *, retries: int | None = None, timeout=None, **kwargs
+) -> httpx.Response:
+    """Async ``request`` with the same retry and concurrency policy."""
+    method = method.upper()
+    host = httpx.URL(url).host
+    idempotent = method in IDEMPOTENT
+    if retries is None:
+        retries = HTTP_RETRIES
+    kwargs["timeout"] = _timeout(timeout) or async_client().timeout
+
+    attempt = 0
+    while True:
+        t0 = time.monotonic()
+        res = None
+        try:
+            async with _aslot(host):
+                res = await async_client().request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            _record(host, time.monotonic() - t0, error=True, retry=attempt > 0)
+            if attempt >= retries or not (idempotent or isinstance(e, NOT_SENT)):
+                raise
+        else:
+            failed = res.status_code in RETRY_STATUS
+            _record(host, time.monotonic() - t0, error=res.status_code >= 500, retry=attempt > 0)
+            if not failed or not idempotent or attempt >= retries:
+                return res
+            await res.aclose()
+        attempt += 1
+        await asyncio.sleep(_backoff(attempt, res))
+
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await arequest("POST", url, **kwargs)
+
+
+async def aput(url: str, **kwargs) -> httpx.Response:
+    return await arequest("PUT", url, **kwargs)
+
+
+@asynccontextmanager
+async def astream(
+    method: str, url: str, *, retries: int | None = None, timeout=None, **kwargs
+) -> AsyncIterator[httpx.Response]:
+    """Async ``stream``: retries only happen before the response is yielded."""
+    method = method.upper()
+    host = httpx.URL(url).host
+    idempotent = method in IDEMPOTENT
+    if retries is None:
+        retries = HTTP_RETRIES
+    kwargs["timeout"] = _timeout(timeout) or async_client().timeout
+
+    attempt = 0
+    while True:
+        t0 = time.monotonic()
+        res = None
+        yielded = False
+        try:
+            async with _aslot(host), async_client().stream(method, url, **kwargs) as res:
+                failed = res.status_code in RETRY_STATUS
+                if not failed or not idempotent or attempt >= retries:
+                    yielded = True
+                    try:
+                        yield res
+                    finally:
+                        _record(
+                            host,
+                            time.monotonic() - t0,
+                            error=res.status_code >= 500,
+                            retry=attempt > 0,
+                        )
+                    return
+                _record(host, time.monotonic() - t0, error=True, retry=attempt > 0)
+        except httpx.TransportError as e:
+            if yielded:
+                raise
+            _record(host, time.monotonic() - t0, error=True, retry=attempt > 0)
+            if attempt >= retries or not (idempotent or isinstance(e, NOT_SENT)):
+                raise
+        attempt += 1
+        await asyncio.sleep(_backoff(attempt, res))
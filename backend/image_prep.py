@@ -0,0 +1,84 @@
+"""
+Encode-once preprocessing of uploaded images for the vision model.
+
+Each upload is EXIF-rotated, downscaled to ``VISION_MAX_SIDE`` and
+re-encoded once; the result is cached on disk next to the blob store (keyed
+by content hash and encode settings) and its data URL is memoized in
+process, so every LLM processor reuses the same small payload.
+"""
+from __future__ import annotations
+
+import base64
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from blob_store import UPLOAD_DIR, digest_of
+from config import VISION_MAX_SIDE, VISION_IMAGE_FORMAT, VISION_IMAGE_QUALITY
+from llm_processors import _to_data_url
+
+PREP_DIR = UPLOAD_DIR / "prepared"
+_FORMATS = {"jpeg": ("JPEG", "image/jpeg", ".jpg"), "webp": ("WEBP", "image/webp", ".webp")}
+
+_memo: OrderedDict[str, str] = OrderedDict()
+_memo_lock = threading.Lock()
+_MEMO_SIZE = 32
+
+
+def _encode(src: Path, dest: Path, fmt: str) -> None:
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+        if im.mode in ("RGBA", "LA", "P"):
+            im = im.convert("RGBA")
+            bg = Image.new("RGB", im.size, (255, 255, 255))
+            bg.paste(im, mask=im.getchannel("A"))
+            im = bg
+        elif im.mode != "RGB":
+            im = im.convert("RGB")
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=".prep-")
+        os.close(fd)
+        try:
+            im.save(tmp, fmt, quality=VISION_IMAGE_QUALITY, optimize=True)
+            os.replace(tmp, dest)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def prepare_image(image_path: str | Path) -> tuple[Path, str]:
+    """Return ``(path, mime)`` of the model-ready version of ``image_path``."""
+    fmt, mime, ext = _FORMATS.get(VISION_IMAGE_FORMAT, _FORMATS["jpeg"])
+    key = f"{digest_of(image_path)}-{VISION_MAX_SIDE}-{VISION_IMAGE_QUALITY}"
+    dest = PREP_DIR / f"{key}{ext}"
+    if not dest.exists():
+        PREP_DIR.mkdir(parents=True, exist_ok=True)
+        _encode(Path(image_path), dest, fmt)
+    return dest, mime
+
+
+def data_url_for(image_path: str | Path) -> str:
+    """Data URL of the prepared image, falling back to the original bytes."""
+    key = f"{digest_of(image_path)}-{VISION_MAX_SIDE}-{VISION_IMAGE_QUALITY}-{VISION_IMAGE_FORMAT}"
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            return _memo[key]
+
+    try:
+        path, mime = prepare_image(image_path)
+        b64 = base64.b64encode(path.read_bytes()).decode()
+        url = f"data:{mime};base64,{b64}"
+    except Exception as e:
+        print(f"Image preprocessing failed for {image_path}: {e}; sending original")
+        url = _to_data_url(str(image_path))
+
+    with _memo_lock:
+        _memo[key] = url
+        while len(_memo) > _MEMO_SIZE:
+            _memo.popitem(last=False)
+    return url
@@ -0,0 +1,493 @@
+"""
+Durable job queue for long-running music generation.
+
+Jobs live in the ``job`` table of the log database, so they survive restarts
+of the web process. A pool of worker processes claims queued jobs one at a
+time; run ``python worker.py`` to host the pool outside the web server.
+
+A job that submits a Udio task does not wait for it: it is parked as
+``polling`` with the task id, and the shared poller (``udio_poller.py``)
+leases due tasks from the table, checks them and finishes the job.
+
+A job enqueued with a ``dedupe_key`` while an identical one is in flight is
+not run again: the run folder follows the existing job and receives its
+outputs when it finishes (see ``coalesce.py``).
+"""
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import time
+import traceback
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+from sqlalchemy import Column, JSON, func, update
+from sqlmodel import SQLModel, Field, Session, select
+
+import coalesce
+import metrics
+import tracing
+from config import (
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_POOL_LOCK,
+    JOB_STALE_SECONDS,
+    JOB_WORKERS,
+    RETENTION_ENABLED,
+)
+from log_db import engine
+from pipeline import OUTPUT_ROOT, generate_music_from_image
+from run_events import emit
+from udio_module import next_poll_delay, submit_inference
+
+try:
+    import fcntl
+except ImportError:  # Windows: every server process starts its own pool
+    fcntl = None
+
+QUEUED = "queued"
+RUNNING = "running"
+POLLING = "polling"  # Udio task submitted; owned by the poller
+DONE = "done"
+FAILED = "failed"
+
+_pool_lock = None
+
+
+class Job(SQLModel, table=True):
+    id: str = Field(default_factory=lambda: uuid4().hex, primary_key=True)
+    kind: str = Field(index=True)
+    status: str = Field(default=QUEUED, index=True)
+    folder: str = ""
+    args: dict = Field(default_factory=dict, sa_column=Column(JSON))
+    attempts: int = 0
+    error: Optional[str] = None
+    worker: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    task_id: Optional[str] = None
+    task_submitted_at: Optional[datetime] = None
+    next_poll_at: Optional[datetime] = Field(default=None, index=True)
+    polls: int = 0
+    dedupe_key: Optional[str] = Field(default=None, index=True)
+
+
+class JobFollower(SQLModel, table=True):
+    """A run folder waiting for the outputs of an identical job."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: str = Field(index=True)
+    folder: str
+    mirrored: bool = False
+
+
+def _run_music(job: Job) -> Optional[str]:
+    a = job.args
+    return generate_music_from_image(
+        a["image_path"],
+        a.get("language", "en"),
+        OUTPUT_ROOT / job.folder,
+        a.get("audio_path"),
+        use_cache=a.get("use_cache", True),
+        prompt=a.get("prompt"),
+        lyrics=a.get("lyrics"),
+        wait=False,
+    )
+
+
+def _run_regenerate(job: Job) -> Optional[str]:
+    return submit_inference(job.args["assistant_reply"], OUTPUT_ROOT / job.folder)
+
+
+# Handlers return the id of a submitted Udio task, or None when already done.
+HANDLERS: dict[str, Callable[[Job], Optional[str]]] = {
+    "music": _run_music,
+    "regenerate": _run_regenerate,
+}
+
+
+def enqueue_job(kind: str, folder: str, dedupe_key: str | None = None, **args: Any) -> Job:
+    """
+    Queue a job for ``folder``. With ``dedupe_key``, an identical job still in
+    flight is followed instead and returned (its ``folder`` is not ``folder``).
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if dedupe_key:
+        with Session(engine) as db:
+            existing = db.exec(
+                select(Job.id)
+                .where(Job.dedupe_key == dedupe_key, Job.kind == kind, Job.status.in_([QUEUED, RUNNING, POLLING]))
+                .order_by(Job.created_at.desc())
+                .limit(1)
+            ).first()
+        if existing is not None and follow_job(existing, folder):
+            metrics.inc("coalesced_total", stage=f"{kind}_job")
+            return get_job(existing)
+    job = Job(kind=kind, folder=folder, args=args, dedupe_key=dedupe_key)
+    with Session(engine) as db:
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+    return job
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    with Session(engine) as db:
+        return db.get(Job, job_id)
+
+
+def follow_job(job_id: str, folder: str) -> bool:
+    """
+    Have ``folder`` receive the outputs of job ``job_id`` when it finishes.
+    False if the job is unknown or has already failed.
+    """
+    job = get_job(job_id)
+    if job is None or job.status == FAILED:
+        return False
+    with Session(engine) as db:
+        db.add(JobFollower(job_id=job_id, folder=folder))
+        db.commit()
+    job = get_job(job_id)
+    if job.status in (DONE, FAILED):
+        # Finished while we attached; claiming makes sure it is mirrored once
+        mirror_followers(job, job.status == DONE, job.error)
+    return True
+
+
+def mirror_followers(job: Job, done: bool, error: str | None = None) -> int:
+    """
+    Link a finished job's outputs into the folders following it; returns how
+    many. Blocking (hardlinks, event appends, store uploads): on an event
+    loop, call it and its callers through ``asyncio.to_thread``.
+    """
+    with Session(engine) as db:
+        pending = db.exec(
+            select(JobFollower.id, JobFollower.folder)
+            .where(JobFollower.job_id == job.id, JobFollower.mirrored == False)  # noqa: E712
+        ).all()
+        claimed = []
+        for follower_id, folder in pending:
+            res = db.execute(
+                update(JobFollower)
+                .where(JobFollower.id == follower_id, JobFollower.mirrored == False)  # noqa: E712
+                .values(mirrored=True)
+            )
+            if res.rowcount == 1:
+                claimed.append(folder)
+        db.commit()
+    for folder in claimed:
+        try:
+            coalesce.mirror_music(OUTPUT_ROOT / job.folder, OUTPUT_ROOT / folder, job.id, done, error)
+        except Exception as e:
+            print(f"Mirroring job {job.id} into {folder} failed: {e}")
+    return len(claimed)
+
+
+def mirror_encodes(wav: Path, paths: list[Path]) -> int:
+    """
+    Link compressed copies of ``wav``, encoded after its job was mirrored,
+    into the followers still holding that song; returns how many. Blocking.
+    """
+    with Session(engine) as db:
+        folders = db.exec(
+            select(JobFollower.folder)
+            .join(Job, Job.id == JobFollower.job_id)
+            .where(Job.folder == wav.parent.name, JobFollower.mirrored == True)  # noqa: E712
+            .distinct()
+        ).all()
+    linked = 0
+    for folder in folders:
+        dest = OUTPUT_ROOT / folder
+        try:
+            # A regenerated leader song is not the follower's any more
+            if not (dest / wav.name).exists() or not os.path.samefile(dest / wav.name, wav):
+                continue
+            coalesce.mirror_assets(wav.parent, dest, tuple(p.name for p in paths))
+            linked += 1
+        except Exception as e:
+            print(f"Mirroring encodes of {wav} into {folder} failed: {e}")
+    return linked
+
+
+def job_pending(folder: str) -> bool:
+    """Whether a job for ``folder``, or one it follows, may still write to it."""
+    active = [QUEUED, RUNNING, POLLING]
+    with Session(engine) as db:
+        own = db.exec(select(Job.id).where(Job.folder == folder, Job.status.in_(active)).limit(1)).first()
+        followed = db.exec(
+            select(JobFollower.id)
+            .where(JobFollower.folder == folder, JobFollower.mirrored == False)  # noqa: E712
+            .limit(1)
+        ).first()
+    return own is not None or followed is not None
+
+
+def claim_next_job(worker: str) -> Optional[Job]:
+    """Atomically move the oldest queued job to ``running`` and return it."""
+    with Session(engine) as db:
+        # Another worker may win the race for a candidate; try the next one.
+        for _ in range(5):
+            cand = db.exec(
+                select(Job.id)
+                .where(Job.status == QUEUED)
+                .order_by(Job.created_at)
+                .limit(1)
+            ).first()
+            if cand is None:
+                return None
+            res = db.execute(
+                update(Job)
+                .where(Job.id == cand, Job.status == QUEUED)
+                .values(
+                    status=RUNNING,
+                    worker=worker,
+                    started_at=datetime.utcnow(),
+                    attempts=Job.attempts + 1,
+                )
+            )
+            db.commit()
+            if res.rowcount == 1:
+                return db.get(Job, cand)
+    return None
+
+
+def _finish(job_id: str, status: str, error: str | None = None) -> None:
+    with Session(engine) as db:
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(status=status, error=error, finished_at=datetime.utcnow())
+        )
+        db.commit()
+
+
+def requeue_stale_jobs() -> int:
+    """Requeue running jobs whose worker died; fail those out of attempts."""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = (Job.status == RUNNING) & (Job.started_at < cutoff)
+    with Session(engine) as db:
+        db.execute(
+            update(Job)
+            .where(stale, Job.attempts >= JOB_MAX_ATTEMPTS)
+            .values(status=FAILED, error="worker lost", finished_at=datetime.utcnow())
+        )
+        res = db.execute(
+            update(Job).where(stale).values(status=QUEUED, worker=None)
+        )
+        db.commit()
+        return res.rowcount
+
+
+def _observe_job(job: Job, outcome: str) -> None:
+    # Queue wait + music stage + Udio task, end to end
+    elapsed = (datetime.utcnow() - job.created_at).total_seconds()
+    metrics.observe("stage_seconds", elapsed, stage=f"{job.kind}_job", outcome=outcome)
+
+
+def fail_job(job: Job, error: str) -> None:
+    """Requeue ``job`` while it has attempts left, otherwise mark it failed."""
+    run_dir = OUTPUT_ROOT / job.folder
+    if job.attempts < JOB_MAX_ATTEMPTS:
+        print(f"Job {job.id} ({job.kind}) failed: {error}; requeueing")
+        emit(run_dir, "run", "retrying", job_id=job.id, error=error)
+        with Session(engine) as db:
+            db.execute(
+                update(Job)
+                .where(Job.id == job.id)
+                .values(status=QUEUED, worker=None, error=error, task_id=None, next_poll_at=None)
+            )
+            db.commit()
+    else:
+        print(f"Job {job.id} ({job.kind}) failed: {error}")
+        _finish(job.id, FAILED, error)
+        _observe_job(job, "error")
+        emit(run_dir, "audio", "failed", job_id=job.id, error=error)
+        emit(run_dir, "run", "failed", job_id=job.id, error=error)
+        mirror_followers(job, False, error)
+
+
+def complete_job(job: Job) -> None:
+    _finish(job.id, DONE)
+    _observe_job(job, "ok")
+    emit(OUTPUT_ROOT / job.folder, "run", "done", job_id=job.id)
+    mirror_followers(job, True)
+
+
+def _park_for_polling(job: Job, task_id: str) -> None:
+    now = datetime.utcnow()
+    with Session(engine) as db:
+        db.execute(
+            update(Job)
+            .where(Job.id == job.id)
+            .values(
+                status=POLLING,
+                worker=None,
+                task_id=task_id,
+                task_submitted_at=now,
+                next_poll_at=now + timedelta(seconds=next_poll_delay(0)),
+                polls=0,
+            )
+        )
+        db.commit()
+
+
+def lease_due_tasks(limit: int, lease: float) -> list[Job]:
+    """
+    Claim up to ``limit`` polling jobs whose next check is due by pushing
+    ``next_poll_at`` ``lease`` seconds out; a poller that dies simply lets the
+    lease lapse.
+    """
+    now = datetime.utcnow()
+    leased = []
+    with Session(engine) as db:
+        due = db.exec(
+            select(Job.id, Job.next_poll_at)
+            .where(Job.status == POLLING, Job.next_poll_at <= now)
+            .order_by(Job.next_poll_at)
+            .limit(limit)
+        ).all()
+        for job_id, due_at in due:
+            res = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == POLLING, Job.next_poll_at == due_at)
+                .values(next_poll_at=now + timedelta(seconds=lease), polls=Job.polls + 1)
+            )
+            if res.rowcount == 1:
+                leased.append(job_id)
+        db.commit()
+        return [db.get(Job, job_id) for job_id in leased]
+
+
+def job_counts() -> dict[str, int]:
+    """Number of unfinished jobs per status."""
+    with Session(engine) as db:
+        rows = db.exec(
+            select(Job.status, func.count()).where(Job.status.in_([QUEUED, RUNNING, POLLING])).group_by(Job.status)
+        ).all()
+    return {status: 0 for status in (QUEUED, RUNNING, POLLING)} | dict(rows)
+
+
+def schedule_poll(job_id: str, delay: float) -> None:
+    with Session(engine) as db:
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == POLLING)
+            .values(next_poll_at=datetime.utcnow() + timedelta(seconds=delay))
+        )
+        db.commit()
+
+
+def run_job(job: Job) -> None:
+    try:
+        with tracing.trace(f"{job.kind}_job", OUTPUT_ROOT / job.folder, job_id=job.id, attempt=job.attempts):
+            task_id = HANDLERS[job.kind](job)
+    except Exception as e:
+        traceback.print_exc()
+        fail_job(job, str(e))
+        return
+    if task_id:
+        _park_for_polling(job, task_id)
+        return
+    complete_job(job)
+
+
+def worker_loop(worker: str) -> None:
+    # Never share pooled connections inherited from the parent process.
+    engine.dispose()
+    print(f"👷 job worker {worker} started (pid {os.getpid()})")
+    metrics.start_exporter("worker")
+    last_sweep = 0.0
+    while True:
+        if time.monotonic() - last_sweep > 60:
+            requeue_stale_jobs()
+            last_sweep = time.monotonic()
+        job = claim_next_job(worker)
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        run_job(job)
+
+
+def _claim_pool() -> bool:
+    """
+    Whether this process hosts the pool: only the first of the server
+    processes on a host (``uvicorn --workers N``) gets ``JOB_POOL_LOCK``.
+    """
+    global _pool_lock
+    if _pool_lock is not None or fcntl is None:
+        return True
+    Path(JOB_POOL_LOCK).parent.mkdir(parents=True, exist_ok=True)
+    f = open(JOB_POOL_LOCK, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _pool_lock = f  # held until stop_workers or exit
+    return True
+
+
+def start_workers(n: int = JOB_WORKERS) -> list[mp.Process]:
+    """
+    Start ``n`` job workers plus the shared Udio poller and retention sweeper
+    (none if ``n`` is 0, or if another process on this host already hosts them).
+    """
+    from retention import retention_loop
+    from udio_poller import poller_loop
+
+    if not n:
+        return []
+    if not _claim_pool():
+        print(f"👷 job pool already hosted by another process on this host (pid {os.getpid()} skips it)")
+        return []
+    ctx = mp.get_context("spawn")
+    procs = []
+    for i in range(n):
+        p = ctx.Process(
+            target=worker_loop,
+            args=(f"{os.getpid()}-{i}",),
+            name=f"omni-job-worker-{i}",
+            daemon=True,
+        )
+        p.start()
+        procs.append(p)
+    p = ctx.Process(target=poller_loop, name="omni-udio-poller", daemon=True)
+    p.start()
+    procs.append(p)
+    if RETENTION_ENABLED:
+        p = ctx.Process(target=retention_loop, name="omni-retention", daemon=True)
+        p.start()
+        procs.append(p)
+    return procs
+
+
+def stop_workers(procs: list[mp.Process]) -> None:
+    global _pool_lock
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.join(timeout=5)
+    if _pool_lock is not None:
+        _pool_lock.close()
+        _pool_lock = None
+
+
+def run_pool(n: int = JOB_WORKERS) -> None:
+    """Host a worker pool in the foreground until interrupted."""
+    from log_db import create_db_and_tables, report_db_settings
+    import retention  # noqa: F401  (registers the RunUsage table)
+    from storage import report_storage
+
+    create_db_and_tables()
+    report_db_settings()
+    report_storage()
+    procs = start_workers(max(n, 1))
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        stop_workers(procs)
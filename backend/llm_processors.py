@@ -1,18 +1,43 @@
-import requests
 import re
 import ast
+import asyncio
+import json
+import hashlib
 from udio_module import extract_prompt_and_lyrics
-from config import TEST_MODE, OPENAI_API_KEY
+from config import (
+    TEST_MODE,
+    OPENAI_API_KEY,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_PATH,
+    LLM_CACHE_MAX_MB,
+    LLM_CACHE_TTL_HOURS,
+)
+from cache import NullCache, SQLiteCache
+from blob_store import digest_of
+import http_client
 import base64
 import mimetypes
 
+LLM_CACHE = (
+    SQLiteCache(LLM_CACHE_PATH, int(LLM_CACHE_MAX_MB * 1024 * 1024), LLM_CACHE_TTL_HOURS * 3600)
+    if LLM_CACHE_ENABLED
+    else NullCache()
+)
+
 def _to_data_url(path: str) -> str:
     mime, _ = mimetypes.guess_type(path)
     with open(path, "rb") as f:
         b64 = base64.b64encode(f.read()).decode()
     return f"data:{mime or 'application/octet-stream'};base64,{b64}"
 
+def _as_search_entities(items) -> list[str]:
+    return [f"{str(x).strip()} abstract art" for x in items if str(x).strip()]
+
+
 class BaseLLMProcessor:
+    model = "gpt-4.1-mini"
+    response_format: dict | None = None
+
     def __init__(
         self,
         image_path: str,
@@ -20,7 +45,9 @@ class BaseLLMProcessor:
         max_new_tokens: int = 512,
         temperature: float = 1.0,
         top_p: float = 0.9,
-        do_sample: bool = True
+        do_sample: bool = True,
+        image_hash: str | None = None,
+        use_cache: bool = True,
     ):
         self.image_path = image_path
         self.language = language
@@ -28,15 +55,79 @@ class BaseLLMProcessor:
         self.temperature = temperature
         self.top_p = top_p
         self.do_sample = do_sample
+        self.image_hash = image_hash
+        # pass use_cache=False when a fresh sample is wanted for the same image
+        self.use_cache = use_cache
 
         # in production we use the hosted GPT model; no local weights loaded
 
     def generate(self) -> str:
         if TEST_MODE:
             return self._mock_generate()
-        return self._real_generate()
+        if not self.use_cache:
+            return self._real_generate()
+
+        key = self.cache_key()
+        cached = LLM_CACHE.get(key)
+        if cached is not None:
+            return cached
+        raw = self._real_generate()
+        if self._cacheable(raw):
+            LLM_CACHE.set(key, raw)
+        return raw
+
+    async def agenerate(self) -> str:
+        """Async ``generate``: same cache policy, non-blocking OpenAI call."""
+        if TEST_MODE:
+            return self._mock_generate()
+        if not self.use_cache:
+            return await self._areal_generate()
+
+        # The SQLite cache locks and commits; keep it off the event loop
+        key = self.cache_key()
+        cached = await asyncio.to_thread(LLM_CACHE.get, key)
+        if cached is not None:
+            return cached
+        raw = await self._areal_generate()
+        if self._cacheable(raw):
+            await asyncio.to_thread(LLM_CACHE.set, key, raw)
+        return raw
+
+    def cache_key(self) -> str:
+        """Hash of everything that determines the completion for this image."""
+        image_hash = self.image_hash
+        if image_hash is None:
+            if self.image_path.startswith("data:"):
+                image_hash = hashlib.sha256(self.image_path.encode()).hexdigest()
+            else:
+                image_hash = digest_of(self.image_path.removeprefix("file://"))
+        # the prompt template is the message list with the image left out
+        template = [
+            {**m, "content": [c for c in m.get("content", []) if c.get("type") != "image"]}
+            for m in self._build_messages()
+        ]
+        parts = {
+            "processor": type(self).__name__,
+            "image": image_hash,
+            "language": self.language,
+            "prompt": hashlib.sha256(
+                json.dumps(template, ensure_ascii=False, sort_keys=True).encode()
+            ).hexdigest(),
+            "model": self.model,
+            "max_new_tokens": self.max_new_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
 
-    def _real_generate(self) -> str:
+    def _cacheable(self, raw: str) -> bool:
+        """Only keep outputs that postprocess into something usable."""
+        try:
+            return bool(self._postprocess(raw))
+        except Exception:
+            return False
+
+    def _openai_request(self) -> dict:
         messages = self._build_messages()
 
         # Convert Qwen-style message format to OpenAI format
@@ -54,23 +145,32 @@ class BaseLLMProcessor:
             oa_msgs.append({"role": m.get("role", "user"), "content": content_items})
 
         payload = {
-            "model": "gpt-4.1-mini",
+            "model": self.model,
             "messages": oa_msgs,
             "max_tokens": self.max_new_tokens,
             "temperature": self.temperature,
             "top_p": self.top_p,
         }
+        if self.response_format:
+            payload["response_format"] = self.response_format
         headers = {
             "Authorization": f"Bearer {OPENAI_API_KEY}",
             "Content-Type": "application/json",
         }
+        return {
+            "url": "https://api.openai.com/v1/chat/completions",
+            "json": payload,
+            "headers": headers,
+            "timeout": 60,
+        }
 
-        res = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=60,
-        )
+    def _real_generate(self) -> str:
+        res = http_client.post(**self._openai_request())
+        res.raise_for_status()
+        return res.json()["choices"][0]["message"]["content"]
+
+    async def _areal_generate(self) -> str:
+        res = await http_client.apost(**self._openai_request())
         res.raise_for_status()
         return res.json()["choices"][0]["message"]["content"]
 
@@ -79,6 +179,11 @@ class BaseLLMProcessor:
         print("\n=== RAW MODEL OUTPUT ===\n", raw, "\n=== END ===")
         return self._postprocess(raw)
 
+    async def aprocess(self):
+        raw = await self.agenerate()
+        print("\n=== RAW MODEL OUTPUT ===\n", raw, "\n=== END ===")
+        return self._postprocess(raw)
+
     def _build_messages(self):
         raise NotImplementedError("Subclasses must implement _build_messages().")
 
@@ -87,14 +192,15 @@ class BaseLLMProcessor:
 
 
 class ImageToLyricsProcessor(BaseLLMProcessor):
-    def __init__(self, image_path: str, language: str = "en", chords: dict | None = None):
+    def __init__(self, image_path: str, language: str = "en", chords: dict | None = None, **kwargs):
         super().__init__(
             image_path,
             language,
             max_new_tokens=512,
             temperature=1.2,
             top_p=0.95,
-            do_sample=True
+            do_sample=True,
+            **kwargs,
         )
         self.chords = chords or {}
 
@@ -180,16 +286,21 @@ class ImageToLyricsProcessor(BaseLLMProcessor):
         prompt, lyrics = extract_prompt_and_lyrics(output, lang=self.language)
         return prompt, lyrics
 
+    def _cacheable(self, raw: str) -> bool:
+        prompt, _ = self._postprocess(raw)
+        return bool(prompt.strip())
+
 
 class ImageToTagsProcessor(BaseLLMProcessor):
-    def __init__(self, image_path: str, language: str = "en"):
+    def __init__(self, image_path: str, language: str = "en", **kwargs):
         super().__init__(
             image_path,
             language,
             max_new_tokens=256,
             temperature=1.0,
             top_p=0.9,
-            do_sample=True
+            do_sample=True,
+            **kwargs,
         )
 
     def _mock_generate(self):
@@ -321,14 +432,15 @@ class ImageToVisualEntitiesProcessor(BaseLLMProcessor):
     Extracts a set of concise visual entities/keywords from the image
     to drive image search.
     """
-    def __init__(self, image_path: str, language: str = "en"):
+    def __init__(self, image_path: str, language: str = "en", **kwargs):
         super().__init__(
             image_path,
             language,
             max_new_tokens=128,
             temperature=0.7,
             top_p=0.9,
-            do_sample=False
+            do_sample=False,
+            **kwargs,
         )
 
     def _mock_generate(self):
@@ -380,11 +492,145 @@ class ImageToVisualEntitiesProcessor(BaseLLMProcessor):
     def _postprocess(self, output: str):
     # Expect output like: ["tag1", "tag2", ...]
         try:
-            import json
             arr = json.loads(output)
-            return [f"{str(x).strip()} abstract art" for x in arr if isinstance(x, str)]
+            return _as_search_entities(x for x in arr if isinstance(x, str))
         except Exception:
-            import re
             # Fallback: simple regex
-            tags = re.findall(r'"([^"]+)"', output)
-            return [f"{tag.strip()} abstract art" for tag in tags]
+            return _as_search_entities(re.findall(r'"([^"]+)"', output))
+
+
+class ImageToBundleProcessor(BaseLLMProcessor):
+    """
+    Returns tags, visual entities and a music prompt with lyrics from a single
+    completion, so the image is sent to the model once per request. Only the
+    requested ``sections`` are asked for.
+    """
+    SECTIONS = ("tags", "entities", "music")
+    response_format = {"type": "json_object"}
+
+    def __init__(self, image_path: str, language: str = "en", sections=SECTIONS, **kwargs):
+        self.sections = tuple(s for s in self.SECTIONS if s in sections)
+        budget = {"tags": 320, "entities": 256, "music": 640}
+        super().__init__(
+            image_path,
+            language,
+            max_new_tokens=sum(budget[s] for s in self.sections),
+            temperature=1.0,
+            top_p=0.95,
+            do_sample=True,
+            **kwargs,
+        )
+
+    def _mock_generate(self):
+        data = {}
+        if "tags" in self.sections:
+            proc = ImageToTagsProcessor(self.image_path, self.language)
+            data["tags"] = proc._postprocess(proc._mock_generate())
+        if "entities" in self.sections:
+            proc = ImageToVisualEntitiesProcessor(self.image_path, self.language)
+            data["entities"] = json.loads(proc._mock_generate())
+        if "music" in self.sections:
+            proc = ImageToLyricsProcessor(self.image_path, self.language)
+            data["prompt"], data["lyrics"] = extract_prompt_and_lyrics(proc._mock_generate())
+        return json.dumps(data, ensure_ascii=False)
+
+    def _build_messages(self):
+        if self.language == "en":
+            parts = {
+                "tags": (
+                    '"tags": an array of at least 24 diverse inspirational tags for a music producer that combine '
+                    "visual elements (colors, scenery, light, motion, emotion), textural impressions (surfaces, ambience, energy) "
+                    "and musical or production ideas (textures, instrumentation, rhythm, structure), "
+                    'e.g. "crystal sunrise shimmer", "aurora pad resonance", "mossy forest hush".'
+                ),
+                "entities": (
+                    '"entities": an array of at least 24 concise keywords or short phrases describing abstract, conceptual, '
+                    "stylistic or mood-related aspects of the scene, to drive an image search. Avoid literal object names, "
+                    "names of people or places, brands or factual labels. If a keyword might imply real people, faces, body parts "
+                    "or real-life objects, stylize it by appending 'illustration', 'cartoon', 'line art', 'sketch' or 'painting'."
+                ),
+                "music": (
+                    '"prompt": a one-line music prompt describing style, instrumentation and atmosphere inspired by the image, '
+                    'e.g. "Epic fantasy orchestra, slow build-up, thunderstorm ambience, Celtic flute melody".\n'
+                    '"lyrics": at least 12 lines of lyrics in English only, separated by newlines, without timestamps, '
+                    "keeping a consistent emotional tone."
+                ),
+            }
+            prompt = (
+                "You are a multimodal creativity assistant for music producers. "
+                "Analyze the provided image's mood, visual features, atmosphere and possible sonic inspirations, "
+                "then return a single JSON object with exactly these keys:\n"
+                + "\n".join(parts[s] for s in self.sections)
+                + "\nOutput only the JSON object, in English, without any explanations or extra text."
+            )
+        else:
+            parts = {
+                "tags": (
+                    '"tags"：至少 24 个多样化的灵感标签数组，结合视觉元素（颜色、景观、光影、动态、情感）、'
+                    '质感印象（表面、氛围、能量感）以及音乐或制作灵感（音色、乐器、节奏、结构），如 "雨后青苔"、"心跳回声"、"暮色微光"。'
+                ),
+                "entities": (
+                    '"entities"：至少 24 个简洁关键词或短语的数组，描述图像的抽象概念、风格、氛围、色彩或情感，用于图片搜索。'
+                    "避免具体物体名称、人物姓名、地名、品牌。若关键词可能暗示真实人物、面孔、身体部位或现实物体，"
+                    "请添加“插画”、“卡通”、“简笔画”、“国画”等描述词进行风格化。"
+                ),
+                "music": (
+                    '"prompt"：一句话的音乐风格描述（风格、乐器、氛围），如 "伤感，慢节奏，钢琴，雨声"。\n'
+                    '"lyrics"：不少于 12 行的中文歌词，用换行分隔，无需时间戳，情绪保持一致。'
+                ),
+            }
+            prompt = (
+                "你是一名面向音乐制作人的多模态灵感助手。请分析图像的情绪、视觉特征、氛围以及可能的声音灵感，"
+                "并返回一个仅包含以下键的 JSON 对象：\n"
+                + "\n".join(parts[s] for s in self.sections)
+                + "\n仅输出该 JSON 对象，全部使用中文，不要添加任何解释或额外文字。"
+            )
+
+        messages = [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image", "image": self.image_path}
+            ],
+        }]
+
+        return messages
+
+    def _postprocess(self, output: str):
+        text = output.strip()
+        try:
+            data = json.loads(text)
+        except ValueError:
+            # Tolerate code fences or stray prose around the object
+            m = re.search(r"\{[\s\S]*\}", text)
+            data = json.loads(m.group(0)) if m else {}
+        if not isinstance(data, dict):
+            return {}
+
+        result = {}
+        if "tags" in self.sections and isinstance(data.get("tags"), list):
+            tags = [str(t).strip() for t in data["tags"] if str(t).strip()]
+            if tags:
+                result["tags"] = tags
+        if "entities" in self.sections and isinstance(data.get("entities"), list):
+            entities = _as_search_entities(x for x in data["entities"] if isinstance(x, str))
+            if entities:
+                result["entities"] = entities
+        if "music" in self.sections:
+            prompt = data.get("prompt")
+            lyrics = data.get("lyrics")
+            if isinstance(lyrics, list):
+                lyrics = "\n".join(str(line) for line in lyrics)
+            if isinstance(prompt, str) and prompt.strip() and isinstance(lyrics, str) and lyrics.strip():
+                result["prompt"] = prompt.strip()
+                result["lyrics"] = lyrics.strip()
+        return result
+
+    def _cacheable(self, raw: str) -> bool:
+        """Only keep bundles with every requested section; a partial one is asked for again."""
+        try:
+            result = self._postprocess(raw)
+        except Exception:
+            return False
+        keys = {"tags": ("tags",), "entities": ("entities",), "music": ("prompt", "lyrics")}
+        return all(k in result for s in self.sections for k in keys[s])
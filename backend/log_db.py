@@ -1,22 +1,113 @@
 from __future__ import annotations
 
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, Any
+from typing import Any, Callable, Optional
 from uuid import uuid4
 
 from sqlmodel import SQLModel, Field, create_engine, Session
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, JSON, bindparam, event, insert, inspect, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
+
+from config import (
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    EVENT_BATCH_SIZE,
+    EVENT_FLUSH_INTERVAL,
+    EVENT_QUEUE_MAX,
+    SESSION_CACHE_SIZE,
+    SESSION_TOUCH_INTERVAL,
+    SQLITE_BUSY_TIMEOUT,
+    SQLITE_CACHE_MB,
+    SQLITE_MMAP_MB,
+)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./omni_logs.db")
 
-engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
+# INSERT ... ON CONFLICT by dialect; others check for existing rows first
+UPSERTS = {"sqlite": sqlite_insert, "postgresql": pg_insert}
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # readers no longer block the writer (and vice versa)
+    "synchronous": "NORMAL",  # fsync at checkpoints, not every commit; safe with WAL
+    "busy_timeout": int(SQLITE_BUSY_TIMEOUT * 1000),  # wait for the write lock instead of "database is locked"
+    "cache_size": -int(SQLITE_CACHE_MB * 1024),  # negative = KiB
+    "mmap_size": int(SQLITE_MMAP_MB * 1024 * 1024),
+    "temp_store": "MEMORY",
+}
+
+
+def make_engine(url: str) -> Engine:
+    """
+    Engine for ``url``: SQLite connections get ``SQLITE_PRAGMAS``; other
+    databases (Postgres) get a sized, recycled connection pool.
+    """
+    if make_url(url).get_backend_name() != "sqlite":
+        return create_engine(
+            url,
+            echo=False,
+            pool_pre_ping=True,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+
+    eng = create_engine(
+        url,
+        echo=False,
+        pool_pre_ping=True,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT},
+    )
+
+    @event.listens_for(eng, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+
+    return eng
+
+
+engine = make_engine(DATABASE_URL)
+
+
+def db_settings() -> dict:
+    """Effective settings of the log DB, read back from the database and pool."""
+    settings = {"backend": engine.dialect.name, "url": engine.url.render_as_string(hide_password=True)}
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            for name in SQLITE_PRAGMAS:
+                settings[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+    else:
+        settings["pool"] = engine.pool.status()
+        if engine.dialect.name == "postgresql":
+            with engine.connect() as conn:
+                settings["max_connections"] = conn.exec_driver_sql("SHOW max_connections").scalar()
+    return settings
+
+
+def report_db_settings() -> None:
+    settings = db_settings()
+    print("🗄️ log DB:", ", ".join(f"{k}={v}" for k, v in settings.items()))
+    if settings.get("journal_mode", "wal").lower() != "wal":
+        print("⚠️ log DB is not in WAL mode; concurrent writers will serialize")
 
 
 class SessionEntry(SQLModel, table=True):
     id: str = Field(default_factory=lambda: uuid4().hex, primary_key=True)
     started_at: datetime = Field(default_factory=datetime.utcnow)
     ended_at: Optional[datetime] = None
+    last_seen_at: Optional[datetime] = None
     user_agent: str = ""
     locale: Optional[str] = None
 
@@ -29,8 +120,28 @@ class Event(SQLModel, table=True):
     payload: dict = Field(default_factory=dict, sa_column=Column(JSON))
 
 
+def _add_missing_columns() -> None:
+    """Add columns introduced after a table was first created (no migration tool here)."""
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            added = [col for col in table.columns if col.name not in have]
+            for col in added:
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}"
+                if col.default is not None and col.default.is_scalar:
+                    ddl += f" DEFAULT {col.default.arg!r}"
+                conn.execute(text(ddl))
+            for index in table.indexes:
+                if any(col in added for col in index.columns):
+                    index.create(conn, checkfirst=True)
+
+
 def create_db_and_tables() -> None:
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
 
 
 def get_session():
@@ -38,7 +149,172 @@ def get_session():
         yield s
 
 
-def log_event(db: Session, session_id: str, ev_type: str, **payload: Any) -> None:
-    ev = Event(session_id=session_id, type=ev_type, payload=payload)
-    db.add(ev)
-    db.commit()
+class EventWriter:
+    """
+    Write-behind event log. ``log`` and ``touch_session`` only enqueue; a
+    daemon thread writes queued rows in one transaction once
+    ``EVENT_BATCH_SIZE`` are waiting or ``EVENT_FLUSH_INTERVAL`` seconds after
+    the first, so a request never waits on a commit (an fsync on SQLite).
+    """
+
+    _STOP = object()
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue(maxsize=EVENT_QUEUE_MAX)
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.on_session_failure: Callable[[list[str]], None] | None = None  # ids whose rows were lost
+
+    def _ensure_started(self) -> None:
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+                    self.thread.start()
+
+    def _put(self, item: tuple[str, dict]) -> bool:
+        """Queue a row; False if the queue is full and it was dropped."""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"Event queue full; {self.dropped} rows dropped so far")
+            return False
+
+    def log(self, session_id: str, ev_type: str, payload: dict) -> None:
+        self._put(("event", {"session_id": session_id, "ts": datetime.utcnow(), "type": ev_type, "payload": payload}))
+
+    def touch_session(self, session_id: str, user_agent: str, locale: str | None) -> bool:
+        now = datetime.utcnow()
+        return self._put(("session", {
+            "id": session_id, "started_at": now, "last_seen_at": now,
+            "user_agent": user_agent, "locale": locale,
+        }))
+
+    def _write_sessions(self, conn, rows: list[dict]) -> None:
+        latest = {r["id"]: r for r in rows}  # a batch may touch one session several times
+        table = SessionEntry.__table__
+        upsert = UPSERTS.get(conn.dialect.name)
+        if upsert is not None:
+            # Another process may insert the same new session first; that must
+            # not roll back the events in this batch
+            stmt = upsert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={"ended_at": None, "last_seen_at": stmt.excluded.last_seen_at},
+            )
+            conn.execute(stmt, list(latest.values()))
+            return
+        known = set(conn.scalars(select(table.c.id).where(table.c.id.in_(list(latest)))))
+        new = [r for sid, r in latest.items() if sid not in known]
+        if new:
+            conn.execute(insert(table), new)
+        seen = [{"sid": sid, "seen": r["last_seen_at"]} for sid, r in latest.items() if sid in known]
+        if seen:
+            conn.execute(
+                update(table)
+                .where(table.c.id == bindparam("sid"))
+                .values(ended_at=None, last_seen_at=bindparam("seen")),
+                seen,
+            )
+
+    def _write(self, items: list[tuple[str, dict]]) -> None:
+        sessions = [row for kind, row in items if kind == "session"]
+        events = [row for kind, row in items if kind == "event"]
+        try:
+            with engine.begin() as conn:
+                # Sessions first: events of a new session reference its row
+                if sessions:
+                    self._write_sessions(conn, sessions)
+                if events:
+                    conn.execute(insert(Event.__table__), events)
+        except Exception as e:
+            print(f"Writing {len(items)} log rows failed: {e}")
+            if sessions and self.on_session_failure is not None:
+                self.on_session_failure([row["id"] for row in sessions])
+
+    def _run(self) -> None:
+        while True:
+            first = self.queue.get()
+            if first is self._STOP:
+                return
+            items = [first]
+            deadline = time.monotonic() + EVENT_FLUSH_INTERVAL
+            stop = False
+            while len(items) < EVENT_BATCH_SIZE:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                items.append(item)
+            self._write(items)
+            if stop:
+                return
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Flush everything queued so far and stop the writer thread."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return
+        self.queue.put(self._STOP)
+        thread.join(timeout)
+
+
+class SessionCache:
+    """
+    Session IDs seen recently (LRU, ``SESSION_CACHE_SIZE`` entries). A session
+    is written through the event writer the first time it shows up and then at
+    most once per ``SESSION_TOUCH_INTERVAL`` seconds to refresh ``last_seen_at``.
+    It only counts as written once queued, and is forgotten again if the write
+    fails, so the next request retries it.
+    """
+
+    def __init__(self, writer: EventWriter):
+        self.writer = writer
+        self.touched: OrderedDict[str, float] = OrderedDict()
+        self.lock = threading.Lock()
+        writer.on_session_failure = self.forget
+
+    def seen(self, session_id: str, user_agent: str = "", locale: str | None = None) -> None:
+        now = time.monotonic()
+        with self.lock:
+            last = self.touched.get(session_id)
+            if last is not None and now - last < SESSION_TOUCH_INTERVAL:
+                self.touched.move_to_end(session_id)
+                return
+        if not self.writer.touch_session(session_id, user_agent, locale):
+            return
+        with self.lock:
+            self.touched[session_id] = now
+            self.touched.move_to_end(session_id)
+            while len(self.touched) > SESSION_CACHE_SIZE:
+                self.touched.popitem(last=False)
+
+    def forget(self, session_ids: list[str]) -> None:
+        with self.lock:
+            for sid in session_ids:
+                self.touched.pop(sid, None)
+
+
+event_writer = EventWriter()
+session_cache = SessionCache(event_writer)
+
+
+def log_event(session_id: str, ev_type: str, **payload: Any) -> None:
+    event_writer.log(session_id, ev_type, payload)
+
+
+def touch_session(session_id: str, user_agent: str = "", locale: str | None = None) -> None:
+    session_cache.seen(session_id, user_agent, locale)
+
+
+def flush_events() -> None:
+    event_writer.close()
@@ -0,0 +1,293 @@
+"""
+In-process metrics exported in the Prometheus text format at ``/metrics``.
+
+Recording is a dict update under a lock: stage latency histograms
+(``timed`` / ``timer`` / ``observe``), counters (``inc``) and gauges
+(``gauge_add`` / ``gauge_set``). Job workers, the Udio poller and every server process run
+``start_exporter``, which writes a snapshot of the process's metrics to
+``METRICS_DIR`` every few seconds; ``render`` sums the snapshots of all
+processes, as the Prometheus client's multiprocess mode does. When a
+process has exited, its counters and histograms are folded into one
+cumulative ``dead.json`` (they still count towards the totals; its gauges no
+longer do) and its snapshot is deleted.
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import inspect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import tracing
+from config import METRICS_DIR, METRICS_EXPORT_INTERVAL
+
+try:
+    import fcntl
+except ImportError:  # Windows: folds are not serialized across processes
+    fcntl = None
+
+PREFIX = "omni_"
+DEAD_FILE = "dead.json"  # counters and histograms of every exited process
+DEAD_LOCK = "dead.lock"
+# Upper bounds (seconds) of the stage histograms
+BUCKETS = (0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+HELP = {
+    "stage_seconds": ("histogram", "Duration of a pipeline stage"),
+    "http_request_seconds": ("histogram", "Duration of one outbound HTTP attempt"),
+    "http_requests_total": ("counter", "Outbound HTTP attempts by host and outcome"),
+    "http_retries_total": ("counter", "Outbound HTTP attempts that were retries"),
+    "mock_fallbacks_total": ("counter", "Times a component fell back to mock output"),
+    "inflight_requests": ("gauge", "Requests being handled by the server"),
+    "jobs": ("gauge", "Background jobs by status"),
+    "coalesced_total": ("counter", "Generations and jobs that shared an identical one in flight"),
+    "retention_deleted_total": ("counter", "Runs and upload files deleted by retention"),
+    "retention_deleted_bytes_total": ("counter", "Bytes freed by retention"),
+    "retention_bytes": ("gauge", "Size of runs and uploads at the last retention pass"),
+}
+
+_lock = threading.Lock()
+_hists: dict[tuple, list] = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters: dict[tuple, float] = {}
+_gauges: dict[tuple, float] = {}
+_exporter: threading.Thread | None = None
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name: str, value: float, **labels) -> None:
+    k = _key(name, labels)
+    i = bisect.bisect_left(BUCKETS, value)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = [0] * (len(BUCKETS) + 2)
+        h[i] += 1
+        h[-1] += value
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def gauge_add(name: str, delta: float, **labels) -> None:
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = _gauges.get(k, 0) + delta
+
+
+def gauge_set(name: str, value: float, **labels) -> None:
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+@contextmanager
+def timer(stage: str):
+    """Time the block as ``stage`` (and trace it as a span); the outcome label is ``error`` if it raises."""
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        with tracing.span(stage):
+            yield
+        outcome = "ok"
+    finally:
+        observe("stage_seconds", time.perf_counter() - t0, stage=stage, outcome=outcome)
+
+
+def timed(stage: str):
+    """Decorator form of ``timer`` for sync and async functions."""
+    def wrap(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with timer(stage):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def mock_fallback(component: str) -> None:
+    inc("mock_fallbacks_total", component=component)
+
+
+# ---- Export ----
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "hists": [[n, list(l), list(h)] for (n, l), h in _hists.items()],
+            "counters": [[n, list(l), v] for (n, l), v in _counters.items()],
+            "gauges": [[n, list(l), v] for (n, l), v in _gauges.items()],
+        }
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _write_snapshot(path: Path, snap: dict | None = None) -> None:
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".metrics-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(snapshot() if snap is None else snap, f)
+    os.replace(tmp, path)
+
+
+def start_exporter(role: str) -> None:
+    """Write this process's metrics to ``METRICS_DIR`` every ``METRICS_EXPORT_INTERVAL`` seconds."""
+    global _exporter
+    if _exporter is not None:
+        return
+    Path(METRICS_DIR).mkdir(parents=True, exist_ok=True)
+    path = Path(METRICS_DIR) / f"{role}-{os.getpid()}.json"
+
+    def run():
+        while True:
+            try:
+                _write_snapshot(path)
+            except Exception as e:
+                print(f"Metrics export failed: {e}")
+            time.sleep(METRICS_EXPORT_INTERVAL)
+
+    _exporter = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+    _exporter.start()
+
+
+def _merge(snaps: list[dict]) -> dict:
+    """Sum snapshots into ``{"hists", "counters", "gauges"}`` dicts keyed by ``(name, labels)``."""
+    hists: dict[tuple, list] = {}
+    counters: dict[tuple, float] = {}
+    gauges: dict[tuple, float] = {}
+    for snap in snaps:
+        for n, l, h in snap["hists"]:
+            k = (n, tuple(map(tuple, l)))
+            hists[k] = [a + b for a, b in zip(hists.get(k, [0] * len(h)), h)]
+        for kind, merged in (("counters", counters), ("gauges", gauges)):
+            for n, l, v in snap[kind]:
+                k = (n, tuple(map(tuple, l)))
+                merged[k] = merged.get(k, 0) + v
+    return {"hists": hists, "counters": counters, "gauges": gauges}
+
+
+def _read(fp: Path) -> dict | None:
+    try:
+        return json.loads(fp.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _dead_lock(directory: Path, shared: bool = False):
+    """Exclusive while ``dead.json`` is folded into; shared while it and the live snapshots are read."""
+    with open(directory / DEAD_LOCK, "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)  # released on close
+        yield
+
+
+def _retire(fp: Path) -> None:
+    """Fold an exited process's counters and histograms into ``dead.json`` and delete its snapshot."""
+    with _dead_lock(fp.parent):
+        if not fp.exists():
+            return  # another server process folded it
+        snap = _read(fp)
+        if snap is not None:
+            dead = fp.parent / DEAD_FILE
+            merged = _merge([_read(dead) or {"hists": [], "counters": [], "gauges": []}, snap])
+            _write_snapshot(dead, {
+                "hists": [[n, list(l), h] for (n, l), h in merged["hists"].items()],
+                "counters": [[n, list(l), v] for (n, l), v in merged["counters"].items()],
+                "gauges": [],
+            })
+        fp.unlink()
+
+
+def _snapshot_files(directory: Path) -> dict[Path, int]:
+    """Snapshots of other processes by pid."""
+    files = {}
+    for fp in directory.glob("*.json"):
+        try:
+            pid = int(fp.stem.rsplit("-", 1)[-1])
+        except ValueError:
+            continue  # dead.json
+        if pid != os.getpid():
+            files[fp] = pid
+    return files
+
+
+def _collect() -> dict:
+    """
+    This process's metrics, the last snapshot of every other live process and
+    the counters and histograms of exited ones (dropping those would make the
+    totals go down, which Prometheus reads as a counter reset).
+    """
+    directory = Path(METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    for fp, pid in _snapshot_files(directory).items():
+        if not _alive(pid):
+            _retire(fp)
+    snaps = [snapshot()]
+    # A snapshot is either still on its own or already in dead.json, never both
+    with _dead_lock(directory, shared=True):
+        for fp in [*_snapshot_files(directory), directory / DEAD_FILE]:
+            snap = _read(fp)
+            if snap is not None:
+                snaps.append(snap)
+    return _merge(snaps)
+
+
+def _esc(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra) -> str:
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in items) + "}"
+
+
+def render(extra_gauges: dict[tuple, float] | None = None) -> str:
+    """Prometheus text exposition of every process's metrics plus ``extra_gauges``."""
+    data = _collect()
+    gauges = {**data["gauges"], **(extra_gauges or {})}
+    series: dict[str, list[str]] = {}
+
+    for (name, labels), h in sorted(data["hists"].items()):
+        lines = series.setdefault(name, [])
+        cum = 0
+        for bound, n in zip([*BUCKETS, "+Inf"], h[:-1]):
+            cum += n
+            lines.append(f"{PREFIX}{name}_bucket{_labels(labels, le=bound)} {cum}")
+        lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {h[-1]}")
+        lines.append(f"{PREFIX}{name}_count{_labels(labels)} {cum}")
+    for merged in (data["counters"], gauges):
+        for (name, labels), v in sorted(merged.items()):
+            series.setdefault(name, []).append(f"{PREFIX}{name}{_labels(labels)} {v}")
+
+    out = []
+    for name, lines in series.items():
+        kind, doc = HELP.get(name, ("untyped", name))
+        out += [f"# HELP {PREFIX}{name} {doc}", f"# TYPE {PREFIX}{name} {kind}", *lines]
+    return "\n".join(out) + "\n"
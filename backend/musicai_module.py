@@ -1,12 +1,15 @@
 import os
 import time
-import requests
+import asyncio
 import wave
 import tempfile
 import shutil
 import subprocess
 from pathlib import Path
 from config import TEST_MODE, MUSIC_AI_API_KEY, MUSICAI_CHORD_WORKFLOW
+import http_client
+import metrics
+import tracing
 
 API_BASE = 'https://api.music.ai/v1'
 
@@ -62,32 +65,70 @@ def _prepare_audio(path: str, limit_sec: float = 30.0) -> str:
 
 
 def _get_signed_urls():
-    r = requests.get(f'{API_BASE}/upload', headers=HEADERS)
+    r = http_client.get(f'{API_BASE}/upload', headers=HEADERS)
     r.raise_for_status()
     j = r.json()
     return j['uploadUrl'], j['downloadUrl']
 
 
 def _upload_file(path: str, url: str):
-    with open(path, 'rb') as f:
-        r = requests.put(url, data=f)
+    # Read up front so a retried PUT resends the whole body
+    r = http_client.put(url, content=Path(path).read_bytes(), timeout=120)
     r.raise_for_status()
 
 
-def _create_job(download_url: str, workflow: str, name: str):
-    payload = {
+def _job_payload(download_url: str, workflow: str, name: str):
+    return {
         'workflow': workflow,
         'params': {'inputUrl': download_url},
         'name': name,
     }
+
+
+def _create_job(download_url: str, workflow: str, name: str):
     h = {**HEADERS, 'Content-Type': 'application/json'}
-    r = requests.post(f'{API_BASE}/job', json=payload, headers=h)
+    r = http_client.post(f'{API_BASE}/job', json=_job_payload(download_url, workflow, name), headers=h)
     r.raise_for_status()
     return r.json()['id']
 
 
 def _get_job(job_id: str):
-    r = requests.get(f'{API_BASE}/job/{job_id}', headers=HEADERS)
+    r = http_client.get(f'{API_BASE}/job/{job_id}', headers=HEADERS)
+    r.raise_for_status()
+    return r.json()
+
+
+def _job_finished(job) -> bool:
+    status = job.get('status')
+    if status == 'FAILED':
+        raise RuntimeError('MusicAI job failed: ' + job.get('error', {}).get('message', ''))
+    return status == 'SUCCEEDED'
+
+
+async def _aget_signed_urls():
+    r = await http_client.aget(f'{API_BASE}/upload', headers=HEADERS)
+    r.raise_for_status()
+    j = r.json()
+    return j['uploadUrl'], j['downloadUrl']
+
+
+async def _aupload_file(path: str, url: str):
+    content = await asyncio.to_thread(Path(path).read_bytes)
+    r = await http_client.aput(url, content=content, timeout=120)
+    r.raise_for_status()
+
+
+async def _acreate_job(download_url: str, workflow: str, name: str):
+    h = {**HEADERS, 'Content-Type': 'application/json'}
+    r = await http_client.apost(
+        f'{API_BASE}/job', json=_job_payload(download_url, workflow, name), headers=h
+    )
+    r.raise_for_status()
+    return r.json()['id']
+
+
+async def _aget_job(job_id: str):
+    r = await http_client.aget(f'{API_BASE}/job/{job_id}', headers=HEADERS)
     r.raise_for_status()
     return r.json()
 
@@ -109,6 +150,7 @@ def _clean_chord_label(chord: str) -> str:
     return "No chord" if chord == "N" else chord
 
 
+@metrics.timed("chord_transcription")
 def transcribe_chords(audio_path: str):
     """Return list of chords from Music AI transcription."""
     if TEST_MODE:
@@ -117,27 +159,31 @@ def transcribe_chords(audio_path: str):
     if not MUSIC_AI_API_KEY:
         raise RuntimeError('MUSIC_AI_API_KEY not set')
 
-    trimmed = _prepare_audio(audio_path)
-    up_url, dl_url = _get_signed_urls()
-    _upload_file(trimmed, up_url)
-    job_id = _create_job(dl_url, MUSICAI_CHORD_WORKFLOW, 'omniwizz_chords')
-
-    while True:
-        job = _get_job(job_id)
-        status = job.get('status')
-        if status == 'SUCCEEDED':
-            break
-        if status == 'FAILED':
-            raise RuntimeError('MusicAI job failed: ' + job.get('error', {}).get('message', ''))
-        time.sleep(5)
+    with tracing.span('prepare_audio'):
+        trimmed = _prepare_audio(audio_path)
+    with tracing.span('musicai_upload', bytes=os.path.getsize(trimmed)):
+        up_url, dl_url = _get_signed_urls()
+        _upload_file(trimmed, up_url)
+    with tracing.span('musicai_job') as attrs:
+        job_id = _create_job(dl_url, MUSICAI_CHORD_WORKFLOW, 'omniwizz_chords')
+        attrs['polls'] = 0
+        while True:
+            job = _get_job(job_id)
+            attrs['polls'] += 1
+            if _job_finished(job):
+                break
+            time.sleep(5)
 
     chord_url = job.get('result', {}).get('chords')
     if not chord_url:
         return {'key': '', 'chords': []}
 
-    r = requests.get(chord_url)
+    r = http_client.get(chord_url)
     r.raise_for_status()
-    data = r.json()
+    return _finish_chords(r.json(), trimmed, audio_path)
+
+
+def _finish_chords(data, trimmed: str, audio_path: str):
     progression = _parse_progressions(data)
     chords = [_clean_chord_label(ch) for ch in progression]
 
@@ -150,3 +196,35 @@ def transcribe_chords(audio_path: str):
     print(f"🎼 MusicAI chords extracted: {chords}")
     return chords
 
+
+@metrics.timed("chord_transcription")
+async def atranscribe_chords(audio_path: str):
+    """Async ``transcribe_chords``."""
+    if TEST_MODE:
+        return {'key': 'C major', 'chords': ['C', 'G', 'Am', 'F']}
+
+    if not MUSIC_AI_API_KEY:
+        raise RuntimeError('MUSIC_AI_API_KEY not set')
+
+    with tracing.span('prepare_audio'):
+        trimmed = await asyncio.to_thread(_prepare_audio, audio_path)
+    with tracing.span('musicai_upload', bytes=os.path.getsize(trimmed)):
+        up_url, dl_url = await _aget_signed_urls()
+        await _aupload_file(trimmed, up_url)
+    with tracing.span('musicai_job') as attrs:
+        job_id = await _acreate_job(dl_url, MUSICAI_CHORD_WORKFLOW, 'omniwizz_chords')
+        attrs['polls'] = 0
+        while True:
+            job = await _aget_job(job_id)
+            attrs['polls'] += 1
+            if _job_finished(job):
+                break
+            await asyncio.sleep(5)
+
+    chord_url = job.get('result', {}).get('chords')
+    if not chord_url:
+        return {'key': '', 'chords': []}
+
+    r = await http_client.aget(chord_url)
+    r.raise_for_status()
+    return _finish_chords(r.json(), trimmed, audio_path)
@@ -1,21 +1,33 @@
+import asyncio
 import uuid
 import json
 from datetime import datetime
 from pathlib import Path
-import shutil
-from llm_processors import _to_data_url
-from config import TEST_MODE
-from musicai_module import transcribe_chords
+from config import TEST_MODE, IMAGE_STAGE_DEADLINE
+from musicai_module import transcribe_chords, atranscribe_chords
 
 from llm_processors import (
+    ImageToBundleProcessor,
     ImageToLyricsProcessor,
     ImageToTagsProcessor,
     ImageToVisualEntitiesProcessor,
 )
-from udio_module import run_inference
-from serpapi_module import fetch_images_for_entity
+from udio_module import run_inference, arun_inference, submit_inference
+from serpapi_module import afetch_images_for_entity
+import http_client
+import metrics
+import storage
+import tracing
+from run_events import emit
+from blob_store import digest_of, link_into
+from asset_cache import write_text_asset
+from image_prep import data_url_for
+import derivatives
+from derivatives import make_variants
+from storage import OUTPUT_ROOT
 
-OUTPUT_ROOT = Path(__file__).parent.parent / "output"
+MOCK_IMAGE_DIR = Path(__file__).parent / "mock_data" / "images"
+_variant_tasks: set[asyncio.Task] = set()  # thumbnails still rendering after their run was answered
 
 
 def _make_run_dir() -> Path:
@@ -26,35 +38,21 @@ def _make_run_dir() -> Path:
     return d
 
 
-def generate_music_from_image(
-    image_path: str,
-    language: str = "en",
-    run_dir: Path = None,
-    audio_path: str | None = None,
-) -> str:
-    # 1) Prepare run_dir
-    out_dir = run_dir or _make_run_dir()
-    shutil.copy2(image_path, out_dir / Path(image_path).name)
+# ---- LLM stages (shared by the sync and async entry points) ----
 
-    chords = None
-    if audio_path:
-        try:
-            chords = transcribe_chords(audio_path)
-            with open(out_dir / "chords.json", "w", encoding="utf-8") as f:
-                json.dump(chords, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Chord transcription failed: {e}")
+def _lyrics_processor(image_path: str, language: str, chords, use_cache: bool):
+    return ImageToLyricsProcessor(
+        data_url_for(image_path),
+        language,
+        chords,
+        image_hash=digest_of(image_path),
+        use_cache=use_cache,
+    )
 
-    # 2) LLM → prompt + lyrics
-    uri = _to_data_url(image_path)
-    proc = ImageToLyricsProcessor(uri, language, chords)
-    try:
-        raw = proc.generate()
-    except Exception as e:
-        print(f"LLM generation failed: {e}; falling back to mock")
-        raw = proc._mock_generate()
 
+def _parse_lyrics(proc: ImageToLyricsProcessor, raw: str) -> tuple[str, str]:
     print("\n=== LLM RAW OUTPUT ===\n", raw, "\n=== END ===")
+    tracing.annotate(response_chars=len(raw or ""))
 
     try:
         prompt, lyrics = proc._postprocess(raw)
@@ -62,89 +60,454 @@ def generate_music_from_image(
             raise ValueError("empty prompt")
     except Exception as e:
         print(f"Postprocessing failed: {e}; using mock output")
+        metrics.mock_fallback("lyrics")
         raw = proc._mock_generate()
         prompt, lyrics = proc._postprocess(raw)
+    return prompt, lyrics
 
-    # 3) Store prompt for later reference
-    with open(out_dir / "prompt.txt", "w", encoding="utf-8") as f:
-        f.write(prompt)
 
-    # 4) Assemble assistant reply for Udio
-    assistant_reply = f"**Music Prompt:** {prompt}\n\n**Lyrics:**\n{lyrics}"
+@metrics.timed("lyrics_llm")
+def _lyrics_from_image(
+    image_path: str, language: str, chords, use_cache: bool
+) -> tuple[str, str]:
+    proc = _lyrics_processor(image_path, language, chords, use_cache)
+    try:
+        raw = proc.generate()
+    except Exception as e:
+        print(f"LLM generation failed: {e}; falling back to mock")
+        metrics.mock_fallback("lyrics")
+        raw = proc._mock_generate()
+    return _parse_lyrics(proc, raw)
+
 
-    # 5) Inference (or mock)
+@metrics.timed("lyrics_llm")
+async def _alyrics_from_image(
+    image_path: str, language: str, chords, use_cache: bool
+) -> tuple[str, str]:
+    proc = await asyncio.to_thread(_lyrics_processor, image_path, language, chords, use_cache)
     try:
-        audio_path = run_inference(assistant_reply, out_dir)
+        raw = await proc.agenerate()
     except Exception as e:
-        print(f"Udio failed: {e}; using mock audio")
-        audio_path = run_inference(assistant_reply, out_dir, use_mock=True)
-    return audio_path
+        print(f"LLM generation failed: {e}; falling back to mock")
+        metrics.mock_fallback("lyrics")
+        raw = proc._mock_generate()
+    return _parse_lyrics(proc, raw)
 
 
-def generate_tags_from_image(
-    image_path: str, language: str = "en", run_dir: Path = None
-):
-    out_dir = run_dir or _make_run_dir()
-    shutil.copy2(image_path, out_dir / Path(image_path).name)
+def _tags_processor(image_path: str, language: str, use_cache: bool):
+    return ImageToTagsProcessor(
+        data_url_for(image_path),
+        language,
+        image_hash=digest_of(image_path),
+        use_cache=use_cache,
+    )
+
 
-    uri = _to_data_url(image_path)
-    proc = ImageToTagsProcessor(uri, language)
+@metrics.timed("tags_llm")
+def _tags_from_image(image_path: str, language: str, use_cache: bool) -> list[str]:
+    proc = _tags_processor(image_path, language, use_cache)
     try:
         tags = proc.process()
         if not tags:
             raise ValueError("no tags")
     except Exception as e:
         print(f"Tag generation failed: {e}; using mock tags")
+        metrics.mock_fallback("tags")
         tags = proc._postprocess(proc._mock_generate())
+    return tags
 
-    # save tags.json
-    with open(out_dir / "tags.json", "w", encoding="utf-8") as f:
-        json.dump(tags, f, ensure_ascii=False, indent=2)
 
-    return tags, out_dir
+@metrics.timed("tags_llm")
+async def _atags_from_image(image_path: str, language: str, use_cache: bool) -> list[str]:
+    proc = await asyncio.to_thread(_tags_processor, image_path, language, use_cache)
+    try:
+        tags = await proc.aprocess()
+        if not tags:
+            raise ValueError("no tags")
+    except Exception as e:
+        print(f"Tag generation failed: {e}; using mock tags")
+        metrics.mock_fallback("tags")
+        tags = proc._postprocess(proc._mock_generate())
+    return tags
 
 
-def generate_images_from_image(
-    image_path: str, language: str = "en", per_entity: int = 1, run_dir: Path = None
-):
+def _entities_processor(image_path: str, language: str, use_cache: bool):
+    return ImageToVisualEntitiesProcessor(
+        data_url_for(image_path),
+        language,
+        image_hash=digest_of(image_path),
+        use_cache=use_cache,
+    )
+
+
+@metrics.timed("entities_llm")
+def _entities_from_image(image_path: str, language: str, use_cache: bool) -> list[str]:
+    proc = _entities_processor(image_path, language, use_cache)
+    try:
+        return proc.process()
+    except Exception as e:
+        print(f"Entity extraction failed: {e}; continuing with empty list")
+        metrics.mock_fallback("entities")
+        return []
+
+
+@metrics.timed("entities_llm")
+async def _aentities_from_image(image_path: str, language: str, use_cache: bool) -> list[str]:
+    proc = await asyncio.to_thread(_entities_processor, image_path, language, use_cache)
+    try:
+        return await proc.aprocess()
+    except Exception as e:
+        print(f"Entity extraction failed: {e}; continuing with empty list")
+        metrics.mock_fallback("entities")
+        return []
+
+
+def _bundle_processor(image_path: str, language: str, modes, use_cache: bool):
+    sections = [
+        section
+        for mode, section in (("tags", "tags"), ("images", "entities"), ("music", "music"))
+        if mode in modes
+    ]
+    return ImageToBundleProcessor(
+        data_url_for(image_path),
+        language,
+        sections,
+        image_hash=digest_of(image_path),
+        use_cache=use_cache,
+    )
+
+
+@metrics.timed("bundle_llm")
+def generate_bundle_from_image(
+    image_path: str,
+    language: str = "en",
+    modes=("tags", "images", "music"),
+    use_cache: bool = True,
+) -> dict:
+    """
+    One multimodal completion for several modes. Returns whichever of
+    ``tags``, ``entities``, ``prompt`` and ``lyrics`` parsed cleanly; callers
+    fall back to the per-mode processors for anything missing.
+    """
+    proc = _bundle_processor(image_path, language, modes, use_cache)
+    try:
+        return proc.process()
+    except Exception as e:
+        print(f"Combined generation failed: {e}; falling back to per-mode processors")
+        return {}
+
+
+@metrics.timed("bundle_llm")
+async def agenerate_bundle_from_image(
+    image_path: str,
+    language: str = "en",
+    modes=("tags", "images", "music"),
+    use_cache: bool = True,
+) -> dict:
+    proc = await asyncio.to_thread(_bundle_processor, image_path, language, modes, use_cache)
+    try:
+        return await proc.aprocess()
+    except Exception as e:
+        print(f"Combined generation failed: {e}; falling back to per-mode processors")
+        return {}
+
+
+# ---- Output writers ----
+
+def _save_chords(out_dir: Path, chords) -> None:
+    with open(out_dir / "chords.json", "w", encoding="utf-8") as f:
+        json.dump(chords, f, ensure_ascii=False, indent=2)
+    storage.publish(out_dir / "chords.json")
+    emit(out_dir, "chords", "ready")
+
+
+def _save_prompt(out_dir: Path, prompt: str, lyrics: str) -> str:
+    """Store the prompt and return the assistant reply Udio expects."""
+    storage.publish(*write_text_asset(out_dir / "prompt.txt", prompt))
+    emit(out_dir, "prompt", "ready")
+    return f"**Music Prompt:** {prompt}\n\n**Lyrics:**\n{lyrics}"
+
+
+def _save_tags(out_dir: Path, tags: list[str]) -> None:
+    storage.publish(*write_text_asset(out_dir / "tags.json", json.dumps(tags, ensure_ascii=False, indent=2)))
+    emit(out_dir, "tags", "ready")
+
+
+def _use_mock_images(image_dir: Path) -> list[str]:
+    for img_path in MOCK_IMAGE_DIR.glob("*.*"):
+        link_into(img_path, image_dir)
+    paths = [str(p) for p in image_dir.glob("*.*")]
+    storage.publish(*paths)
+    return paths
+
+
+def _publish_variants(image_paths: list[str]) -> None:
+    """Publish the derivatives of the run's images (fetched images publish themselves)."""
+    storage.publish(*(
+        vp
+        for p in image_paths
+        for variant in derivatives.VARIANTS
+        if (vp := derivatives.variant_path(Path(p), variant)).exists()
+    ))
+
+
+async def _amake_variants(image_path: str, out_dir: Path, all_paths: list[str]) -> None:
+    """WebP thumbnails of the fetched images and the upload, then publish them."""
+    try:
+        # CPU-bound; one task per image so the derivative process pool shares them out
+        async with tracing.atrace("derivatives", out_dir, images=len(all_paths) + 1):
+            await asyncio.gather(
+                *(
+                    derivatives.arun(make_variants, [p])
+                    for p in _derivative_sources(image_path, out_dir, all_paths)
+                )
+            )
+        await asyncio.to_thread(_publish_variants, all_paths)
+    except Exception as e:
+        print(f"Derivatives for {out_dir.name} failed: {e}")
+
+
+@metrics.timed("images")
+async def _afetch_images(entities: list[str], per_entity: int, image_dir: Path) -> list[str]:
+    """
+    Search and download every entity concurrently. Whatever has finished by
+    ``IMAGE_STAGE_DEADLINE`` is returned (in entity order); the rest is cancelled.
+    """
+    tasks = [
+        asyncio.ensure_future(afetch_images_for_entity(ent, num=per_entity, out_dir=image_dir))
+        for ent in entities
+    ]
+    if not tasks:
+        return []
+    _, pending = await asyncio.wait(tasks, timeout=IMAGE_STAGE_DEADLINE)
+    for t in pending:
+        t.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        print(f"Image stage deadline hit; dropping {len(pending)} of {len(tasks)} entities")
+        tracing.annotate(dropped=len(pending))
+
+    all_paths = []
+    for ent, t in zip(entities, tasks):
+        if t in pending:
+            continue
+        try:
+            all_paths.extend(t.result())
+        except Exception as e:
+            print(f"Image fetch failed for {ent}: {e}")
+    tracing.annotate(entities=len(entities), images=len(all_paths))
+    return all_paths
+
+
+async def _afetch_entities(entities: list[str], per_entity: int, image_dir: Path) -> list[str]:
+    # Sync callers get a private loop; close its HTTP client before it goes away.
+    try:
+        return await _afetch_images(entities, per_entity, image_dir)
+    finally:
+        await http_client.aclose()
+
+
+def _derivative_sources(image_path: str, out_dir: Path, image_paths: list[str]) -> list[str]:
+    return [*image_paths, str(out_dir / Path(image_path).name)]
+
+
+def _prepare_image_dir(image_path: str, run_dir: Path | None) -> tuple[Path, Path]:
     out_dir = run_dir or _make_run_dir()
-    shutil.copy2(image_path, out_dir / Path(image_path).name)
+    link_into(image_path, out_dir)
 
     # subfolder for images
     image_dir = out_dir / "images"
     image_dir.mkdir(exist_ok=True)
+    return out_dir, image_dir
+
+
+# ---- Sync entry points (job workers, scripts) ----
+
+@tracing.traced("mode:music")
+def generate_music_from_image(
+    image_path: str,
+    language: str = "en",
+    run_dir: Path = None,
+    audio_path: str | None = None,
+    use_cache: bool = True,
+    prompt: str | None = None,
+    lyrics: str | None = None,
+    wait: bool = True,
+) -> str | None:
+    """
+    Returns the audio path. With ``wait=False`` the Udio task is only
+    submitted and its task id returned (``None`` if the audio already exists,
+    e.g. mock output); the caller is then responsible for polling it.
+    """
+    # 1) Prepare run_dir
+    out_dir = run_dir or _make_run_dir()
+    link_into(image_path, out_dir)
+
+    chords = None
+    if audio_path:
+        try:
+            chords = transcribe_chords(audio_path)
+            _save_chords(out_dir, chords)
+        except Exception as e:
+            print(f"Chord transcription failed: {e}")
+            emit(out_dir, "chords", "failed", error=str(e))
 
-    # 1) LLM → entities
-    uri = _to_data_url(image_path)
-    proc = ImageToVisualEntitiesProcessor(uri, language)
+    # 2) LLM → prompt + lyrics, unless the fused call already produced them
+    if not (prompt and prompt.strip()):
+        prompt, lyrics = _lyrics_from_image(image_path, language, chords, use_cache)
+
+    # 3) Store prompt and assemble assistant reply for Udio
+    assistant_reply = _save_prompt(out_dir, prompt, lyrics)
+
+    # 4) Inference (or mock)
     try:
-        entities = proc.process()
+        if not wait:
+            return submit_inference(assistant_reply, out_dir)
+        audio_path = run_inference(assistant_reply, out_dir)
     except Exception as e:
-        print(f"Entity extraction failed: {e}; continuing with empty list")
-        entities = []
+        print(f"Udio failed: {e}; using mock audio")
+        metrics.mock_fallback("udio")
+        audio_path = run_inference(assistant_reply, out_dir, use_mock=True)
+    return audio_path if wait else None
+
+
+@tracing.traced("mode:tags")
+def generate_tags_from_image(
+    image_path: str,
+    language: str = "en",
+    run_dir: Path = None,
+    use_cache: bool = True,
+    tags: list[str] | None = None,
+):
+    out_dir = run_dir or _make_run_dir()
+    link_into(image_path, out_dir)
+
+    if not tags:
+        tags = _tags_from_image(image_path, language, use_cache)
+
+    _save_tags(out_dir, tags)
+    return tags, out_dir
+
+
+@tracing.traced("mode:images")
+def generate_images_from_image(
+    image_path: str,
+    language: str = "en",
+    per_entity: int = 1,
+    run_dir: Path = None,
+    use_cache: bool = True,
+    entities: list[str] | None = None,
+):
+    out_dir, image_dir = _prepare_image_dir(image_path, run_dir)
+
+    # 1) LLM → entities, unless the fused call already produced them
+    if not entities:
+        entities = _entities_from_image(image_path, language, use_cache)
 
     # 2) MOCK: copy pre-made images
     if TEST_MODE:
-        mock_dir = Path(__file__).parent / "mock_data" / "images"
-        for img_path in mock_dir.glob("*.*"):
-            shutil.copy(img_path, image_dir)
-        all_paths = [str(p) for p in image_dir.glob("*.*")]
-        return entities, out_dir, all_paths
+        all_paths = _use_mock_images(image_dir)
+    else:
+        # 3) REAL: fetch all entities concurrently, bounded by the stage deadline
+        all_paths = asyncio.run(_afetch_entities(entities, per_entity, image_dir))
 
-    # 3) REAL: fetch per entity
-    all_paths = []
-    for ent in entities:
+        if not all_paths:
+            print("No images fetched; using mock images")
+            metrics.mock_fallback("images")
+            all_paths = _use_mock_images(image_dir)
+
+    # 4) WebP thumbnails of the fetched images and the upload
+    with tracing.span("derivatives", images=len(all_paths) + 1):
+        make_variants(_derivative_sources(image_path, out_dir, all_paths))
+    _publish_variants(all_paths)
+
+    emit(out_dir, "images", "ready", count=len(all_paths))
+    return entities, out_dir, all_paths
+
+
+# ---- Async entry points (request path; never block the event loop) ----
+
+@tracing.traced("mode:music")
+async def agenerate_music_from_image(
+    image_path: str,
+    language: str = "en",
+    run_dir: Path = None,
+    audio_path: str | None = None,
+    use_cache: bool = True,
+    prompt: str | None = None,
+    lyrics: str | None = None,
+) -> str:
+    out_dir = run_dir or await asyncio.to_thread(_make_run_dir)
+    await asyncio.to_thread(link_into, image_path, out_dir)
+
+    chords = None
+    if audio_path:
         try:
-            imgs = fetch_images_for_entity(ent, num=per_entity, out_dir=image_dir)
-            all_paths.extend(imgs)
+            chords = await atranscribe_chords(audio_path)
+            await asyncio.to_thread(_save_chords, out_dir, chords)
         except Exception as e:
-            print(f"Image fetch failed for {ent}: {e}")
+            print(f"Chord transcription failed: {e}")
+            emit(out_dir, "chords", "failed", error=str(e))
+
+    if not (prompt and prompt.strip()):
+        prompt, lyrics = await _alyrics_from_image(image_path, language, chords, use_cache)
+
+    assistant_reply = await asyncio.to_thread(_save_prompt, out_dir, prompt, lyrics)
+
+    try:
+        return await arun_inference(assistant_reply, out_dir)
+    except Exception as e:
+        print(f"Udio failed: {e}; using mock audio")
+        metrics.mock_fallback("udio")
+        return await arun_inference(assistant_reply, out_dir, use_mock=True)
+
+
+@tracing.traced("mode:tags")
+async def agenerate_tags_from_image(
+    image_path: str,
+    language: str = "en",
+    run_dir: Path = None,
+    use_cache: bool = True,
+    tags: list[str] | None = None,
+):
+    out_dir = run_dir or await asyncio.to_thread(_make_run_dir)
+    await asyncio.to_thread(link_into, image_path, out_dir)
+
+    if not tags:
+        tags = await _atags_from_image(image_path, language, use_cache)
+
+    await asyncio.to_thread(_save_tags, out_dir, tags)
+    return tags, out_dir
+
+
+@tracing.traced("mode:images")
+async def agenerate_images_from_image(
+    image_path: str,
+    language: str = "en",
+    per_entity: int = 1,
+    run_dir: Path = None,
+    use_cache: bool = True,
+    entities: list[str] | None = None,
+):
+    out_dir, image_dir = await asyncio.to_thread(_prepare_image_dir, image_path, run_dir)
+
+    if not entities:
+        entities = await _aentities_from_image(image_path, language, use_cache)
+
+    if TEST_MODE:
+        all_paths = await asyncio.to_thread(_use_mock_images, image_dir)
+    else:
+        all_paths = await _afetch_images(entities, per_entity, image_dir)
+
+        if not all_paths:
+            print("No images fetched; using mock images")
+            metrics.mock_fallback("images")
+            all_paths = await asyncio.to_thread(_use_mock_images, image_dir)
 
-    if not all_paths:
-        print("No images fetched; using mock images")
-        mock_dir = Path(__file__).parent / "mock_data" / "images"
-        for img_path in mock_dir.glob("*.*"):
-            shutil.copy(img_path, image_dir)
-        all_paths = [str(p) for p in image_dir.glob("*.*")]
+    # Thumbnails render after "ready"; fetch renders any still missing on demand
+    task = asyncio.create_task(_amake_variants(image_path, out_dir, all_paths))
+    _variant_tasks.add(task)
+    task.add_done_callback(_variant_tasks.discard)
 
-    return entities, out_dir, all_paths
\ No newline at end of file
+    emit(out_dir, "images", "ready", count=len(all_paths))
+    return entities, out_dir, all_paths
@@ -0,0 +1,334 @@
+"""
+Retention of run folders and uploads.
+
+A background process sweeps ``output/`` and ``uploads/`` incrementally:
+each step looks at no more than ``RETENTION_BATCH`` entries and then
+resumes where it stopped, so the tree is never walked in one go.
+
+Runs are deleted once their last use is older than ``RUN_MAX_AGE_DAYS``. A
+run's last use is its last fetch, taken from the analytics rollups, or else
+its newest file. When the runs add up to more than ``OUTPUT_MAX_GB``, the
+least recently used go first. Pinned runs, runs with unfinished jobs and
+runs younger than ``RETENTION_MIN_AGE`` are never touched. A run's size
+counts each hardlinked file only by its share, so it estimates what
+deleting the run frees.
+
+Upload files (blobs, prepared images, derivatives) are only candidates once
+no run links to them any more (``st_nlink == 1``) and no unfinished job
+references them. They are deleted by age (``UPLOAD_MAX_AGE_DAYS``) or, when
+over ``UPLOAD_MAX_GB``, oldest first. Every deletion is counted in metrics.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Optional
+
+from sqlmodel import Field, Session, SQLModel, func, select
+
+import metrics
+import storage
+from analytics import RunFetchCount
+from blob_store import UPLOAD_DIR
+from config import (
+    OUTPUT_MAX_GB,
+    RETENTION_BATCH,
+    RETENTION_INTERVAL,
+    RETENTION_MIN_AGE,
+    RUN_MAX_AGE_DAYS,
+    UPLOAD_MAX_AGE_DAYS,
+    UPLOAD_MAX_GB,
+)
+from jobs import Job, JobFollower, POLLING, QUEUED, RUNNING
+from log_db import engine
+from pipeline import OUTPUT_ROOT
+
+GB = 1024 ** 3
+
+
+class RunUsage(SQLModel, table=True):
+    folder: str = Field(primary_key=True)
+    bytes: int = 0
+    modified_at: Optional[datetime] = None  # newest file in the run
+    pinned: bool = False
+    scanned_at: Optional[datetime] = None
+
+
+def pin(folder: str, pinned: bool = True) -> None:
+    with Session(engine) as db:
+        row = db.get(RunUsage, folder) or RunUsage(folder=folder)
+        row.pinned = pinned
+        db.add(row)
+        db.commit()
+
+
+def _iter_files(root: Path) -> Iterator[os.DirEntry]:
+    """Files under ``root``, lazily, one directory listing at a time."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+def _iter_runs() -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(OUTPUT_ROOT) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def _run_size(path: Path) -> tuple[int, float]:
+    """Bytes deleting the run would free (hardlinks counted by share) and its newest mtime."""
+    size, newest = 0, os.stat(path).st_mtime
+    for entry in _iter_files(path):
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        size += st.st_size // max(1, st.st_nlink)
+        newest = max(newest, st.st_mtime)
+    return size, newest
+
+
+def _pending() -> tuple[set[str], set[str]]:
+    """Folders (own or following) and upload paths of unfinished jobs."""
+    with Session(engine) as db:
+        jobs = db.exec(select(Job).where(Job.status.in_([QUEUED, RUNNING, POLLING]))).all()
+        following = db.exec(select(JobFollower.folder).where(JobFollower.mirrored == False)).all()  # noqa: E712
+    folders = {j.folder for j in jobs} | set(following)
+    paths = {
+        str(Path(p).resolve())
+        for j in jobs
+        for p in (j.args.get("image_path"), j.args.get("audio_path"))
+        if p
+    }
+    return folders, paths
+
+
+def _last_fetch(db: Session, folders: list[str]) -> dict[str, datetime]:
+    rows = db.exec(
+        select(RunFetchCount.folder, func.max(RunFetchCount.last_at))
+        .where(RunFetchCount.folder.in_(folders))
+        .group_by(RunFetchCount.folder)
+    ).all()
+    return {folder: at for folder, at in rows if at is not None}
+
+
+class RetentionManager:
+    def __init__(self):
+        self.runs: Iterator[os.DirEntry] | None = None
+        self.seen_runs: set[str] = set()
+        self.uploads: Iterator[os.DirEntry] | None = None
+        self.upload_total = 0
+        self.upload_candidates: list[tuple[float, int, str]] = []
+        self.run_quota_due = False
+        self.upload_excess = 0
+
+    # ---- runs ----
+
+    def _delete_run(self, db: Session, row: RunUsage, reason: str) -> None:
+        folder, size = row.folder, row.bytes
+        shutil.rmtree(OUTPUT_ROOT / folder, ignore_errors=True)
+        try:
+            storage.get().delete_prefix(f"{folder}/")
+        except Exception as e:
+            print(f"Could not delete {folder} from the output store: {e}")
+        if row in db and row not in db.new:
+            db.delete(row)
+        else:
+            db.expunge(row)
+        metrics.inc("retention_deleted_total", kind="run", reason=reason)
+        metrics.inc("retention_deleted_bytes_total", size, kind="run", reason=reason)
+        print(f"🧹 deleted run {folder} ({reason}, {size / 1e6:.1f} MB)")
+
+    def _protected(self, row: RunUsage, pending: set[str], now: datetime) -> bool:
+        return (
+            row.pinned
+            or row.folder in pending
+            or (row.modified_at is not None and now - row.modified_at < timedelta(seconds=RETENTION_MIN_AGE))
+        )
+
+    def scan_runs(self, pending: set[str]) -> int:
+        """Size the next batch of runs and delete those past ``RUN_MAX_AGE_DAYS``."""
+        if self.runs is None:
+            self.runs, self.seen_runs = _iter_runs(), set()
+        batch = []
+        for entry in self.runs:
+            batch.append(entry)
+            if len(batch) >= RETENTION_BATCH:
+                break
+        else:
+            self.runs = None  # pass complete; quota is checked next
+
+        now = datetime.utcnow()
+        deleted = 0
+        with Session(engine) as db:
+            last_fetch = _last_fetch(db, [e.name for e in batch])
+            for entry in batch:
+                try:
+                    size, newest = _run_size(Path(entry.path))
+                except FileNotFoundError:
+                    continue
+                row = db.get(RunUsage, entry.name) or RunUsage(folder=entry.name)
+                row.bytes = size
+                row.modified_at = datetime.utcfromtimestamp(newest)
+                row.scanned_at = now
+                db.add(row)
+                last_use = max(row.modified_at, last_fetch.get(entry.name, row.modified_at))
+                if (
+                    RUN_MAX_AGE_DAYS > 0
+                    and now - last_use > timedelta(days=RUN_MAX_AGE_DAYS)
+                    and not self._protected(row, pending, now)
+                ):
+                    self._delete_run(db, row, "age")
+                    deleted += 1
+                else:
+                    self.seen_runs.add(entry.name)
+            if self.runs is None:
+                # Forget runs deleted by hand since the last pass
+                for row in db.exec(select(RunUsage)).all():
+                    if row.folder not in self.seen_runs and not row.pinned:
+                        db.delete(row)
+                self.run_quota_due = True
+            db.commit()
+        return deleted
+
+    def enforce_run_quota(self, pending: set[str]) -> int:
+        """Delete least recently used runs, a batch at a time, while over ``OUTPUT_MAX_GB``."""
+        if OUTPUT_MAX_GB <= 0:
+            self.run_quota_due = False
+            return 0
+        now = datetime.utcnow()
+        deleted = 0
+        with Session(engine) as db:
+            total = db.exec(select(func.coalesce(func.sum(RunUsage.bytes), 0))).one()
+            metrics.gauge_set("retention_bytes", total, kind="run")
+            excess = total - OUTPUT_MAX_GB * GB
+            if excess <= 0:
+                self.run_quota_due = False
+                return 0
+            rows = db.exec(select(RunUsage).where(RunUsage.pinned == False)).all()  # noqa: E712
+            last_fetch = _last_fetch(db, [r.folder for r in rows])
+
+            def last_use(r: RunUsage) -> datetime:
+                modified = r.modified_at or datetime.min
+                return max(modified, last_fetch.get(r.folder, modified))
+
+            for row in sorted(rows, key=last_use):
+                if excess <= 0 or deleted >= RETENTION_BATCH:
+                    break
+                if self._protected(row, pending, now):
+                    continue
+                excess -= row.bytes
+                self._delete_run(db, row, "quota")
+                deleted += 1
+            db.commit()
+        # Still over: the next step continues; nothing left to delete: wait for the next pass
+        self.run_quota_due = excess > 0 and deleted >= RETENTION_BATCH
+        return deleted
+
+    # ---- uploads ----
+
+    def _delete_upload(self, path: str, size: int, reason: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        metrics.inc("retention_deleted_total", kind="upload", reason=reason)
+        metrics.inc("retention_deleted_bytes_total", size, kind="upload", reason=reason)
+
+    def scan_uploads(self, pending: set[str]) -> int:
+        """Check the next batch of upload files; delete unreferenced ones past ``UPLOAD_MAX_AGE_DAYS``."""
+        if self.uploads is None:
+            self.uploads, self.upload_total, self.upload_candidates = _iter_files(UPLOAD_DIR), 0, []
+        now = time.time()
+        deleted = 0
+        for n, entry in enumerate(self.uploads):
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            self.upload_total += st.st_size
+            age = now - st.st_mtime
+            unreferenced = (
+                st.st_nlink == 1
+                and age > RETENTION_MIN_AGE
+                and str(Path(entry.path).resolve()) not in pending
+            )
+            if unreferenced:
+                if UPLOAD_MAX_AGE_DAYS > 0 and age > UPLOAD_MAX_AGE_DAYS * 86400:
+                    self._delete_upload(entry.path, st.st_size, "age")
+                    self.upload_total -= st.st_size
+                    deleted += 1
+                else:
+                    self.upload_candidates.append((st.st_mtime, st.st_size, entry.path))
+            if n + 1 >= RETENTION_BATCH:
+                return deleted
+
+        # Pass complete: oldest unreferenced files go while over quota
+        metrics.gauge_set("retention_bytes", self.upload_total, kind="upload")
+        self.uploads = None
+        if UPLOAD_MAX_GB > 0:
+            self.upload_excess = self.upload_total - UPLOAD_MAX_GB * GB
+            self.upload_candidates.sort()
+        return deleted
+
+    def enforce_upload_quota(self, pending: set[str]) -> int:
+        deleted = 0
+        while self.upload_excess > 0 and self.upload_candidates and deleted < RETENTION_BATCH:
+            _, size, path = self.upload_candidates.pop(0)
+            if str(Path(path).resolve()) in pending:
+                continue
+            try:
+                if os.stat(path).st_nlink > 1:
+                    continue  # linked into a run since the scan
+            except FileNotFoundError:
+                continue
+            self._delete_upload(path, size, "quota")
+            self.upload_excess -= size
+            deleted += 1
+        if not self.upload_candidates:
+            self.upload_excess = 0
+        return deleted
+
+    def step(self) -> int:
+        """One bounded unit of work; returns the number of deletions."""
+        folders, paths = _pending()
+        if self.run_quota_due:
+            deleted = self.enforce_run_quota(folders)
+        else:
+            deleted = self.scan_runs(folders)
+        if self.upload_excess > 0:
+            deleted += self.enforce_upload_quota(paths)
+        else:
+            deleted += self.scan_uploads(paths)
+        return deleted
+
+
+def retention_loop() -> None:
+    # Never share pooled connections inherited from the parent process.
+    engine.dispose()
+    print(f"🧹 retention sweeper started (pid {os.getpid()})")
+    metrics.start_exporter("retention")
+    manager = RetentionManager()
+    while True:
+        try:
+            deleted = manager.step()
+        except Exception as e:
+            print(f"Retention step failed: {e}")
+            deleted = 0
+        # Keep going while there is work; otherwise sweep gently
+        time.sleep(1.0 if deleted else RETENTION_INTERVAL)
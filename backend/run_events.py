@@ -0,0 +1,106 @@
+"""
+Per-run completion events.
+
+Pipeline stages append one JSON line to ``events.jsonl`` in the run folder as
+each asset is written or fails. Appends are atomic across processes, so job
+workers and the web server can share the file, and ``/runs/{folder}/events``
+tails it as a Server-Sent Events stream.
+
+Every run ends with a terminal ``run`` event (``done`` or ``failed``); a run
+whose music job is queued gets a ``run queued`` event first, so the stream
+knows to wait for it.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable
+
+from config import EVENTS_STREAM_TIMEOUT
+
+EVENTS_FILE = "events.jsonl"
+TERMINAL = {"done", "failed"}
+
+
+def emit(run_dir: Path, asset: str, status: str, **info) -> None:
+    ev = {"asset": asset, "status": status, "ts": time.time(), **info}
+    line = json.dumps(ev, ensure_ascii=False) + "\n"
+    try:
+        with open(Path(run_dir) / EVENTS_FILE, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Could not record {asset} {status} event: {e}")
+
+
+def count_events(run_dir: Path) -> int:
+    fp = Path(run_dir) / EVENTS_FILE
+    if not fp.exists():
+        return 0
+    with open(fp, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def _format(event_id: int, line: str) -> str:
+    return f"id: {event_id}\ndata: {line}\n\n"
+
+
+async def stream_events(
+    run_dir: Path,
+    since: int = 0,
+    is_disconnected: Callable[[], Awaitable[bool]] | None = None,
+    pending: Callable[[], Awaitable[bool]] | None = None,
+    timeout: float = EVENTS_STREAM_TIMEOUT,
+    interval: float = 0.5,
+) -> AsyncIterator[str]:
+    """
+    Yield SSE frames for events after the ``since``-th line until the run
+    reaches a terminal state, the client goes away or ``timeout`` expires.
+    A run that is already settled (its last ``run`` event is terminal, or it
+    has none and ``pending()`` is false) ends the stream once it is caught up.
+    """
+    fp = Path(run_dir) / EVENTS_FILE
+    event_id = 0
+    offset = 0
+    buf = b""
+    deadline = time.monotonic() + timeout
+    last_sent = time.monotonic()
+    run_status = None  # of the latest run event, including those before ``since``
+
+    yield "retry: 3000\n\n"
+    while time.monotonic() < deadline:
+        if is_disconnected is not None and await is_disconnected():
+            return
+
+        new = False
+        if fp.exists() and fp.stat().st_size > offset:
+            with open(fp, "rb") as f:
+                f.seek(offset)
+                chunk = f.read()
+            offset += len(chunk)
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for raw in lines:
+                event_id += 1
+                if not raw.strip():
+                    continue
+                line = raw.decode("utf-8")
+                ev = json.loads(line)
+                if ev.get("asset") == "run":
+                    run_status = ev.get("status")
+                if event_id <= since:
+                    continue
+                yield _format(event_id, line)
+                last_sent = time.monotonic()
+                new = True
+        if run_status in TERMINAL:
+            return
+        if not new and run_status is None and pending is not None and not await pending():
+            return  # no run events and no job: nothing more will be written
+
+        # Comment frames keep proxies from closing an idle stream.
+        if time.monotonic() - last_sent > 15:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(interval)
@@ -1,29 +1,80 @@
-import os, requests, io
+import asyncio
+import hashlib
+import json
+import os, io
+import tempfile
+import weakref
 from pathlib import Path
 from PIL import Image
+import http_client
+import metrics
+import storage
+import tracing
+from blob_store import link_into
+from cache import FileCache, NullCache, SQLiteCache
+from config import (
+    IMAGE_FETCH_CONCURRENCY,
+    IMAGE_EXTRA_CANDIDATES,
+    SEARCH_CACHE_ENABLED,
+    SEARCH_CACHE_PATH,
+    SEARCH_CACHE_MAX_MB,
+    SEARCH_CACHE_TTL_HOURS,
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_MAX_MB,
+    IMAGE_MAX_BYTES,
+    IMAGE_MAX_PIXELS,
+)
 
 API_KEY = os.getenv("SERPAPI_API_KEY")
 SEARCH_URL = "https://serpapi.com/search.json"
 ALLOWED_FORMATS = {"jpg", "jpeg", "png", "gif"}
+CHUNK_SIZE = 64 * 1024
 
-def fetch_images_for_entity(entity: str, num: int = 1, out_dir: Path = None):
-    """
-    Query SerpAPI for `entity`, download top `num` images into out_dir,
-    verify validity, return list of local file paths.
-    """
+# Search results by (query, engine, page); downloaded images by source URL.
+SEARCH_CACHE = (
+    SQLiteCache(SEARCH_CACHE_PATH, int(SEARCH_CACHE_MAX_MB * 1024 * 1024), SEARCH_CACHE_TTL_HOURS * 3600)
+    if SEARCH_CACHE_ENABLED
+    else NullCache()
+)
+IMAGE_CACHE = (
+    FileCache(IMAGE_CACHE_DIR, int(IMAGE_CACHE_MAX_MB * 1024 * 1024))
+    if SEARCH_CACHE_ENABLED
+    else None
+)
+
+_slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _search_params(entity: str) -> dict:
     if not API_KEY:
         raise RuntimeError("SERPAPI_API_KEY not set in environment")
-    params = {
+    return {
         "engine": "google_images",
         "q": entity,
         "api_key": API_KEY,
         "tbm": "isch",
         "ijn": "0"
     }
-    res = requests.get(SEARCH_URL, params=params, timeout=10)
-    data = res.json().get("images_results", [])[:num]
-    paths = []
-    for idx, img in enumerate(data):
+
+
+def _search_key(params: dict) -> str:
+    ident = {k: params[k] for k in ("engine", "q", "tbm", "ijn")}
+    return "serp:" + hashlib.sha256(json.dumps(ident, sort_keys=True).encode()).hexdigest()
+
+
+def _cached_results(params: dict) -> list | None:
+    cached = SEARCH_CACHE.get(_search_key(params))
+    return json.loads(cached) if cached is not None else None
+
+
+def _store_results(params: dict, results: list) -> None:
+    if results:
+        SEARCH_CACHE.set(_search_key(params), json.dumps(results))
+
+
+def _candidates(results: list, num: int):
+    """Yield ``(idx, url, ext)`` for the first ``num`` results with a usable format."""
+    for idx, img in enumerate(results[:num]):
         img_url = img.get("original") or img.get("thumbnail")
         if not img_url: continue
 
@@ -31,18 +82,157 @@ def fetch_images_for_entity(entity: str, num: int = 1, out_dir: Path = None):
         ext = img_url.split(".")[-1].split("?")[0].lower()
         if ext not in ALLOWED_FORMATS:
             continue
+        yield idx, img_url, ext
 
-        # Download image content
+
+def _image_name(entity: str, idx: int, ext: str) -> str:
+    return f"{entity.replace(' ', '_')}_{idx}.{ext}"
+
+
+class _ImageSink:
+    """
+    Streams one download into a temp file. The response is rejected from its
+    headers (Content-Type, Content-Length) and again by the image header in
+    its first ``HEAD_BYTES`` (format and dimensions, sniffed once); the body
+    is cut off at ``IMAGE_MAX_BYTES``. Memory stays bounded by ``HEAD_BYTES``.
+    ``open``, ``feed``, ``finish`` and ``discard`` do file I/O.
+    """
+
+    HEAD_BYTES = 64 * 1024  # JPEGs with large EXIF blocks put SOF further in
+    FORMATS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif"}
+
+    def __init__(self, headers, tmp_dir: Path):
+        ctype = headers.get("content-type", "").split(";")[0].strip().lower()
+        if ctype and not ctype.startswith("image/") and ctype != "application/octet-stream":
+            raise ValueError(f"not an image: {ctype}")
+        length = headers.get("content-length", "")
+        if length.isdigit() and int(length) > IMAGE_MAX_BYTES:
+            raise ValueError(f"too large: {length} bytes")
+        self.tmp_dir = tmp_dir
+        self.path = None
+        self.file = None
+        self.size = 0
+        self.head = b""
+        self.ext = None
+
+    def open(self) -> None:
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=self.tmp_dir, prefix=".dl-")
+        self.file = os.fdopen(fd, "wb")
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > IMAGE_MAX_BYTES:
+            raise ValueError(f"too large: over {IMAGE_MAX_BYTES} bytes")
+        self.file.write(chunk)
+        if self.ext is None and len(self.head) < self.HEAD_BYTES:
+            self.head += chunk[: self.HEAD_BYTES - len(self.head)]
+            if len(self.head) == self.HEAD_BYTES:
+                self._check_head()
+
+    def _check_head(self) -> None:
+        try:
+            with Image.open(io.BytesIO(self.head)) as im:
+                fmt, (w, h) = im.format, im.size
+        except Image.DecompressionBombError as e:
+            raise ValueError(str(e))
+        except Exception:
+            raise ValueError("unrecognised image header")
+        if fmt not in self.FORMATS:
+            raise ValueError(f"unsupported format: {fmt}")
+        if w * h > IMAGE_MAX_PIXELS:
+            raise ValueError(f"too many pixels: {w}x{h}")
+        self.ext = self.FORMATS[fmt]
+        self.head = b""
+
+    def finish(self) -> tuple[Path, str]:
+        self.file.close()
+        if self.ext is None:
+            self._check_head()
+        return Path(self.path), self.ext
+
+    def discard(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            Path(self.path).unlink(missing_ok=True)
+
+
+def _tmp_dir(out_dir: Path) -> Path:
+    # Same filesystem as the final location so the file can be renamed into place.
+    return IMAGE_CACHE.root if IMAGE_CACHE is not None else out_dir
+
+
+def _keep(img_url: str, path: Path, ext: str) -> Path:
+    """Move a finished download into the image cache (when enabled)."""
+    if IMAGE_CACHE is None:
+        return path
+    return IMAGE_CACHE.put_file(img_url, path, f".{ext}")
+
+
+def _place(img: Path, entity: str, idx: int, ext: str, out_dir: Path) -> str:
+    """
+    Hardlink a cached image into ``out_dir``, or rename an uncached download
+    there, and publish it to the output store.
+    """
+    fname = _image_name(entity, idx, ext)
+    if IMAGE_CACHE is not None:
+        local = link_into(img, out_dir, fname)
+    else:
+        local = out_dir / fname
+        os.replace(img, local)
+    storage.publish(local)
+    return str(local)
+
+
+def _discard(img: Path) -> None:
+    # Cached files stay for the next run; uncached spares are temp files.
+    if IMAGE_CACHE is None:
+        img.unlink(missing_ok=True)
+
+
+def _cached_image(img_url: str) -> tuple[Path, str] | None:
+    if IMAGE_CACHE is None:
+        return None
+    path = IMAGE_CACHE.get(img_url)
+    return (path, path.suffix.lstrip(".")) if path is not None else None
+
+
+@metrics.timed("image_download")
+def _download(img_url: str, out_dir: Path) -> tuple[Path, str]:
+    # no retries: a failing candidate is simply skipped
+    with http_client.stream("GET", img_url, timeout=10, retries=0) as res:
+        res.raise_for_status()
+        sink = _ImageSink(res.headers, _tmp_dir(out_dir))
         try:
-            img_data = requests.get(img_url, timeout=10).content
+            sink.open()
+            for chunk in res.iter_bytes(CHUNK_SIZE):
+                sink.feed(chunk)
+            path, ext = sink.finish()
+        except BaseException:
+            sink.discard()
+            raise
+    tracing.annotate(bytes=sink.size)
+    return _keep(img_url, path, ext), ext
 
-            # Verify valid image
-            Image.open(io.BytesIO(img_data)).verify()
 
-            fname = f"{entity.replace(' ', '_')}_{idx}.{ext}"
-            local = out_dir / fname
-            local.write_bytes(img_data)
-            paths.append(str(local))
+def fetch_images_for_entity(entity: str, num: int = 1, out_dir: Path = None):
+    """
+    Query SerpAPI for `entity`, download top `num` images into out_dir,
+    verify validity, return list of local file paths.
+    """
+    params = _search_params(entity)
+    data = _cached_results(params)
+    if data is None:
+        with metrics.timer("image_search"):
+            res = http_client.get(SEARCH_URL, params=params, timeout=10)
+        data = res.json().get("images_results", [])
+        _store_results(params, data)
+    paths = []
+    for idx, img_url, ext in _candidates(data, num):
+        # Download image content
+        try:
+            img, ext = _cached_image(img_url) or _download(img_url, out_dir)
+            paths.append(_place(img, entity, idx, ext, out_dir))
         except Exception:
             continue
 
@@ -50,4 +240,81 @@ def fetch_images_for_entity(entity: str, num: int = 1, out_dir: Path = None):
         if len(paths) >= num:
             break
 
-    return paths
\ No newline at end of file
+    return paths
+
+
+def _fetch_slots() -> asyncio.Semaphore:
+    """Global cap on concurrent SerpAPI/image requests for the running loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _slots:
+        _slots[loop] = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+    return _slots[loop]
+
+
+@metrics.timed("image_download")
+async def _adownload(img_url: str, out_dir: Path) -> tuple[Path, str]:
+    cached = await asyncio.to_thread(_cached_image, img_url)
+    if cached is not None:
+        tracing.annotate(cached=True)
+        return cached
+    async with _fetch_slots():
+        # no retries: a failing candidate is simply replaced by the next one
+        async with http_client.astream("GET", img_url, timeout=10, retries=0) as res:
+            res.raise_for_status()
+            sink = _ImageSink(res.headers, _tmp_dir(out_dir))
+            try:
+                await asyncio.to_thread(sink.open)
+                async for chunk in res.aiter_bytes(CHUNK_SIZE):
+                    await asyncio.to_thread(sink.feed, chunk)
+                path, ext = await asyncio.to_thread(sink.finish)
+            except BaseException:
+                await asyncio.to_thread(sink.discard)
+                raise
+    tracing.annotate(bytes=sink.size)
+    if IMAGE_CACHE is None:
+        return path, ext
+    return await asyncio.to_thread(_keep, img_url, path, ext), ext
+
+
+async def afetch_images_for_entity(entity: str, num: int = 1, out_dir: Path = None):
+    """
+    Async ``fetch_images_for_entity``. Downloads ``num`` candidates plus up to
+    ``IMAGE_EXTRA_CANDIDATES`` spares in parallel and keeps the first ``num``
+    that verify, in search-rank order: a candidate is only taken once every
+    higher-ranked one has verified or failed.
+    """
+    params = _search_params(entity)
+    data = await asyncio.to_thread(_cached_results, params)
+    if data is None:
+        async with _fetch_slots():
+            with metrics.timer("image_search"):
+                res = await http_client.aget(SEARCH_URL, params=params, timeout=10)
+        data = res.json().get("images_results", [])
+        await asyncio.to_thread(_store_results, params, data)
+
+    candidates = list(_candidates(data, num + IMAGE_EXTRA_CANDIDATES))
+    tasks = {
+        asyncio.ensure_future(_adownload(img_url, out_dir)): idx
+        for idx, img_url, _ in candidates
+    }
+    paths = []
+    taken = set()
+    try:
+        for t, idx in tasks.items():  # rank order
+            try:
+                img, ext = await t
+            except Exception:
+                continue
+            taken.add(t)
+            paths.append(await asyncio.to_thread(_place, img, entity, idx, ext, out_dir))
+            if len(paths) >= num:
+                break
+    finally:
+        for t in tasks:
+            t.cancel()
+
+    # Spares that also finished are dropped (cached ones stay cached).
+    for t in tasks:
+        if t not in taken and t.done() and not t.cancelled() and t.exception() is None:
+            await asyncio.to_thread(_discard, t.result()[0])
+    return paths
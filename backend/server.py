@@ -1,38 +1,76 @@
-import shutil
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI, UploadFile, Request, File, Form, HTTPException, BackgroundTasks, Depends
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, Request, File, Form, HTTPException, Query
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+import analytics
+import asset_cache
+import audio_formats
+import coalesce
 import dev_tools
+import derivatives
+import http_client
+import metrics
+import retention  # noqa: F401  (registers the RunUsage table)
+import storage
+import tracing
 from starlette.middleware.base import BaseHTTPMiddleware
-from sqlmodel import Session as DBSession, SQLModel
+from sqlmodel import SQLModel
 import time
 from uuid import uuid4
 
 from log_db import (
     create_db_and_tables,
-    get_session,
+    flush_events,
     log_event,
-    SessionEntry,
-    engine as DB_ENGINE,
+    report_db_settings,
+    touch_session,
 )
 
 from pipeline import (
     _make_run_dir,
-    generate_music_from_image,
-    generate_tags_from_image,
-    generate_images_from_image,
+    agenerate_bundle_from_image,
+    agenerate_tags_from_image,
+    agenerate_images_from_image,
 )
-from udio_module import run_inference
+from blob_store import UPLOAD_DIR, link_into, save_stream, write_manifest
+from image_prep import data_url_for
+from run_events import count_events, emit, stream_events
+from jobs import enqueue_job, follow_job, get_job, job_counts, job_pending, start_workers, stop_workers
+from config import COALESCE_ENABLED, JOB_WORKERS
 
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics.start_exporter("server")
+    workers = start_workers(JOB_WORKERS)
+    rollups = asyncio.create_task(analytics.rollup_loop())
+    yield
+    rollups.cancel()
+    stop_workers(workers)
+    derivatives.shutdown()
+    await http_client.aclose()
+    await run_in_threadpool(flush_events)
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(dev_tools.router)
+app.include_router(analytics.router)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://jingtianwu.github.io"],  # or ["*"] for testing
@@ -49,17 +87,12 @@ class SessionIDMiddleware(BaseHTTPMiddleware):
             sid = uuid4().hex
         request.state.session_id = sid
 
-        with DBSession(DB_ENGINE) as db:
-            sess = db.get(SessionEntry, sid)
-            if not sess:
-                sess = SessionEntry(
-                    id=sid,
-                    user_agent=request.headers.get("user-agent", ""),
-                    locale=request.headers.get("accept-language"),
-                )
-                db.add(sess)
-            sess.ended_at = None
-            db.commit()
+        # Cached; new sessions and last-seen updates go through the batched log writer
+        touch_session(
+            sid,
+            user_agent=request.headers.get("user-agent", ""),
+            locale=request.headers.get("accept-language"),
+        )
 
         response = await call_next(request)
         response.headers["x-omni-session"] = sid
@@ -67,133 +100,291 @@ class SessionIDMiddleware(BaseHTTPMiddleware):
 
 
 app.add_middleware(SessionIDMiddleware)
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        metrics.gauge_add("inflight_requests", 1)
+        try:
+            return await call_next(request)
+        finally:
+            metrics.gauge_add("inflight_requests", -1)
+
+
+app.add_middleware(MetricsMiddleware)
 create_db_and_tables()
+report_db_settings()
+storage.report_storage()
 
 @app.api_route("/", methods=["GET", "HEAD"], include_in_schema=False)
 def root(request: Request):
     return {"status": "OmniWizz API is live"}
 
-UPLOAD_DIR = Path(__file__).parent / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR = Path(__file__).parent.parent / "output"
+OUTPUT_DIR = storage.OUTPUT_ROOT
 
 
 @app.post("/generate")
 async def generate(
-    background_tasks: BackgroundTasks,
     request: Request,
     file: UploadFile = File(...),
     audio: UploadFile | None = File(None),
     language: str = "en",
     modes: str = "music,tags,images",  # default all three
-    db: DBSession = Depends(get_session),
+    fresh: bool = False,  # bypass the LLM result cache
 ):
-    start_t = time.monotonic()
-    # 1) Write upload to disk
-    img_path = UPLOAD_DIR / file.filename
-    with open(img_path, "wb") as out:
-        shutil.copyfileobj(file.file, out)
+    # Spans are kept until the request ends; the run folder is bound once created
+    async with tracing.atrace("generate", modes=modes) as trace:
+        return await _generate(request, file, audio, language, modes, fresh, trace)
+
 
-    audio_path = None
-    if audio is not None:
-        audio_path = UPLOAD_DIR / audio.filename
-        with open(audio_path, "wb") as out:
-            shutil.copyfileobj(audio.file, out)
+async def _generate(
+    request: Request,
+    file: UploadFile,
+    audio: UploadFile | None,
+    language: str,
+    modes: str,
+    fresh: bool,
+    trace: tracing.Trace,
+):
+    start_t = time.monotonic()
+    # 1) Stream uploads into the content-addressed blob store
+    with metrics.timer("upload_write"):
+        img_path = await run_in_threadpool(save_stream, file.file, file.filename)
+        audio_path = None
+        if audio is not None:
+            audio_path = await run_in_threadpool(save_stream, audio.file, audio.filename)
+    # Resize/re-encode once up front; every processor reuses the cached data URL
+    with metrics.timer("image_prep"):
+        await run_in_threadpool(data_url_for, img_path)
 
     # 2) Create single run folder
-    run_dir = _make_run_dir()
-    results = {}
+    run_dir = await run_in_threadpool(_make_run_dir)
+    trace.bind(run_dir)
+    await run_in_threadpool(
+        write_manifest,
+        run_dir,
+        image=(img_path, file.filename),
+        audio=(audio_path, audio.filename) if audio_path else None,
+    )
 
     modes_set = set(modes.lower().split(","))
 
-    try:
-        # 3a) Tags first
-        if "tags" in modes_set:
-            tags, _ = generate_tags_from_image(str(img_path), language, run_dir)
-            folder = run_dir.name
-            results["tags"] = {
-                "folder": folder,
-                "tags": tags,
-                "tags_url": f"/output/{folder}/tags.json",
-            }
-
-        # 3b) Images next
-        if "images" in modes_set:
-            entities, _, image_paths = generate_images_from_image(
-                str(img_path), language, run_dir=run_dir
-            )
-            folder = run_dir.name
-            image_urls = [
-                f"/output/{folder}/images/{Path(p).name}" for p in image_paths
-            ]
-            results["images"] = {
-                "folder": folder,
-                "entities": [str(e) for e in entities],
-                "images": image_urls,
-            }
-
-        # 3c) Music last (async)
-        if "music" in modes_set:
-            folder = run_dir.name
-            background_tasks.add_task(
-                generate_music_from_image,
-                str(img_path),
-                language,
-                run_dir,
-                str(audio_path) if audio_path else None,
-            )
-            results["music"] = {
-                "folder": folder,
-                "audio_url": f"/output/{folder}/audio.wav",
-                "lyrics_url": f"/output/{folder}/lyrics.lrc",
-                "prompt_url": f"/output/{folder}/prompt.txt",
-                "pending": True,
-            }
+    async def compute() -> dict:
+        return await _run_modes(run_dir, img_path, audio_path, language, modes_set, fresh)
 
+    try:
+        # 3) Identical requests in flight share one computation; each keeps its own folder
+        if COALESCE_ENABLED:
+            key = await run_in_threadpool(coalesce.flight_key, img_path, audio_path, language, fresh, modes_set)
+            shared, led = await flights.run(key, compute)
+        else:
+            shared, led = await compute(), True
+        if not led:
+            with tracing.span("follow", leader=shared["run_dir"].name):
+                shared = await run_in_threadpool(_follow, shared, run_dir, img_path, modes_set)
     except Exception as e:
+        metrics.observe("stage_seconds", time.monotonic() - start_t, stage="generate", outcome="error")
+        emit(run_dir, "run", "failed", error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+    results = _results(run_dir.name, shared)
     latency = time.monotonic() - start_t
+    metrics.observe("stage_seconds", latency, stage="generate", outcome="ok")
     log_event(
-        db,
         request.state.session_id,
         "generate",
         modes=modes,
         folder=run_dir.name,
         latency=latency,
+        coalesced=not led,
     )
 
     return results
 
 
+flights = coalesce.SingleFlight()
+
+
+async def _run_modes(
+    run_dir: Path,
+    img_path: Path,
+    audio_path: Path | None,
+    language: str,
+    modes_set: set[str],
+    fresh: bool,
+) -> dict:
+    """Run the requested modes into ``run_dir``; returns what followers need to share it."""
+    shared = {"run_dir": run_dir}
+
+    # a) One fused LLM call covers every requested mode it can; the
+    #    per-mode processors remain the fallback for anything it misses.
+    bundle = {}
+    fused = [m for m in ("tags", "images", "music") if m in modes_set]
+    if audio_path and "music" in fused:
+        fused.remove("music")  # lyrics need the transcribed chords first
+    if len(fused) > 1:
+        bundle = await agenerate_bundle_from_image(
+            str(img_path), language, fused, use_cache=not fresh
+        )
+
+    # b) Tags and images run concurrently on the event loop
+    stages = {}
+    if "tags" in modes_set:
+        stages["tags"] = asyncio.create_task(agenerate_tags_from_image(
+            str(img_path),
+            language,
+            run_dir,
+            use_cache=not fresh,
+            tags=bundle.get("tags"),
+        ))
+    if "images" in modes_set:
+        stages["images"] = asyncio.create_task(agenerate_images_from_image(
+            str(img_path),
+            language,
+            run_dir=run_dir,
+            use_cache=not fresh,
+            entities=bundle.get("entities"),
+        ))
+
+    # c) Music (queued for the worker pool while the stages run); an
+    #    identical job in flight in any process is followed instead
+    try:
+        if "music" in modes_set:
+            music_key = None
+            if COALESCE_ENABLED:
+                music_key = await run_in_threadpool(
+                    coalesce.flight_key, img_path, audio_path, language, fresh, ("music",)
+                )
+            music_args = dict(
+                image_path=str(img_path),
+                language=language,
+                audio_path=str(audio_path) if audio_path else None,
+                use_cache=not fresh,
+                prompt=bundle.get("prompt"),
+                lyrics=bundle.get("lyrics"),
+            )
+            # Before the enqueue: a fast job's "run done" must come after it
+            emit(run_dir, "run", "queued")
+            job = await run_in_threadpool(
+                enqueue_job, "music", run_dir.name, dedupe_key=music_key, **music_args
+            )
+            shared.update(job_id=job.id, music_key=music_key, music_args=music_args)
+        done = dict(zip(stages, await asyncio.gather(*stages.values())))
+    except BaseException:
+        for task in stages.values():
+            task.cancel()
+        raise
+    if "tags" in done:
+        shared["tags"], _ = done["tags"]
+    if "images" in done:
+        entities, _, image_paths = done["images"]
+        shared["entities"] = [str(e) for e in entities]
+        shared["images"] = [Path(p).name for p in image_paths]
+    if "job_id" not in shared:
+        emit(run_dir, "run", "done")  # no music job to finish it
+    return shared
+
+
+def _follow(shared: dict, run_dir: Path, img_path: Path, modes_set: set[str]) -> dict:
+    """Link the leader's outputs into this request's own run folder."""
+    src = shared["run_dir"]
+    link_into(img_path, run_dir)
+    if "tags" in shared:
+        coalesce.mirror_assets(src, run_dir, coalesce.TAGS_ASSETS)
+        emit(run_dir, "tags", "ready")
+    if "images" in shared:
+        coalesce.mirror_assets(src, run_dir, coalesce.IMAGE_ASSETS)
+        emit(run_dir, "images", "ready", count=len(shared["images"]))
+    if "job_id" not in shared:
+        emit(run_dir, "run", "done")
+        return shared
+    emit(run_dir, "run", "queued")
+    if not follow_job(shared["job_id"], run_dir.name):
+        # The leader's music job is gone or failed already: this request makes
+        # its own, which other followers can still coalesce with
+        job = enqueue_job(
+            "music", run_dir.name, dedupe_key=shared["music_key"], **shared["music_args"]
+        )
+        shared = {**shared, "job_id": job.id}
+    return shared
+
+
+def _results(folder: str, shared: dict) -> dict:
+    results = {}
+    if "job_id" in shared:
+        results["music"] = {
+            "folder": folder,
+            "job_id": shared["job_id"],
+            "audio_url": f"/output/{folder}/audio.wav",
+            "lyrics_url": f"/output/{folder}/lyrics.lrc",
+            "prompt_url": f"/output/{folder}/prompt.txt",
+            "events_url": f"/runs/{folder}/events",
+            "pending": True,
+        }
+    if "tags" in shared:
+        results["tags"] = {
+            "folder": folder,
+            "tags": shared["tags"],
+            "tags_url": f"/output/{folder}/tags.json",
+        }
+    if "images" in shared:
+        results["images"] = {
+            "folder": folder,
+            "entities": shared["entities"],
+            "images": [f"/output/{folder}/images/{name}" for name in shared["images"]],
+        }
+    return results
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(key: str = Query(..., description="API key set in LOG_DOWNLOAD_KEY")):
+    # Scrape with `params: {key: [...]}` in the Prometheus job config
+    if key != dev_tools.API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid key")
+    counts = await run_in_threadpool(job_counts)
+    jobs = {("jobs", (("status", status),)): n for status, n in counts.items()}
+    return PlainTextResponse(
+        await run_in_threadpool(metrics.render, jobs),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+def _reset_for_regenerate(out_dir: Path, prompt: str) -> int:
+    """Write the new prompt and drop the old song and lyrics; returns the event count to stream from."""
+    store = storage.get()
+    store.publish(*asset_cache.write_text_asset(out_dir / "prompt.txt", prompt))
+
+    # Remove old audio (and its compressed copies) & lyrics so frontend polls until new files exist
+    for audio_fp in out_dir.glob("audio.*"):
+        audio_fp.unlink()
+    for lrc_fp in out_dir.glob("lyrics.lrc*"):
+        lrc_fp.unlink()
+    store.delete_prefix(f"{out_dir.name}/audio.")
+    store.delete_prefix(f"{out_dir.name}/lyrics.lrc")
+    since = count_events(out_dir)
+    emit(out_dir, "run", "queued")
+    return since
+
+
 @app.post("/regenerate")
 async def regenerate(
-    background_tasks: BackgroundTasks,
     request: Request,
     folder: str = Form(...),
     prompt: str = Form(...),
     lyrics: str = Form(...),
-    db: DBSession = Depends(get_session),
 ):
     out_dir = OUTPUT_DIR / folder
     if not out_dir.exists():
         raise HTTPException(404, "Folder not found")
 
-    (out_dir / "prompt.txt").write_text(prompt, encoding="utf-8")
-
-    # Remove old audio & lyrics so frontend polls until new files exist
-    audio_fp = out_dir / "audio.wav"
-    lrc_fp = out_dir / "lyrics.lrc"
-    if audio_fp.exists():
-        audio_fp.unlink()
-    if lrc_fp.exists():
-        lrc_fp.unlink()
-    
     assistant_reply = f"**Music Prompt:** {prompt}\n\n**Lyrics:**\n{lyrics}"
-    background_tasks.add_task(run_inference, assistant_reply, out_dir)
+    events_since = await run_in_threadpool(_reset_for_regenerate, out_dir, prompt)
+    job = await run_in_threadpool(
+        enqueue_job, "regenerate", folder, assistant_reply=assistant_reply
+    )
 
     log_event(
-        db,
         request.state.session_id,
         "regenerate",
         folder=folder,
@@ -202,26 +393,123 @@ async def regenerate(
     )
     return {
         "audio_url": f"/output/{folder}/audio.wav",
+        "job_id": job.id,
+        "events_url": f"/runs/{folder}/events?since={events_since}",
+        "events_since": events_since,
         "pending": True,
     }
 
 
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "folder": job.folder,
+        "attempts": job.attempts,
+        "error": job.error,
+        "task_id": job.task_id,
+        "polls": job.polls,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+@app.get("/runs/{folder}/events")
+async def run_events_stream(folder: str, request: Request, since: int = 0):
+    run_dir = OUTPUT_DIR / folder
+    if not run_dir.is_dir():
+        raise HTTPException(404, "Folder not found")
+    # EventSource reconnects resume after the last event they saw.
+    last_id = request.headers.get("last-event-id", "")
+    if last_id.isdigit():
+        since = int(last_id)
+
+    async def pending() -> bool:
+        return await run_in_threadpool(job_pending, folder)
+
+    return StreamingResponse(
+        stream_events(run_dir, since, request.is_disconnected, pending),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/runs/{folder}/trace")
+async def run_trace(folder: str, format: str = "json"):
+    """The run's spans as nested JSON, or ``?format=html`` for a waterfall."""
+    run_dir = OUTPUT_DIR / folder
+    if not run_dir.is_dir():
+        raise HTTPException(404, "Folder not found")
+    if format == "html":
+        return HTMLResponse(await run_in_threadpool(tracing.waterfall_html, run_dir, folder))
+    return await run_in_threadpool(tracing.load_trace, run_dir)
+
+
 @app.get("/output/{folder}/{subpath:path}")
-async def fetch(folder: str, subpath: str, request: Request, db: DBSession = Depends(get_session)):
+async def fetch(
+    folder: str,
+    subpath: str,
+    request: Request,
+    variant: str | None = None,  # e.g. "thumb": WebP derivative of an image
+    fmt: str | None = Query(None, alias="format"),  # opus | aac | mp3 copy of audio.wav
+):
+    store = storage.get()
     fp = OUTPUT_DIR / folder / subpath
-    if not fp.exists():
+    # A run built on another host is only in the remote store
+    local = fp.exists()
+    if not local and not (store.remote and await run_in_threadpool(store.exists, f"{folder}/{subpath}")):
         raise HTTPException(404, "Not found")
 
+    def available(p: Path) -> bool:
+        return p.exists() if local else store.exists(storage.key_for(p))
+
     ext = subpath.lower().rsplit(".", 1)[-1]
+    if variant is not None:
+        if variant not in derivatives.VARIANTS:
+            raise HTTPException(400, f"Unknown variant: {variant}")
+        if ext in derivatives.SOURCE_EXTS:
+            vp = derivatives.variant_path(fp, variant)
+            if local and not vp.exists():
+                # Older runs and uploads: render on demand, else serve the original
+                try:
+                    await derivatives.arun(derivatives.make_variant, str(fp), variant)
+                    await run_in_threadpool(store.publish, vp)
+                except Exception as e:
+                    print(f"Derivative {variant} failed for {fp}: {e}")
+            if await run_in_threadpool(available, vp):
+                fp, ext = vp, "webp"
+
+    headers = {}
     if ext == "wav":
-        media_type = "audio/wav"
-    elif ext in {"png", "jpg", "jpeg", "gif"}:
+        # Serve a compressed copy when the client asks for one we have
+        fp, media_type = await run_in_threadpool(
+            audio_formats.negotiate, fp, fmt, request.headers.get("accept", ""), available
+        )
+        headers["Vary"] = "Accept"
+    elif ext in {"png", "jpg", "jpeg", "gif", "webp"}:
         media_type = f"image/{ext if ext != 'jpg' else 'jpeg'}"
-    elif ext == "txt":
+    elif ext in {"txt", "lrc"}:
         media_type = "text/plain"
+    elif ext == "json":
+        media_type = "application/json"
     else:
         media_type = "application/octet-stream"
 
+    # Precompressed gzip/brotli copy of small text assets
+    fp, encoding = await run_in_threadpool(
+        asset_cache.pick_encoding, fp, request.headers.get("accept-encoding", ""), None if local else available
+    )
+    if fp.name in asset_cache.TEXT_ASSETS or encoding:
+        headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
     asset_type = "other"
     sp_lower = subpath.lower()
     if sp_lower == "tags.json":
@@ -236,13 +524,61 @@ async def fetch(folder: str, subpath: str, request: Request, db: DBSession = Dep
         asset_type = "audio"
 
     log_event(
-        db,
         request.state.session_id,
         "fetch_output",
         path=f"{folder}/{subpath}",
         asset_type=asset_type,
+        variant=variant,
+        served=fp.name,
     )
-    return FileResponse(str(fp), media_type=media_type)
+
+    if store.remote and (store.redirect or not local):
+        key = storage.key_for(fp)
+        obj = await run_in_threadpool(store.head, key)
+        if obj is not None:
+            if store.redirect:
+                # The negotiated object depends on the same request headers as before
+                redirect_headers = {"Cache-Control": storage.redirect_cache_control(subpath)}
+                if "Vary" in headers:
+                    redirect_headers["Vary"] = headers["Vary"]
+                return RedirectResponse(store.url(key), status_code=307, headers=redirect_headers)
+            return await _stream_object(store, key, obj, request, media_type, headers)
+        if not local:
+            raise HTTPException(404, "Not found")
+        # Not published (yet): this host still has the file
+
+    etag = await run_in_threadpool(asset_cache.etag_for, fp)
+    headers["ETag"] = etag
+    headers["Cache-Control"] = asset_cache.cache_control(subpath)
+    headers["Accept-Ranges"] = "bytes"
+    if asset_cache.not_modified(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    # Range / If-Range requests get 206 partial content from FileResponse
+    return FileResponse(str(fp), media_type=media_type, headers=headers)
+
+
+async def _stream_object(store, key: str, obj: dict, request: Request, media_type: str, headers: dict):
+    """Relay an object from the remote store (ETag, Range and If-Range included)."""
+    etag = obj["ETag"]
+    headers["ETag"] = etag
+    headers["Cache-Control"] = obj.get("CacheControl") or asset_cache.cache_control(key.split("/", 1)[-1])
+    headers["Accept-Ranges"] = "bytes"
+    if asset_cache.not_modified(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range != etag:
+        range_header = None  # the client's copy is stale: send the whole object
+    got = await run_in_threadpool(store.open, key, range_header)
+    if got is None:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{obj['ContentLength']}"})
+    headers["Content-Length"] = str(got["ContentLength"])
+    status = 200
+    if got.get("ContentRange"):
+        headers["Content-Range"] = got["ContentRange"]
+        status = 206
+    return StreamingResponse(store.iter_body(got), status_code=status, media_type=media_type, headers=headers)
 
 
 class ClientEvent(SQLModel):
@@ -251,9 +587,9 @@ class ClientEvent(SQLModel):
 
 
 @app.post("/log/batch")
-async def log_batch(events: list[ClientEvent], request: Request, db: DBSession = Depends(get_session)):
+async def log_batch(events: list[ClientEvent], request: Request):
     sid = request.state.session_id
     for ev in events:
         payload = ev.payload or {}
-        log_event(db, sid, ev.type, **payload)
+        log_event(sid, ev.type, **payload)
     return {"status": "ok"}
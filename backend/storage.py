@@ -0,0 +1,247 @@
+"""
+Where finished run assets are stored and served from.
+
+Runs are built in a local working folder under ``OUTPUT_DIR`` (ffmpeg,
+Pillow and the hardlinked caches need real files), and each asset is
+``publish``ed once it is complete, before its ``ready`` event. Backends:
+
+- ``local`` (default): the working folder is the store; publishing is free
+  and ``/output`` streams files from disk as before.
+- ``s3``: assets are uploaded to ``S3_BUCKET`` under ``<folder>/<path>`` on
+  any S3-API service (AWS, or MinIO via ``S3_ENDPOINT_URL``), so server
+  processes on other hosts can serve the run. With ``STORAGE_REDIRECT``,
+  ``/output`` answers with a presigned URL and the bytes bypass the app.
+
+Credentials come from the usual ``AWS_ACCESS_KEY_ID`` /
+``AWS_SECRET_ACCESS_KEY`` environment variables.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Iterator
+
+from asset_cache import REVALIDATE, cache_control
+from config import (
+    OUTPUT_DIR,
+    PRESIGN_TTL,
+    S3_BUCKET,
+    S3_ENDPOINT_URL,
+    S3_PREFIX,
+    S3_REGION,
+    STORAGE_BACKEND,
+    STORAGE_REDIRECT,
+)
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+OUTPUT_ROOT = Path(OUTPUT_DIR)
+CHUNK_SIZE = 256 * 1024
+
+CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "opus": "audio/ogg",
+    "m4a": "audio/mp4",
+    "mp3": "audio/mpeg",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "webp": "image/webp",
+    "txt": "text/plain; charset=utf-8",
+    "lrc": "text/plain; charset=utf-8",
+    "json": "application/json",
+}
+ENCODING_SUFFIXES = {".gz": "gzip", ".br": "br"}
+
+
+def key_for(path: str | Path) -> str:
+    """Store key of a file in the working folder, e.g. ``<folder>/images/a.jpg``."""
+    return Path(path).resolve().relative_to(OUTPUT_ROOT.resolve()).as_posix()
+
+
+def object_headers(key: str) -> dict:
+    """Content type, encoding and Cache-Control an asset is stored (and served) with."""
+    name, encoding = key, None
+    for suffix, enc in ENCODING_SUFFIXES.items():
+        if key.endswith(suffix):
+            name, encoding = key[: -len(suffix)], enc
+    ext = name.rsplit(".", 1)[-1].lower()
+    headers = {
+        "ContentType": CONTENT_TYPES.get(ext, "application/octet-stream"),
+        "CacheControl": cache_control(name.split("/", 1)[-1]),
+    }
+    if encoding:
+        headers["ContentEncoding"] = encoding
+    return headers
+
+
+class LocalStorage:
+    """The working folder itself."""
+
+    name = "local"
+    remote = False
+    redirect = False
+
+    def publish(self, *paths: str | Path) -> None:
+        pass
+
+    def exists(self, key: str) -> bool:
+        return (OUTPUT_ROOT / key).is_file()
+
+    def delete_prefix(self, prefix: str) -> int:
+        return 0  # retention and /regenerate remove the local files themselves
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "root": str(OUTPUT_ROOT)}
+
+
+class S3Storage:
+    """An S3-API bucket (AWS S3, MinIO, ...)."""
+
+    name = "s3"
+    remote = True
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        endpoint_url: str | None = S3_ENDPOINT_URL,
+        prefix: str = S3_PREFIX,
+        redirect: bool = STORAGE_REDIRECT,
+    ):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs the boto3 package")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.redirect = redirect
+        # Path-style addressing works with MinIO and any host name
+        self.client = boto3.session.Session().client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=S3_REGION,
+            config=BotoConfig(s3={"addressing_style": "path"}, retries={"mode": "standard"}),
+        )
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def ensure_bucket(self) -> None:
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchBucket"):
+                raise
+            self.client.create_bucket(Bucket=self.bucket)
+            print(f"📦 created bucket {self.bucket}")
+
+    def publish(self, *paths: str | Path) -> None:
+        """Upload finished files; a failure is logged and the local copy still serves this host."""
+        for path in paths:
+            key = key_for(path)
+            try:
+                self.client.upload_file(
+                    str(path), self.bucket, self._key(key), ExtraArgs=object_headers(key)
+                )
+            except Exception as e:
+                print(f"Publishing {key} failed: {e}")
+
+    def head(self, key: str) -> dict | None:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self.head(key) is not None
+
+    def url(self, key: str) -> str:
+        """Presigned GET URL, valid for ``PRESIGN_TTL`` seconds."""
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(key)},
+            ExpiresIn=int(PRESIGN_TTL),
+        )
+
+    def open(self, key: str, range_header: str | None = None) -> dict | None:
+        """``GetObject`` response (``Range`` passed through); ``None`` if the range is unsatisfiable."""
+        args = {"Bucket": self.bucket, "Key": self._key(key)}
+        if range_header:
+            args["Range"] = range_header
+        try:
+            return self.client.get_object(**args)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "InvalidRange":
+                return None
+            raise
+
+    def iter_body(self, obj: dict) -> Iterator[bytes]:
+        body = obj["Body"]
+        try:
+            yield from body.iter_chunks(CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def delete_prefix(self, prefix: str) -> int:
+        deleted = 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            keys = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys, "Quiet": True})
+                deleted += len(keys)
+        return deleted
+
+    def describe(self) -> dict:
+        return {
+            "backend": self.name,
+            "bucket": self.bucket,
+            "endpoint": self.endpoint_url or "aws",
+            "prefix": self.prefix,
+            "redirect": self.redirect,
+        }
+
+
+def redirect_cache_control(subpath: str) -> str:
+    """Immutable assets may reuse a redirect while its presigned URL is still valid."""
+    if cache_control(subpath) == REVALIDATE:
+        return REVALIDATE
+    return f"private, max-age={int(PRESIGN_TTL // 2)}"
+
+
+BACKENDS = {"local": LocalStorage, "s3": S3Storage}
+
+_storage: LocalStorage | S3Storage | None = None
+_storage_pid: int | None = None
+_lock = threading.Lock()
+
+
+def get() -> LocalStorage | S3Storage:
+    """This process's storage backend (clients are never shared across processes)."""
+    global _storage, _storage_pid
+    if _storage is None or _storage_pid != os.getpid():
+        with _lock:
+            if _storage is None or _storage_pid != os.getpid():
+                if STORAGE_BACKEND not in BACKENDS:
+                    raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+                _storage, _storage_pid = BACKENDS[STORAGE_BACKEND](), os.getpid()
+    return _storage
+
+
+def publish(*paths: str | Path) -> None:
+    get().publish(*paths)
+
+
+def report_storage() -> None:
+    store = get()
+    if isinstance(store, S3Storage):
+        store.ensure_bucket()
+    print("📦 storage:", ", ".join(f"{k}={v}" for k, v in store.describe().items()))
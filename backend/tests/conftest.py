@@ -0,0 +1,53 @@
+"""
+Shared setup for the backend tests.
+
+The backend reads its configuration at import time, so the environment is
+pointed at a throwaway database, output folder and caches before any backend
+module is imported. The modules are flat, imported from ``backend/`` the
+way ``server.py`` imports them.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+TMP = Path(tempfile.mkdtemp(prefix="omni-tests-"))
+os.environ.update(
+    TEST_MODE="true",
+    DATABASE_URL=f"sqlite:///{TMP / 'omni_logs.db'}",
+    JOB_WORKERS="0",
+    OUTPUT_DIR=str(TMP / "output"),
+    LLM_CACHE_PATH=str(TMP / "cache" / "llm_cache.db"),
+    SEARCH_CACHE_PATH=str(TMP / "cache" / "search_cache.db"),
+    IMAGE_CACHE_DIR=str(TMP / "cache" / "images"),
+    METRICS_DIR=str(TMP / "cache" / "metrics"),
+    STORAGE_BACKEND="local",
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def db():
+    """A fresh set of tables for every test."""
+    from sqlmodel import SQLModel
+
+    import analytics  # noqa: F401 (registers the rollup tables)
+    import jobs  # noqa: F401 (registers Job and JobFollower)
+    import retention  # noqa: F401 (registers RunUsage)
+    from log_db import create_db_and_tables, engine
+
+    SQLModel.metadata.drop_all(engine)
+    create_db_and_tables()
+    yield engine
+
+
+@pytest.fixture
+def run_dir():
+    """An empty run folder under ``OUTPUT_DIR``."""
+    import storage
+
+    folder = storage.OUTPUT_ROOT / f"run-{os.urandom(4).hex()}"
+    folder.mkdir(parents=True)
+    return folder
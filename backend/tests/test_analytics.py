@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+import analytics
+from analytics import EventCount, RollupState, rollup
+from log_db import Event, SessionEntry
+
+OLD = timedelta(minutes=5)
+
+
+def _add_events(engine, *ages: timedelta) -> list[int]:
+    now = datetime.utcnow()
+    with Session(engine) as db:
+        sess = SessionEntry()
+        db.add(sess)
+        events = [Event(session_id=sess.id, ts=now - age, type="visit") for age in ages]
+        db.add_all(events)
+        db.commit()
+        return [ev.id for ev in events]
+
+
+def _state(engine) -> tuple[int, int]:
+    with Session(engine) as db:
+        state = db.get(RollupState, "events")
+        counted = sum(r.count for r in db.exec(select(EventCount)).all())
+    return state.last_event_id, counted
+
+
+def test_rollup_stops_at_first_unsettled_event(db):
+    first, unsettled, later = _add_events(db, OLD, timedelta(0), OLD)
+
+    assert rollup() == 1
+    assert _state(db) == (first, 1)
+
+    # Once the straggler settles, it and everything after it are folded
+    with Session(db) as s:
+        s.get(Event, unsettled).ts -= OLD
+        s.commit()
+    assert rollup() == 2
+    assert _state(db) == (later, 3)
+    assert rollup() == 0
+
+
+def test_rollup_works_in_batches(db, monkeypatch):
+    monkeypatch.setattr(analytics, "BATCH", 2)
+    ids = _add_events(db, OLD, OLD, OLD, OLD, OLD)
+    assert rollup() == 5
+    assert _state(db) == (ids[-1], 5)
+
@@ -0,0 +1,110 @@
+import gzip
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import asset_cache
+from asset_cache import IMMUTABLE, REVALIDATE, cache_control, not_modified, pick_encoding, write_text_asset
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ("*", True),
+    ('"abcd"', False),
+])
+def test_not_modified_uses_weak_comparison(header, expected):
+    assert not_modified(header, '"abc"') is expected
+
+
+def test_cache_control_revalidates_mutable_assets_only():
+    assert cache_control("prompt.txt") == REVALIDATE
+    assert cache_control("audio.opus") == REVALIDATE
+    assert cache_control("images/cat_0.jpg") == IMMUTABLE
+    assert cache_control("tags.json") == IMMUTABLE
+
+
+def test_pick_encoding_prefers_brotli_and_honours_q0(tmp_path):
+    written = write_text_asset(tmp_path / "lyrics.lrc", "la la la\n" * 50)
+    path = written[0]
+    if asset_cache.brotli is not None:
+        assert pick_encoding(path, "gzip, br") == (path.with_name("lyrics.lrc.br"), "br")
+    assert pick_encoding(path, "gzip, br;q=0") == (path.with_name("lyrics.lrc.gz"), "gzip")
+    assert pick_encoding(path, "identity") == (path, None)
+    assert pick_encoding(tmp_path / "audio.wav", "gzip") == (tmp_path / "audio.wav", None)
+
+
+def test_pick_encoding_skips_copies_older_than_the_source(tmp_path):
+    path = write_text_asset(tmp_path / "prompt.txt", "old prompt")[0]
+    path.write_text("new prompt")  # written without its compressed copies
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert pick_encoding(path, "gzip, br") == (path, None)
+
+
+@pytest.fixture
+def client(db):
+    import server
+
+    return TestClient(server.app)
+
+
+def test_fetch_sends_etag_and_answers_304(client, run_dir):
+    (run_dir / "tags.json").write_text('["a"]')
+    url = f"/output/{run_dir.name}/tags.json"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == IMMUTABLE
+
+    again = client.get(url, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    assert again.content == b""
+
+    (run_dir / "tags.json").write_text('["b"]')
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+
+def test_fetch_serves_the_precompressed_copy(client, run_dir):
+    text = "verse\n" * 100
+    write_text_asset(run_dir / "lyrics.lrc", text)
+    url = f"/output/{run_dir.name}/lyrics.lrc"
+
+    gz = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert gz.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in gz.headers["vary"]
+    assert gz.text == text  # decoded by the client
+    assert int(gz.headers["content-length"]) == len(gzip.compress(text.encode(), 9, mtime=0))
+
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.text == text
+    assert "Accept-Encoding" in plain.headers["vary"]
+    assert plain.headers["etag"] != gz.headers["etag"]  # each representation has its own
+
+
+def test_fetch_serves_byte_ranges(client, run_dir):
+    (run_dir / "audio.wav").write_bytes(bytes(range(256)))
+    res = client.get(f"/output/{run_dir.name}/audio.wav", headers={"Range": "bytes=10-19"})
+    assert res.status_code == 206
+    assert res.content == bytes(range(10, 20))
+
+
+def test_regenerate_rewrites_the_prompt_and_drops_the_old_song(client, run_dir):
+    (run_dir / "audio.wav").write_bytes(b"RIFF")
+    (run_dir / "audio.opus").write_bytes(b"OggS")
+    write_text_asset(run_dir / "lyrics.lrc", "old")
+    (run_dir / "events.jsonl").write_text('{"asset": "run", "status": "done"}\n')
+
+    res = client.post("/regenerate", data={"folder": run_dir.name, "prompt": "new prompt", "lyrics": "la"})
+    assert res.status_code == 200
+    assert res.json()["events_since"] == 1
+    assert (run_dir / "prompt.txt").read_text() == "new prompt"
+    assert gzip.decompress((run_dir / "prompt.txt.gz").read_bytes()) == b"new prompt"
+    assert not list(run_dir.glob("audio.*")) and not list(run_dir.glob("lyrics.lrc*"))
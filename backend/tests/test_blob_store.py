@@ -0,0 +1,53 @@
+import errno
+import os
+import threading
+
+import blob_store
+from blob_store import link_into
+
+
+def test_link_into_hardlinks_and_is_idempotent(tmp_path):
+    src = tmp_path / "src.bin"
+    src.write_bytes(b"data")
+    out = tmp_path / "out"
+    out.mkdir()
+    dest = link_into(src, out)
+    assert dest.stat().st_ino == src.stat().st_ino
+    assert link_into(src, out) == dest
+
+
+def test_link_into_copies_across_devices_concurrently(tmp_path, monkeypatch):
+    def cross_device(src, dest):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    started = threading.Barrier(8)
+    real_copy = blob_store.shutil.copy2
+
+    def copy_together(src, dest):
+        started.wait()  # every thread is past the exists() check
+        return real_copy(src, dest)
+
+    monkeypatch.setattr(blob_store.os, "link", cross_device)
+    monkeypatch.setattr(blob_store.shutil, "copy2", copy_together)
+    src = tmp_path / "src.bin"
+    src.write_bytes(os.urandom(1 << 20))
+    out = tmp_path / "out"
+    out.mkdir()
+
+    errors = []
+
+    def copy():
+        try:
+            link_into(src, out, "copy.bin")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=copy) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert (out / "copy.bin").read_bytes() == src.read_bytes()
+    assert [p.name for p in out.iterdir()] == ["copy.bin"]  # no temp files left
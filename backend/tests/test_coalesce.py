@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight, flight_key
+
+
+def _counting(result="r", delay=0.05, error=None):
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return result
+
+    return fn, calls
+
+
+def test_concurrent_calls_share_one_computation():
+    async def main():
+        flights = SingleFlight()
+        fn, calls = _counting()
+        results = await asyncio.gather(*(flights.run("k", fn) for _ in range(5)))
+        return flights, calls, results
+
+    flights, calls, results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ["r"] * 5
+    assert [led for _, led in results] == [True, False, False, False, False]
+    assert flights.flights == {}
+
+
+def test_different_keys_and_later_calls_run_again():
+    async def main():
+        flights = SingleFlight()
+        fn, calls = _counting()
+        await asyncio.gather(flights.run("a", fn), flights.run("b", fn))
+        await flights.run("a", fn)
+        return calls
+
+    assert len(asyncio.run(main())) == 3
+
+
+def test_followers_retry_on_their_own_when_the_leader_fails():
+    async def main():
+        flights = SingleFlight()
+        bad, _ = _counting(error=RuntimeError("boom"))
+        good, calls = _counting(result="own")
+        leader = asyncio.create_task(flights.run("k", bad))
+        await asyncio.sleep(0)
+        follower = await flights.run("k", good)
+        with pytest.raises(RuntimeError):
+            await leader
+        return follower, calls
+
+    follower, calls = asyncio.run(main())
+    assert follower == ("own", True)
+    assert len(calls) == 1
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def main():
+        flights = SingleFlight()
+        slow, _ = _counting(delay=10)
+        fn, calls = _counting(result="own")
+        leader = asyncio.create_task(flights.run("k", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.run("k", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower, calls
+
+    result, calls = asyncio.run(main())
+    assert result == ("own", True)
+    assert len(calls) == 1
+
+
+def test_cancelled_follower_does_not_cancel_the_leader():
+    async def main():
+        flights = SingleFlight()
+        fn, calls = _counting(delay=0.05)
+        leader = asyncio.create_task(flights.run("k", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.run("k", fn))
+        await asyncio.sleep(0)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader, calls
+
+    result, calls = asyncio.run(main())
+    assert result == ("r", True)
+    assert len(calls) == 1
+
+
+def test_flight_key_depends_on_content_and_options(tmp_path):
+    a, b = tmp_path / "a.png", tmp_path / "b.png"
+    a.write_bytes(b"same")
+    b.write_bytes(b"same")
+    key = flight_key(a, None, "en", False, {"tags", "images"})
+    assert flight_key(b, None, "en", False, ("images", "tags")) == key
+    assert flight_key(a, None, "de", False, {"tags", "images"}) != key
+    assert flight_key(a, None, "en", True, {"tags", "images"}) != key
+    assert flight_key(a, None, "en", False, {"tags"}) != key
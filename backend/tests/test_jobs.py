@@ -0,0 +1,163 @@
+import json
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from sqlmodel import Session
+
+import jobs
+from jobs import (
+    FAILED,
+    QUEUED,
+    RUNNING,
+    JobFollower,
+    claim_next_job,
+    enqueue_job,
+    fail_job,
+    get_job,
+    mirror_followers,
+    requeue_stale_jobs,
+)
+
+
+def _events(run_dir) -> list[tuple[str, str]]:
+    lines = (run_dir / "events.jsonl").read_text().splitlines()
+    return [(e["asset"], e["status"]) for e in map(json.loads, lines)]
+
+
+def test_mirror_followers_links_outputs_into_each_follower_once(db, run_dir):
+    job = enqueue_job("music", run_dir.name, image_path="x.png")
+    for name in ("audio.wav", "prompt.txt", "lyrics.lrc"):
+        (run_dir / name).write_text(name)
+    followers = [run_dir.parent / f"{run_dir.name}-f{i}" for i in range(2)]
+    with Session(db) as s:
+        for f in followers:
+            f.mkdir()
+            s.add(JobFollower(job_id=job.id, folder=f.name))
+        s.commit()
+
+    assert mirror_followers(job, True) == 2
+    assert mirror_followers(job, True) == 0  # already mirrored
+    for f in followers:
+        assert (f / "audio.wav").stat().st_ino == (run_dir / "audio.wav").stat().st_ino
+        assert ("audio", "ready") in _events(f)
+        assert _events(f)[-1] == ("run", "done")
+
+
+def test_mirror_followers_passes_on_failure(db, run_dir):
+    job = enqueue_job("music", run_dir.name, image_path="x.png")
+    follower = run_dir.parent / f"{run_dir.name}-f"
+    follower.mkdir()
+    with Session(db) as s:
+        s.add(JobFollower(job_id=job.id, folder=follower.name))
+        s.commit()
+
+    assert mirror_followers(job, False, "boom") == 1
+    assert _events(follower) == [("audio", "failed"), ("run", "failed")]
+    assert not (follower / "audio.wav").exists()
+
+
+def test_claim_takes_the_oldest_queued_job_once(db):
+    first = enqueue_job("music", "a", image_path="x.png")
+    second = enqueue_job("music", "b", image_path="x.png")
+
+    job = claim_next_job("w1")
+    assert (job.id, job.status, job.worker, job.attempts) == (first.id, RUNNING, "w1", 1)
+    assert claim_next_job("w2").id == second.id
+    assert claim_next_job("w3") is None
+
+
+def test_claims_from_concurrent_workers_never_overlap(db):
+    ids = {enqueue_job("music", f"r{i}", image_path="x.png").id for i in range(20)}
+    with ThreadPoolExecutor(8) as pool:
+        claimed = list(pool.map(lambda i: claim_next_job(f"w{i}"), range(30)))
+    got = [j.id for j in claimed if j is not None]
+    assert sorted(got) == sorted(ids)
+
+
+def test_stale_running_job_is_requeued_then_failed(db, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0)
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    job = enqueue_job("music", "a", image_path="x.png")
+
+    claim_next_job("w")
+    assert requeue_stale_jobs() == 1
+    assert get_job(job.id).status == QUEUED
+
+    claim_next_job("w")  # second attempt, the last one
+    requeue_stale_jobs()
+    assert (get_job(job.id).status, get_job(job.id).error) == (FAILED, "worker lost")
+
+
+def test_failed_job_is_retried_while_it_has_attempts(db, run_dir, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    enqueue_job("music", run_dir.name, image_path="x.png")
+
+    fail_job(claim_next_job("w"), "boom")
+    job = claim_next_job("w")
+    assert job.attempts == 2
+
+    fail_job(job, "boom again")
+    assert (get_job(job.id).status, get_job(job.id).error) == (FAILED, "boom again")
+    assert claim_next_job("w") is None
+
+
+def test_only_one_process_per_host_hosts_the_pool(tmp_path, monkeypatch):
+    lock = tmp_path / "pool.lock"
+    monkeypatch.setattr(jobs, "JOB_POOL_LOCK", str(lock))
+    assert jobs._claim_pool()
+    try:
+        other = subprocess.run(
+            [sys.executable, "-c", POOL_CLAIM, str(lock)],
+            cwd=Path(jobs.__file__).parent,
+            capture_output=True,
+            text=True,
+        )
+        assert other.stdout.strip().splitlines()[-1] == "False"
+    finally:
+        jobs.stop_workers([])
+    assert jobs._pool_lock is None
+
+
+POOL_CLAIM = """
+import sys
+import jobs
+jobs.JOB_POOL_LOCK = sys.argv[1]
+print(jobs._claim_pool())
+"""
+
+
+def test_late_encodes_reach_mirrored_followers(db, run_dir, monkeypatch):
+    import udio_module
+
+    job = enqueue_job("music", run_dir.name, image_path="x.png")
+    wav = run_dir / "audio.wav"
+    wav.write_bytes(b"RIFF")
+    follower = run_dir.parent / f"{run_dir.name}-f"
+    follower.mkdir()
+    with Session(db) as s:
+        s.add(JobFollower(job_id=job.id, folder=follower.name))
+        s.commit()
+    assert mirror_followers(job, True) == 1
+    assert not (follower / "audio.opus").exists()
+
+    def transcode(w):
+        (w.parent / "audio.opus").write_bytes(b"OggS")
+        return ["opus"]
+
+    monkeypatch.setattr(udio_module, "transcode", transcode)
+    udio_module._encode_audio(wav)
+    assert (follower / "audio.opus").stat().st_ino == (run_dir / "audio.opus").stat().st_ino
+
+
+def test_job_pending_covers_own_and_followed_jobs(db):
+    job = enqueue_job("music", "lead", image_path="x.png")
+    with Session(db) as s:
+        s.add(JobFollower(job_id=job.id, folder="follower"))
+        s.commit()
+    assert jobs.job_pending("lead") and jobs.job_pending("follower")
+    assert not jobs.job_pending("other")
+
+    jobs.complete_job(get_job(job.id))
+    assert not jobs.job_pending("lead") and not jobs.job_pending("follower")
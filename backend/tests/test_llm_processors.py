@@ -0,0 +1,29 @@
+import json
+
+from llm_processors import ImageToBundleProcessor
+
+FULL = {
+    "tags": ["neon rain pulse"],
+    "entities": ["city lights painting"],
+    "prompt": "Synthwave, slow, rain ambience",
+    "lyrics": "line one\nline two",
+}
+
+
+def _bundle(sections) -> ImageToBundleProcessor:
+    return ImageToBundleProcessor("image.png", "en", sections=sections, use_cache=False)
+
+
+def test_bundle_with_every_requested_section_is_cached():
+    assert _bundle(("tags", "entities", "music"))._cacheable(json.dumps(FULL))
+
+
+def test_bundle_missing_a_requested_section_is_not_cached():
+    partial = {k: v for k, v in FULL.items() if k != "lyrics"}
+    assert not _bundle(("tags", "entities", "music"))._cacheable(json.dumps(partial))
+    assert not _bundle(("tags", "entities"))._cacheable(json.dumps({"tags": FULL["tags"]}))
+
+
+def test_bundle_only_needs_the_sections_it_asked_for():
+    assert _bundle(("tags",))._cacheable(json.dumps({"tags": FULL["tags"]}))
+    assert not _bundle(("tags",))._cacheable("not json")
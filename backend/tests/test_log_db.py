@@ -0,0 +1,76 @@
+import queue
+
+import log_db
+from log_db import EventWriter, SessionCache
+
+
+def _writer(maxsize: int = 0) -> EventWriter:
+    writer = EventWriter()
+    writer.queue = queue.Queue(maxsize=maxsize)
+    writer._ensure_started = lambda: None  # rows stay queued for the test to inspect
+    return writer
+
+
+def test_session_is_written_once_per_interval():
+    writer = _writer()
+    cache = SessionCache(writer)
+    cache.seen("s1")
+    cache.seen("s1")
+    assert writer.queue.qsize() == 1
+    assert "s1" in cache.touched
+
+
+def test_session_dropped_by_a_full_queue_is_retried():
+    writer = _writer(maxsize=1)
+    cache = SessionCache(writer)
+    writer.log("s0", "visit", {})  # fills the queue
+    cache.seen("s1")
+    assert "s1" not in cache.touched
+
+    writer.queue.get_nowait()
+    cache.seen("s1")
+    assert "s1" in cache.touched
+    assert writer.queue.get_nowait()[1]["id"] == "s1"
+
+
+def test_session_is_forgotten_when_its_write_fails(monkeypatch):
+    writer = _writer()
+    cache = SessionCache(writer)
+    cache.seen("s1")
+    cache.seen("s2")
+
+    def fail(conn, rows):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(writer, "_write_sessions", fail)
+    writer._write([writer.queue.get_nowait()])
+    assert "s1" not in cache.touched
+    assert "s2" in cache.touched
+
+    cache.seen("s1")
+    assert writer.queue.qsize() == 2  # s2 still queued, s1 queued again
+
+
+def test_module_cache_is_wired_to_the_module_writer():
+    assert log_db.event_writer.on_session_failure == log_db.session_cache.forget
+
+
+def test_a_session_inserted_elsewhere_keeps_this_batchs_events(db):
+    from datetime import datetime, timedelta
+
+    from sqlmodel import Session, select
+
+    from log_db import Event, SessionEntry
+
+    t0 = datetime.utcnow()
+    for i, writer in enumerate((EventWriter(), EventWriter())):  # one per process
+        seen = t0 + timedelta(seconds=i)
+        writer._write([
+            ("session", {"id": "s1", "started_at": seen, "last_seen_at": seen, "user_agent": "ua", "locale": None}),
+            ("event", {"session_id": "s1", "ts": seen, "type": f"visit{i}", "payload": {}}),
+        ])
+
+    with Session(db) as s:
+        session = s.exec(select(SessionEntry)).one()
+        assert (session.started_at, session.last_seen_at) == (t0, t0 + timedelta(seconds=1))
+        assert sorted(e.type for e in s.exec(select(Event))) == ["visit0", "visit1"]
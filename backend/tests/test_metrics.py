@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import metrics
+from config import METRICS_DIR
+
+
+def _dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def _write(name: str, counter: float, gauge: float) -> Path:
+    fp = Path(METRICS_DIR) / name
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    fp.write_text(json.dumps({
+        "hists": [["stage_seconds", [["stage", "t"]], [1] + [0] * len(metrics.BUCKETS) + [0.001]]],
+        "counters": [["coalesced_total", [["stage", "t"]], counter]],
+        "gauges": [["inflight_requests", [], gauge]],
+    }))
+    return fp
+
+
+def _totals() -> tuple[float, float, int]:
+    data = metrics._collect()
+    key = ("stage", "t"),
+    return (
+        data["counters"].get(("coalesced_total", key), 0),
+        data["gauges"].get(("inflight_requests", ()), 0),
+        data["hists"].get(("stage_seconds", key), [0])[0],
+    )
+
+
+def test_exited_process_keeps_counters_but_not_gauges():
+    for fp in Path(METRICS_DIR).glob("*.json"):
+        fp.unlink()
+    _write(f"poller-{os.getppid()}.json", counter=1, gauge=2)
+    fp = _write(f"worker-{_dead_pid()}.json", counter=3, gauge=5)
+
+    assert _totals() == (4, 2, 2)
+    assert not fp.exists()
+    assert (Path(METRICS_DIR) / metrics.DEAD_FILE).exists()
+    assert _totals() == (4, 2, 2)  # read again, not counted twice
+
+
+def test_exited_processes_fold_into_one_file():
+    for fp in Path(METRICS_DIR).glob("*.json"):
+        fp.unlink()
+    for i in range(3):
+        _write(f"worker-{_dead_pid()}.json", counter=i + 1, gauge=5)
+        assert _totals() == (sum(range(1, i + 2)), 0, i + 1)
+
+    assert [fp.name for fp in Path(METRICS_DIR).glob("*.json")] == [metrics.DEAD_FILE]
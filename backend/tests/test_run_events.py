@@ -0,0 +1,57 @@
+import asyncio
+
+from run_events import emit, stream_events
+
+
+def _collect(run_dir, since=0, pending=None, timeout=5.0) -> list[str]:
+    async def run():
+        return [f async for f in stream_events(run_dir, since, pending=pending, timeout=timeout, interval=0.01)]
+
+    return asyncio.run(run())
+
+
+def _data(frames: list[str]) -> list[str]:
+    return [f for f in frames if f.startswith("id:")]
+
+
+def test_stream_ends_on_the_terminal_run_event(run_dir):
+    emit(run_dir, "tags", "ready")
+    emit(run_dir, "run", "done")
+    assert len(_data(_collect(run_dir))) == 2
+
+
+def test_reconnect_after_the_terminal_event_returns_at_once(run_dir):
+    emit(run_dir, "audio", "ready")
+    emit(run_dir, "run", "done")
+    frames = _collect(run_dir, since=2, timeout=60)
+    assert _data(frames) == []
+
+
+def test_run_without_run_events_or_job_returns_at_once(run_dir):
+    emit(run_dir, "tags", "ready")
+
+    async def pending():
+        return False
+
+    assert len(_data(_collect(run_dir, pending=pending, timeout=60))) == 1
+
+
+def test_queued_run_waits_for_its_job(run_dir):
+    emit(run_dir, "run", "done")
+    emit(run_dir, "run", "queued")  # regenerated
+
+    async def run():
+        frames = []
+
+        async def finish():
+            await asyncio.sleep(0.1)
+            emit(run_dir, "audio", "ready")
+            emit(run_dir, "run", "done")
+
+        task = asyncio.create_task(finish())
+        async for f in stream_events(run_dir, 1, timeout=5, interval=0.01):
+            frames.append(f)
+        await task
+        return frames
+
+    assert len(_data(asyncio.run(run()))) == 3
@@ -0,0 +1,142 @@
+"""
+S3Storage against moto, or against a real S3-API service (e.g. MinIO) when
+``S3_ENDPOINT_URL`` is set; each test gets its own bucket.
+"""
+import os
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+
+import storage
+
+pytest.importorskip("boto3")
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    bucket = f"omni-tests-{os.urandom(4).hex()}"
+    endpoint = os.getenv("S3_ENDPOINT_URL")
+    if endpoint:
+        store = storage.S3Storage(bucket=bucket, endpoint_url=endpoint, prefix="tests", redirect=False)
+        store.ensure_bucket()
+        yield store
+        store.delete_prefix("")
+        store.client.delete_bucket(Bucket=bucket)
+        return
+
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        store = storage.S3Storage(bucket=bucket, endpoint_url=None, prefix="tests", redirect=False)
+        store.ensure_bucket()
+        yield store
+
+
+AUDIO = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def published(s3, run_dir):
+    """A run with audio and a gzipped lyrics copy, published to ``s3``."""
+    (run_dir / "audio.wav").write_bytes(AUDIO)
+    (run_dir / "images").mkdir()
+    (run_dir / "images" / "cat_0.jpg").write_bytes(b"jpeg")
+    (run_dir / "lyrics.lrc.gz").write_bytes(b"gz")
+    s3.publish(run_dir / "audio.wav", run_dir / "images" / "cat_0.jpg", run_dir / "lyrics.lrc.gz")
+    return run_dir
+
+
+def test_publish_stores_headers(s3, published):
+    folder = published.name
+    audio = s3.head(f"{folder}/audio.wav")
+    assert audio["ContentType"] == "audio/wav"
+    assert audio["CacheControl"] == "no-cache"
+    assert audio["ContentLength"] == len(AUDIO)
+
+    image = s3.head(f"{folder}/images/cat_0.jpg")
+    assert image["ContentType"] == "image/jpeg"
+    assert "immutable" in image["CacheControl"]
+
+    lyrics = s3.head(f"{folder}/lyrics.lrc.gz")
+    assert lyrics["ContentType"].startswith("text/plain")
+    assert lyrics["ContentEncoding"] == "gzip"
+
+    assert s3.head(f"{folder}/missing.txt") is None
+    assert not s3.exists(f"{folder}/missing.txt")
+
+
+def test_presigned_url(s3, published):
+    url = s3.url(f"{published.name}/audio.wav")
+    assert f"/{s3.bucket}/tests/{published.name}/audio.wav" in url
+    assert "Signature=" in url
+
+
+def test_open_passes_ranges_through(s3, published):
+    key = f"{published.name}/audio.wav"
+    part = s3.open(key, "bytes=10-19")
+    assert part["ContentRange"] == f"bytes 10-19/{len(AUDIO)}"
+    assert b"".join(s3.iter_body(part)) == AUDIO[10:20]
+
+    whole = s3.open(key)
+    assert b"".join(s3.iter_body(whole)) == AUDIO
+
+    assert s3.open(key, f"bytes={len(AUDIO) + 10}-") is None
+
+
+def test_delete_prefix_removes_only_that_run(s3, published, run_dir):
+    other = run_dir.parent / f"{published.name}-other"
+    other.mkdir()
+    (other / "tags.json").write_text("[]")
+    s3.publish(other / "tags.json")
+
+    assert s3.delete_prefix(f"{published.name}/") == 3
+    assert not s3.exists(f"{published.name}/audio.wav")
+    assert s3.exists(f"{other.name}/tags.json")
+
+
+@pytest.fixture
+def remote_run(s3, published, db, monkeypatch):
+    """``published`` served by the app from the bucket only, as on another host."""
+    import server
+
+    monkeypatch.setattr(storage, "_storage", s3)
+    monkeypatch.setattr(storage, "_storage_pid", os.getpid())
+    shutil.rmtree(published)
+    return TestClient(server.app), f"/output/{published.name}"
+
+
+def test_relay_streams_ranges_and_revalidates(remote_run):
+    client, base = remote_run
+    url = f"{base}/audio.wav"
+
+    whole = client.get(url)
+    assert whole.status_code == 200
+    assert whole.content == AUDIO
+    etag = whole.headers["etag"]
+
+    part = client.get(url, headers={"Range": "bytes=0-99"})
+    assert part.status_code == 206
+    assert part.headers["content-range"] == f"bytes 0-99/{len(AUDIO)}"
+    assert part.content == AUDIO[:100]
+
+    stale = client.get(url, headers={"Range": "bytes=0-99", "If-Range": '"stale"'})
+    assert stale.status_code == 200 and stale.content == AUDIO
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    unsatisfiable = client.get(url, headers={"Range": f"bytes={len(AUDIO) + 10}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{len(AUDIO)}"
+
+    assert client.get(f"{base}/missing.txt").status_code == 404
+
+
+def test_redirect_to_presigned_url(remote_run, s3):
+    client, base = remote_run
+    s3.redirect = True
+    res = client.get(f"{base}/images/cat_0.jpg", follow_redirects=False)
+    assert res.status_code == 307
+    assert "Signature=" in res.headers["location"]
+    assert res.headers["cache-control"] == storage.redirect_cache_control("images/cat_0.jpg")
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session
+
+from config import UDIO_POLL_MAX, UDIO_POLL_MIN
+from jobs import POLLING, Job, get_job, lease_due_tasks, schedule_poll
+from udio_module import next_poll_delay
+
+
+@pytest.mark.parametrize("elapsed", [0, 10, 50, 100, 150, 200, 400, 1000, 10_000])
+def test_next_poll_delay_stays_within_bounds(elapsed):
+    assert UDIO_POLL_MIN <= next_poll_delay(elapsed, expected=100) <= UDIO_POLL_MAX
+
+
+def test_next_poll_delay_is_sparse_early_then_dense_then_backs_off():
+    expected = 100
+    early = next_poll_delay(0, expected)
+    around = [next_poll_delay(t, expected) for t in (70, 100, 149)]
+    late = [next_poll_delay(t, expected) for t in (150, 300, 600)]
+    assert early == min(UDIO_POLL_MAX, 0.7 * expected)
+    assert around == [UDIO_POLL_MIN] * 3
+    assert late == sorted(late) and late[-1] > UDIO_POLL_MIN
+
+
+@pytest.mark.parametrize("elapsed", [0, 20, 50, 65])
+def test_next_poll_delay_never_skips_past_the_dense_window(elapsed):
+    # Early checks land at 70% of the expected duration at the latest
+    assert elapsed + next_poll_delay(elapsed, expected=100) <= 70
+
+
+def _polling_job(db, due_in: float) -> str:
+    with Session(db) as s:
+        job = Job(
+            kind="music",
+            status=POLLING,
+            task_id="t",
+            task_submitted_at=datetime.utcnow(),
+            next_poll_at=datetime.utcnow() + timedelta(seconds=due_in),
+        )
+        s.add(job)
+        s.commit()
+        return job.id
+
+
+def test_lease_claims_due_jobs_only(db):
+    due = [_polling_job(db, -10), _polling_job(db, -5)]
+    _polling_job(db, 60)
+
+    leased = lease_due_tasks(10, lease=180)
+    assert [j.id for j in leased] == due  # most overdue first
+    assert all(j.polls == 1 for j in leased)
+    assert all(j.next_poll_at > datetime.utcnow() + timedelta(seconds=170) for j in leased)
+
+
+def test_lease_respects_limit_and_is_exclusive(db):
+    ids = [_polling_job(db, -i) for i in (3, 2, 1)]
+    first = lease_due_tasks(2, lease=180)
+    second = lease_due_tasks(2, lease=180)
+    assert [j.id for j in first] == ids[:2]
+    assert [j.id for j in second] == ids[2:]
+    assert lease_due_tasks(2, lease=180) == []
+
+
+def test_lapsed_lease_is_claimed_again(db):
+    job_id = _polling_job(db, -1)
+    assert len(lease_due_tasks(1, lease=-1)) == 1  # the poller died at once
+    again = lease_due_tasks(1, lease=180)
+    assert [j.id for j in again] == [job_id]
+    assert again[0].polls == 2
+
+
+def test_schedule_poll_replaces_the_lease(db):
+    job_id = _polling_job(db, -1)
+    lease_due_tasks(1, lease=180)
+    schedule_poll(job_id, -1)
+    assert [j.id for j in lease_due_tasks(1, lease=180)] == [job_id]
+
+
+def test_schedule_poll_ignores_finished_jobs(db):
+    job_id = _polling_job(db, -1)
+    with Session(db) as s:
+        s.get(Job, job_id).status = "done"
+        s.commit()
+    schedule_poll(job_id, 5)
+    assert get_job(job_id).next_poll_at < datetime.utcnow()
@@ -0,0 +1,271 @@
+"""
+Per-run trace timelines.
+
+A ``trace`` is opened around a unit of work for one run (the ``/generate``
+request, a music job, one Udio status check) and ``span``s nest inside it
+through context variables, across ``await`` and ``asyncio.to_thread``.
+Finished spans are kept in the ``Trace`` and appended to ``trace.jsonl`` in
+the run folder in one write when it closes (off the event loop for
+``atrace``); appends are atomic, so the web server, job workers and the
+poller share the file, like ``events.jsonl``. ``trace.json``, the nested
+timeline, is assembled from it when ``/runs/{folder}/trace`` asks for it.
+Outside a trace, ``span`` costs one context variable lookup.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from html import escape
+from pathlib import Path
+from uuid import uuid4
+
+SPANS_FILE = "trace.jsonl"
+TRACE_FILE = "trace.json"
+
+
+class Trace:
+    def __init__(self, run_dir: Path | None = None):
+        self.run_dir = Path(run_dir) if run_dir is not None else None
+        self.spans: list[dict] = []  # finished, not yet written
+        self.closed = False
+
+    def bind(self, run_dir: Path) -> None:
+        """Attach the run folder (e.g. once ``/generate`` has created it)."""
+        self.run_dir = Path(run_dir)
+
+    def record(self, rec: dict) -> None:
+        self.spans.append(rec)
+        if self.closed:
+            self.flush()  # a span that outlived its trace
+
+    def flush(self) -> None:
+        """Append the buffered spans to ``trace.jsonl`` in one write."""
+        if self.run_dir is None or not self.spans:
+            return
+        spans, self.spans = self.spans, []
+        data = "".join(json.dumps(rec, ensure_ascii=False, default=str) + "\n" for rec in spans)
+        try:
+            with open(self.run_dir / SPANS_FILE, "a", encoding="utf-8") as f:
+                f.write(data)
+        except OSError as e:
+            print(f"Could not record {len(spans)} spans: {e}")
+
+
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+_span: ContextVar[dict | None] = ContextVar("span", default=None)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time the block as a child of the current span. Yields the span's
+    attribute dict, so callers can add sizes and counts as they learn them.
+    """
+    tr = _trace.get()
+    if tr is None:
+        yield attrs
+        return
+    parent = _span.get()
+    rec = {
+        "id": uuid4().hex[:12],
+        "parent": parent["id"] if parent else None,
+        "name": name,
+        "pid": os.getpid(),
+        "start": time.time(),
+        "attrs": attrs,
+    }
+    token = _span.set(rec)
+    t0 = time.perf_counter()
+    rec["status"] = "error"
+    try:
+        yield attrs
+        rec["status"] = "ok"
+    except BaseException as e:
+        rec["error"] = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        rec["duration"] = time.perf_counter() - t0
+        rec["end"] = rec["start"] + rec["duration"]
+        _span.reset(token)
+        tr.record(rec)
+
+
+def traced(name: str):
+    """Decorator form of ``span`` for sync and async functions."""
+    def wrap(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+@contextmanager
+def _root(name: str, run_dir: Path | None, attrs: dict):
+    tr = Trace(run_dir)
+    token = _trace.set(tr)
+    span_token = _span.set(None)
+    try:
+        with span(name, **attrs):
+            yield tr
+    finally:
+        _span.reset(span_token)
+        _trace.reset(token)
+        tr.closed = True
+
+
+@contextmanager
+def trace(name: str, run_dir: Path | None = None, **attrs):
+    """
+    Root span of a unit of work for one run; yields the ``Trace`` (call
+    ``bind`` if the run folder is created inside the block). The spans are
+    written when the block exits.
+    """
+    try:
+        with _root(name, run_dir, attrs) as tr:
+            yield tr
+    finally:
+        tr.flush()
+
+
+@asynccontextmanager
+async def atrace(name: str, run_dir: Path | None = None, **attrs):
+    """``trace`` for coroutines: the spans are written off the event loop."""
+    try:
+        with _root(name, run_dir, attrs) as tr:
+            yield tr
+    finally:
+        await asyncio.to_thread(tr.flush)
+
+
+def annotate(**attrs) -> None:
+    """Set attributes on the current span (no-op outside a trace)."""
+    cur = _span.get()
+    if cur is not None:
+        cur["attrs"].update(attrs)
+
+
+def count(key: str, n: int = 1) -> None:
+    """Add ``n`` to a counter attribute (e.g. ``retries``) of the current span."""
+    cur = _span.get()
+    if cur is not None:
+        cur["attrs"][key] = cur["attrs"].get(key, 0) + n
+
+
+# ---- Reading ----
+
+def load_spans(run_dir: Path) -> list[dict]:
+    fp = Path(run_dir) / SPANS_FILE
+    if not fp.exists():
+        return []
+    spans = []
+    with open(fp, encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue  # a line still being appended
+    return spans
+
+
+def assemble(spans: list[dict]) -> dict:
+    """Nest spans under their parents; roots and children in start order, times relative to the first."""
+    if not spans:
+        return {"start": None, "duration": 0.0, "spans": []}
+    t0 = min(s["start"] for s in spans)
+    by_id = {s["id"]: {**s, "offset": s["start"] - t0, "children": []} for s in spans}
+    roots = []
+    for s in sorted(by_id.values(), key=lambda s: s["start"]):
+        parent = by_id.get(s["parent"])
+        (parent["children"] if parent else roots).append(s)
+    return {
+        "start": t0,
+        "duration": max(s["end"] for s in spans) - t0,
+        "spans": roots,
+    }
+
+
+def write_trace(run_dir: Path, tr: dict) -> None:
+    run_dir = Path(run_dir)
+    data = json.dumps(tr, ensure_ascii=False, indent=1, default=str)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=run_dir, prefix=".trace-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, run_dir / TRACE_FILE)
+    except OSError as e:
+        print(f"Could not write {run_dir / TRACE_FILE}: {e}")
+
+
+def load_trace(run_dir: Path) -> dict:
+    """The run's nested timeline: ``trace.json``, rebuilt first if spans were added since."""
+    run_dir = Path(run_dir)
+    spans_fp, trace_fp = run_dir / SPANS_FILE, run_dir / TRACE_FILE
+    try:
+        if trace_fp.stat().st_mtime_ns > spans_fp.stat().st_mtime_ns:
+            with open(trace_fp, encoding="utf-8") as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    tr = assemble(load_spans(run_dir))
+    if spans_fp.exists():
+        write_trace(run_dir, tr)
+    return tr
+
+
+def _flatten(spans: list[dict], depth: int = 0):
+    for s in spans:
+        yield depth, s
+        yield from _flatten(s["children"], depth + 1)
+
+
+def waterfall_html(run_dir: Path, title: str) -> str:
+    """Self-contained HTML waterfall of a run's spans."""
+    tr = load_trace(run_dir)
+    total = tr["duration"] or 1.0
+    rows = []
+    for depth, s in _flatten(tr["spans"]):
+        left = 100 * s["offset"] / total
+        width = max(0.2, 100 * s["duration"] / total)
+        attrs = ", ".join(f"{k}={v}" for k, v in s["attrs"].items())
+        tip = escape(f"{s['name']} {s['duration']:.3f}s {attrs} {s.get('error', '')}".strip())
+        cls = "err" if s["status"] != "ok" else ""
+        rows.append(
+            f'<tr title="{tip}"><td style="padding-left:{depth * 14 + 4}px">{escape(s["name"])}</td>'
+            f'<td class="num">{s["offset"]:.2f}s</td><td class="num">{s["duration"]:.2f}s</td>'
+            f'<td class="lane"><div class="bar {cls}" style="left:{left:.2f}%;width:{width:.2f}%"></div></td>'
+            f'<td class="attrs">{escape(attrs)}</td></tr>'
+        )
+    return f"""<!doctype html>
+<html><head><meta charset="utf-8"><title>trace {escape(title)}</title>
+<style>
+body {{ font: 13px system-ui, sans-serif; margin: 16px; }}
+table {{ border-collapse: collapse; width: 100%; }}
+td {{ padding: 2px 6px; border-bottom: 1px solid #eee; white-space: nowrap; }}
+.num {{ text-align: right; color: #555; }}
+.lane {{ position: relative; width: 55%; }}
+.bar {{ position: absolute; top: 4px; height: 12px; background: #4a90d9; border-radius: 2px; }}
+.bar.err {{ background: #d9534f; }}
+.attrs {{ color: #777; font-size: 11px; }}
+</style></head><body>
+<h3>{escape(title)} &mdash; {tr["duration"]:.2f}s, {sum(1 for _ in _flatten(tr["spans"]))} spans</h3>
+<table><tr><th>span</th><th>start</th><th>took</th><th></th><th></th></tr>
+{"".join(rows)}
+</table></body></html>
+"""
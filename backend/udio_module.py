@@ -1,9 +1,26 @@
 import re
+import asyncio
+import os
 import shutil
+import tempfile
+import threading
 import time
-import requests
 from pathlib import Path
-from config import TEST_MODE, PIAPI_KEY
+from config import (
+    TEST_MODE,
+    PIAPI_KEY,
+    UDIO_EXPECTED_SECONDS,
+    UDIO_POLL_MIN,
+    UDIO_POLL_MAX,
+    UDIO_TASK_TIMEOUT,
+)
+from run_events import emit
+from asset_cache import write_text_asset
+from audio_formats import atranscode, delivery_path, transcode
+import http_client
+import metrics
+import storage
+import tracing
 
 def extract_prompt_and_lyrics(output, lang="en"):
     """Return (prompt, lyrics) parsed from raw model output."""
@@ -56,28 +73,101 @@ def extract_prompt_and_lyrics(output, lang="en"):
     return prompt, lyrics
 
 
-def run_inference(assistant_reply: str, out_dir: Path, *, use_mock: bool = TEST_MODE) -> str:
-    """
-    Generate music using the Udio model via PiAPI.
+TASK_URL = "https://api.piapi.ai/api/v1/task"
+CHUNK_SIZE = 256 * 1024
 
-    Writes ``lyrics.lrc`` (plain text) and ``audio.wav`` into ``out_dir`` and
-    returns the path to the audio file.
+
+def next_poll_delay(elapsed: float, expected: float = UDIO_EXPECTED_SECONDS) -> float:
     """
-    if use_mock:
-        # ==== MOCK MODE ====
-        prompt, lyrics = extract_prompt_and_lyrics(assistant_reply)
-        (out_dir / "lyrics.lrc").write_text(lyrics, encoding="utf-8")
+    Seconds until the next status check of a task submitted ``elapsed``
+    seconds ago: sparse early on, every ``UDIO_POLL_MIN`` around the expected
+    finish, then backing off towards ``UDIO_POLL_MAX``.
+    """
+    if elapsed < 0.7 * expected:
+        return min(UDIO_POLL_MAX, max(UDIO_POLL_MIN, 0.7 * expected - elapsed))
+    if elapsed < 1.5 * expected:
+        return UDIO_POLL_MIN
+    return min(UDIO_POLL_MAX, UDIO_POLL_MIN + 0.1 * (elapsed - 1.5 * expected))
 
-        mock_wav_path = Path(__file__).parent / "mock_data" / "mock_audio.wav"
-        fake_wav = out_dir / "audio.wav"
-        shutil.copy(mock_wav_path, fake_wav)
-        return str(fake_wav)
 
-    # ==== REAL MODE ====
+def _write_lyrics(assistant_reply: str, out_dir: Path):
     prompt, lyrics = extract_prompt_and_lyrics(assistant_reply)
-    (out_dir / "lyrics.lrc").write_text(lyrics, encoding="utf-8")
+    storage.publish(*write_text_asset(out_dir / "lyrics.lrc", lyrics))
+    emit(out_dir, "lyrics", "ready")
+    return prompt, lyrics
+
+
+# Compressed copies are encoded after the WAV is announced; "ready" waits only
+# for the song itself, and fetch serves the WAV until a copy exists.
+_encodes: set[asyncio.Task] = set()
+
+
+def _mirror_encodes(wav: Path, paths: list[Path]) -> None:
+    """Coalesced runs that already got the WAV get its compressed copies too."""
+    from jobs import mirror_encodes  # jobs imports this module
+
+    if paths:
+        mirror_encodes(wav, paths)
+
+
+def _encode_audio(wav: Path) -> None:
+    """Transcode an announced song and publish its compressed copies."""
+    with tracing.trace("encode_audio", wav.parent):
+        try:
+            with tracing.span("transcode"):
+                formats = transcode(wav)
+            paths = [delivery_path(wav, f) for f in formats]
+            with tracing.span("publish"):
+                storage.publish(*paths)
+            _mirror_encodes(wav, paths)
+        except Exception as e:
+            print(f"Encoding {wav} failed: {e}")
+
 
-    payload = {
+async def _aencode_audio(wav: Path) -> None:
+    """Async ``_encode_audio``."""
+    async with tracing.atrace("encode_audio", wav.parent):
+        try:
+            with tracing.span("transcode"):
+                formats = await atranscode(wav)
+            paths = [delivery_path(wav, f) for f in formats]
+            with tracing.span("publish"):
+                await asyncio.to_thread(storage.publish, *paths)
+            await asyncio.to_thread(_mirror_encodes, wav, paths)
+        except Exception as e:
+            print(f"Encoding {wav} failed: {e}")
+
+
+def _announce_audio(wav: Path) -> None:
+    """Publish the WAV, emit ``audio ready`` and encode the compressed copies in a thread."""
+    with tracing.span("publish"):
+        storage.publish(wav)
+    emit(wav.parent, "audio", "ready")
+    # Not a daemon: a worker process finishes its encodes before it exits
+    threading.Thread(target=_encode_audio, args=(wav,), name="encode-audio").start()
+
+
+async def _aannounce_audio(wav: Path) -> None:
+    """Async ``_announce_audio``; the encode is a task on the running loop."""
+    with tracing.span("publish"):
+        await asyncio.to_thread(storage.publish, wav)
+    emit(wav.parent, "audio", "ready")
+    task = asyncio.create_task(_aencode_audio(wav))
+    _encodes.add(task)
+    task.add_done_callback(_encodes.discard)
+
+
+@tracing.traced("mock_audio")
+def _mock_audio(out_dir: Path) -> str:
+    mock_wav_path = Path(__file__).parent / "mock_data" / "mock_audio.wav"
+    fake_wav = out_dir / "audio.wav"
+    shutil.copy(mock_wav_path, fake_wav)
+    _announce_audio(fake_wav)
+    return str(fake_wav)
+
+
+def _task_payload(prompt: str, lyrics: str) -> dict:
+    return {
         "model": "music-u",
         "task_type": "generate_music",
         "input": {
@@ -87,61 +177,166 @@ def run_inference(assistant_reply: str, out_dir: Path, *, use_mock: bool = TEST_
         },
         "config": {},
     }
-    headers = {"X-API-Key": PIAPI_KEY}
 
-    res = requests.post(
-        "https://api.piapi.ai/api/v1/task",
-        json=payload,
-        headers=headers,
-        timeout=120,
-    )
-    res.raise_for_status()
-    resp_data = res.json()
+
+def _task_id(resp_data: dict) -> str:
     task_id = resp_data.get("data", {}).get("task_id") or resp_data.get("task_id")
     if not task_id:
         raise RuntimeError("No task_id returned from Udio API")
+    return task_id
+
+
+def _task_status(stat_data: dict) -> str:
+    return stat_data.get("data", {}).get("status") or stat_data.get("status")
+
+
+def _audio_url(stat_data: dict) -> str:
+    """Audio URL of a completed task, across the response formats PiAPI has used."""
+    # NEW: Check audio inside songs[]
+    songs = stat_data.get("data", {}).get("output", {}).get("songs", [])
+    for song in songs:
+        if song.get("song_path"):
+            return song["song_path"]
+
+    # FALLBACK: Previous formats
+    audio_url = (
+        stat_data.get("data", {}).get("output", {}).get("audio_url")
+        or stat_data.get("data", {}).get("outputs", [{}])[0].get("url")
+        or stat_data.get("data", {}).get("works", [{}])[0].get("resource", {}).get("resource")
+        or stat_data.get("output", {}).get("audio_url")
+        or stat_data.get("outputs", [{}])[0].get("url")
+        or stat_data.get("works", [{}])[0].get("resource", {}).get("resource")
+    )
+    if not audio_url:
+        raise RuntimeError("No audio URL found in completed task")
+    return audio_url
+
 
-    for _ in range(75):
-        stat_res = requests.get(
-            f"https://api.piapi.ai/api/v1/task/{task_id}",
-            headers=headers,
-            timeout=60,
+@metrics.timed("udio_download")
+def _download_audio(url: str, out_dir: Path) -> str:
+    """Stream the song to ``audio.wav`` in chunks, then add the compressed copies."""
+    audio_path = out_dir / "audio.wav"
+    fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=".audio-")
+    try:
+        with os.fdopen(fd, "wb") as f, http_client.stream("GET", url, timeout=120) as res:
+            res.raise_for_status()
+            for chunk in res.iter_bytes(CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp, audio_path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    tracing.annotate(bytes=audio_path.stat().st_size)
+    _announce_audio(audio_path)
+    return str(audio_path)
+
+
+@metrics.timed("udio_download")
+async def _adownload_audio(url: str, out_dir: Path) -> str:
+    """Async ``_download_audio``."""
+    audio_path = out_dir / "audio.wav"
+    fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=".audio-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async with http_client.astream("GET", url, timeout=120) as res:
+                res.raise_for_status()
+                async for chunk in res.aiter_bytes(CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(tmp, audio_path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    tracing.annotate(bytes=audio_path.stat().st_size)
+    await _aannounce_audio(audio_path)
+    return str(audio_path)
+
+
+def _headers() -> dict:
+    return {"X-API-Key": PIAPI_KEY}
+
+
+def submit_inference(assistant_reply: str, out_dir: Path, *, use_mock: bool = TEST_MODE) -> str | None:
+    """
+    Write ``lyrics.lrc`` and start a PiAPI task; return its task id. In mock
+    mode the audio is written straight away and ``None`` is returned.
+    """
+    prompt, lyrics = _write_lyrics(assistant_reply, out_dir)
+    if use_mock:
+        _mock_audio(out_dir)
+        return None
+    with metrics.timer("udio_submit"):
+        res = http_client.post(
+            TASK_URL,
+            json=_task_payload(prompt, lyrics),
+            headers=_headers(),
+            timeout=120,
         )
-        stat_res.raise_for_status()
-        stat_data = stat_res.json()
-        status = stat_data.get("data", {}).get("status") or stat_data.get("status")
-        # print("📄 Udio poll status data:", stat_data)
+        res.raise_for_status()
+        return _task_id(res.json())
+
+
+def run_inference(assistant_reply: str, out_dir: Path, *, use_mock: bool = TEST_MODE) -> str:
+    """
+    Generate music using the Udio model via PiAPI.
+
+    Writes ``lyrics.lrc`` (plain text) and ``audio.wav`` into ``out_dir`` and
+    returns the path to the audio file.
+    """
+    task_id = submit_inference(assistant_reply, out_dir, use_mock=use_mock)
+    if task_id is None:
+        return str(out_dir / "audio.wav")
+
+    started = time.monotonic()
+    while time.monotonic() - started < UDIO_TASK_TIMEOUT:
+        time.sleep(next_poll_delay(time.monotonic() - started))
+        with metrics.timer("udio_poll"):
+            stat_res = http_client.get(f"{TASK_URL}/{task_id}", headers=_headers(), timeout=60)
+            stat_res.raise_for_status()
+            stat_data = stat_res.json()
+        status = _task_status(stat_data)
+        if status == "completed":
+            return _download_audio(_audio_url(stat_data), out_dir)
+        if status in {"failed", "error"}:
+            raise RuntimeError(f"Udio task failed: {status}")
+    raise TimeoutError("Udio API timed out")
+
+
+@metrics.timed("udio_poll")
+async def apoll_task(task_id: str) -> dict:
+    """One status check of a PiAPI task; returns the raw status payload."""
+    stat_res = await http_client.aget(f"{TASK_URL}/{task_id}", headers=_headers(), timeout=60)
+    stat_res.raise_for_status()
+    return stat_res.json()
+
+
+async def afinish_task(stat_data: dict, out_dir: Path) -> str:
+    """Download the audio of a completed task into ``out_dir``."""
+    return await _adownload_audio(_audio_url(stat_data), out_dir)
+
+
+async def arun_inference(assistant_reply: str, out_dir: Path, *, use_mock: bool = TEST_MODE) -> str:
+    """Async ``run_inference``: polls PiAPI without holding a thread."""
+    prompt, lyrics = await asyncio.to_thread(_write_lyrics, assistant_reply, out_dir)
+    if use_mock:
+        return await asyncio.to_thread(_mock_audio, out_dir)
+
+    with metrics.timer("udio_submit"):
+        res = await http_client.apost(
+            TASK_URL,
+            json=_task_payload(prompt, lyrics),
+            headers=_headers(),
+            timeout=120,
+        )
+        res.raise_for_status()
+        task_id = _task_id(res.json())
+
+    started = time.monotonic()
+    while time.monotonic() - started < UDIO_TASK_TIMEOUT:
+        await asyncio.sleep(next_poll_delay(time.monotonic() - started))
+        stat_data = await apoll_task(task_id)
+        status = _task_status(stat_data)
         if status == "completed":
-            # NEW: Check audio inside songs[]
-            songs = stat_data.get("data", {}).get("output", {}).get("songs", [])
-            for song in songs:
-                audio_url = song.get("song_path")
-                if audio_url:
-                    wav_res = requests.get(audio_url, timeout=120)
-                    wav_res.raise_for_status()
-                    audio_path = out_dir / "audio.wav"
-                    audio_path.write_bytes(wav_res.content)
-                    return str(audio_path)
-
-            # FALLBACK: Previous formats
-            audio_url = (
-                stat_data.get("data", {}).get("output", {}).get("audio_url")
-                or stat_data.get("data", {}).get("outputs", [{}])[0].get("url")
-                or stat_data.get("data", {}).get("works", [{}])[0].get("resource", {}).get("resource")
-                or stat_data.get("output", {}).get("audio_url")
-                or stat_data.get("outputs", [{}])[0].get("url")
-                or stat_data.get("works", [{}])[0].get("resource", {}).get("resource")
-            )
-
-            if audio_url:
-                wav_res = requests.get(audio_url, timeout=120)
-                wav_res.raise_for_status()
-                audio_path = out_dir / "audio.wav"
-                audio_path.write_bytes(wav_res.content)
-                return str(audio_path)
-
-            raise RuntimeError("No audio URL found in completed task")
+            return await afinish_task(stat_data, out_dir)
         if status in {"failed", "error"}:
             raise RuntimeError(f"Udio task failed: {status}")
-        time.sleep(5)
     raise TimeoutError("Udio API timed out")
@@ -0,0 +1,99 @@
+"""
+Shared poller for submitted Udio (PiAPI) tasks.
+
+One process watches every job parked as ``polling``: each tick it leases the
+jobs whose next check is due (database calls run in threads, off the loop), checks their tasks concurrently over the shared
+async HTTP client (PiAPI has no batch status endpoint, so a batch is one
+multiplexed round of GETs) and either finishes the job or schedules the next
+check with ``next_poll_delay``. The expected task duration is learned from
+completed tasks, so checks cluster around when songs actually finish.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from datetime import datetime
+
+import metrics
+import tracing
+from config import UDIO_EXPECTED_SECONDS, UDIO_POLL_BATCH, UDIO_TASK_TIMEOUT
+from jobs import Job, OUTPUT_ROOT, complete_job, fail_job, lease_due_tasks, schedule_poll
+from log_db import engine
+from udio_module import _mock_audio, _task_status, afinish_task, apoll_task, next_poll_delay
+
+TICK = 1.0
+LEASE_SECONDS = 180  # covers a status check plus the audio download
+
+
+class Poller:
+    def __init__(self):
+        self.expected = UDIO_EXPECTED_SECONDS
+        self.inflight: set[asyncio.Task] = set()
+
+    def _learn(self, duration: float) -> None:
+        # EWMA of observed task durations
+        self.expected = 0.8 * self.expected + 0.2 * duration
+
+    async def check(self, job: Job) -> None:
+        run_dir = OUTPUT_ROOT / job.folder
+        elapsed = (datetime.utcnow() - job.task_submitted_at).total_seconds()
+        try:
+            async with tracing.atrace("udio_check", run_dir, task_id=job.task_id, check=job.polls):
+                stat_data = await apoll_task(job.task_id)
+                status = _task_status(stat_data)
+                tracing.annotate(status=status, elapsed=round(elapsed, 1))
+                if status == "completed":
+                    await afinish_task(stat_data, run_dir)
+        except Exception as e:
+            # Network errors, 5xx after retries, audio not downloadable yet: check again later
+            print(f"Udio poll for {job.task_id} failed: {e}")
+            status = None
+
+        if status == "completed":
+            self._learn(elapsed)
+            metrics.observe("stage_seconds", elapsed, stage="udio_task", outcome="ok")
+            print(f"🎵 Udio task {job.task_id} done after {elapsed:.0f}s ({job.polls} checks)")
+            await asyncio.to_thread(complete_job, job)
+        elif status in {"failed", "error"}:
+            await self.task_failed(job, f"Udio task failed: {status}")
+        elif elapsed > UDIO_TASK_TIMEOUT:
+            await self.task_failed(job, "Udio API timed out")
+        else:
+            await asyncio.to_thread(schedule_poll, job.id, next_poll_delay(elapsed, self.expected))
+
+    async def task_failed(self, job: Job, error: str) -> None:
+        if job.kind == "music":
+            # Same fallback as generate_music_from_image when Udio fails
+            print(f"Udio failed: {error}; using mock audio")
+            metrics.mock_fallback("udio")
+            await asyncio.to_thread(_mock_audio, OUTPUT_ROOT / job.folder)
+            await asyncio.to_thread(complete_job, job)
+        else:
+            await asyncio.to_thread(fail_job, job, error)
+
+    async def tick(self) -> None:
+        room = UDIO_POLL_BATCH - len(self.inflight)
+        if room <= 0:
+            return
+        for job in await asyncio.to_thread(lease_due_tasks, room, LEASE_SECONDS):
+            t = asyncio.create_task(self.check(job))
+            self.inflight.add(t)
+            t.add_done_callback(self.inflight.discard)
+
+    async def run(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Udio poller tick failed: {e}")
+            await asyncio.sleep(max(0.0, TICK - (time.monotonic() - started)))
+
+
+def poller_loop() -> None:
+    # Never share pooled connections inherited from the parent process.
+    engine.dispose()
+    print(f"🛰️ udio poller started (pid {os.getpid()})")
+    metrics.start_exporter("poller")
+    asyncio.run(Poller().run())
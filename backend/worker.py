@@ -0,0 +1,5 @@
+"""Standalone job worker pool: ``python worker.py`` (set JOB_WORKERS=0 on the web service)."""
+from jobs import run_pool
+
+if __name__ == "__main__":
+    run_pool()
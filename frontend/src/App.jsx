@@ -10,6 +10,21 @@ const BACKEND_URL =
     ? ""
     : "https://omniwizz.onrender.com";
 
+// Compressed copy of audio.wav this browser can play; the backend falls back to WAV.
+const AUDIO_FORMAT = (() => {
+  if (typeof document === "undefined") return "";
+  const a = document.createElement("audio");
+  if (a.canPlayType('audio/ogg; codecs="opus"')) return "opus";
+  if (a.canPlayType('audio/mp4; codecs="mp4a.40.2"')) return "aac";
+  if (a.canPlayType("audio/mpeg")) return "mp3";
+  return "";
+})();
+
+function withAudioFormat(url) {
+  if (!url || !AUDIO_FORMAT) return url;
+  return `${url}${url.includes("?") ? "&" : "?"}format=${AUDIO_FORMAT}`;
+}
+
 function withBase(path) {
   if (!path) return path;
   try {
@@ -83,6 +98,7 @@ export default function App() {
   const [regenLoading, setRegenLoading] = useState(false);
   const [pendingPrompt, setPendingPrompt] = useState(false);
   const [pendingLyrics, setPendingLyrics] = useState(false);
+  const [eventsSince, setEventsSince] = useState(null);
 
   const captureAndGenerate = () => {
     const art = document.querySelector(".artboard");
@@ -229,6 +245,7 @@ export default function App() {
         setAudioUrl(withBase(j.music.audio_url));
         setPendingMusic(!!j.music.pending);
         setRunFolder(j.music.folder || "");
+        setEventsSince(0);
         setPendingPrompt(true);
         setPendingLyrics(true);
         try {
@@ -303,6 +320,7 @@ export default function App() {
     }
     if (!runFolder) return;
     log("regenerate_click", { folder: runFolder });
+    setEventsSince(null);
     setRegenLoading(true);
     setPendingMusic(true);
     if (audioRef.current) {
@@ -321,6 +339,7 @@ export default function App() {
       if (j.audio_url) {
         setAudioUrl(withBase(j.audio_url) + `?t=${Date.now()}`);
       }
+      setEventsSince(j.events_since ?? 0);
     } catch (err) {
       console.error("Regenerate failed:", err);
     } finally {
@@ -397,52 +416,46 @@ export default function App() {
   }, [stage, imagePositions, tagPositions]);
 
   useEffect(() => {
-    if (!pendingMusic || !audioUrl) return;
-    const id = setInterval(async () => {
+    if (!runFolder || !pendingMusic || eventsSince === null) return;
+    const es = new EventSource(`${BACKEND_URL}/runs/${runFolder}/events?since=${eventsSince}`);
+
+    const loadText = async (name, modifiedRef, origRef, setText, setPending) => {
       try {
-        const resp = await fetch(audioUrl, { cache: "no-store" });
-        if (resp.ok) {
-          setPendingMusic(false);
-          setAudioUrl(audioUrl + `?t=${Date.now()}`);
-          clearInterval(id);
+        const r = await fetch(`${BACKEND_URL}/output/${runFolder}/${name}`, { cache: "no-cache" });
+        if (r.ok && !modifiedRef.current) {
+          const txt = await r.text();
+          origRef.current = txt;
+          setText(txt);
         }
       } catch {}
-    }, 10000);
-    return () => clearInterval(id);
-  }, [pendingMusic, audioUrl]);
+      setPending(false);
+    };
 
-  useEffect(() => {
-    if (!runFolder || (!pendingPrompt && !pendingLyrics)) return;
-    const check = async () => {
-      if (pendingPrompt) {
-        try {
-          const r = await fetch(`${BACKEND_URL}/output/${runFolder}/prompt.txt`, { cache: "no-store" });
-          if (r.ok) {
-            const txt = await r.text();
-            origPromptRef.current = txt;
-            promptModifiedRef.current = false;
-            setPromptText(txt);
-            setPendingPrompt(false);
-          }
-        } catch {}
+    es.onmessage = (msg) => {
+      let ev;
+      try {
+        ev = JSON.parse(msg.data);
+      } catch {
+        return;
       }
-      if (pendingLyrics) {
-        try {
-          const r = await fetch(`${BACKEND_URL}/output/${runFolder}/lyrics.lrc`, { cache: "no-store" });
-          if (r.ok) {
-            const lyr = await r.text();
-            origLyricsRef.current = lyr;
-            lyricsModifiedRef.current = false;
-            setLyricsText(lyr);
-            setPendingLyrics(false);
-          }
-        } catch {}
+      if (ev.asset === "prompt" && ev.status === "ready") {
+        loadText("prompt.txt", promptModifiedRef, origPromptRef, setPromptText, setPendingPrompt);
+      } else if (ev.asset === "lyrics" && ev.status === "ready") {
+        loadText("lyrics.lrc", lyricsModifiedRef, origLyricsRef, setLyricsText, setPendingLyrics);
+      } else if (ev.asset === "audio" && ev.status === "ready") {
+        setAudioUrl((u) => `${u.split("?")[0]}?t=${Date.now()}`);
+        setPendingMusic(false);
+      } else if (ev.status === "failed" && (ev.asset === "audio" || ev.asset === "run")) {
+        setPendingMusic(false);
+        setPendingPrompt(false);
+        setPendingLyrics(false);
+      }
+      if (ev.asset === "run" && (ev.status === "done" || ev.status === "failed")) {
+        es.close();
       }
     };
-    check();
-    const id = setInterval(check, 5000);
-    return () => clearInterval(id);
-  }, [runFolder, pendingPrompt, pendingLyrics]);
+    return () => es.close();
+  }, [runFolder, pendingMusic, eventsSince]);
 
   const progress = duration ? currentTime / duration : 0;
   const theta    = -Math.PI / 2 + 2 * Math.PI * progress;
@@ -838,7 +851,7 @@ export default function App() {
               {audioUrl && (
                 <audio
                   ref={audioRef}
-                  src={audioUrl}
+                  src={withAudioFormat(audioUrl)}
                   onPlay={() => { setPlaying(true); log("audio_play"); }}
                   onPause={() => { setPlaying(false); log("audio_pause"); }}
                   onEnded={() => setPlaying(false)}
@@ -855,7 +868,8 @@ export default function App() {
               {imagePositions.map(({ x, y, rotation }, i) => (
                 <img
                   key={i}
-                  src={visibleImages[i]}
+                  src={visibleImages[i] && `${visibleImages[i]}?variant=thumb`}
+                  srcSet={visibleImages[i] && `${visibleImages[i]}?variant=medium 2x`}
                   alt=""
                   className="cloud-img"
                   draggable={false}